@@ -0,0 +1,50 @@
+# Email render micro-benchmark
+# Times the HTML and plain-text renderers on synthetic batches of listings.
+# Run from the repository root: python -m benchmarks.email_render
+
+import sys
+import random
+import timeit
+
+from email_renderer import render_html, render_text
+
+SIZES = (50, 500, 5000)
+TERMS = ('navy champion reverse weave', 'vintage black levi trucker', '80s north face puffer jacket', 'true vintage rayon shirt')
+
+
+def synthetic_listings(count, seed=0):
+    rng = random.Random(seed)
+    listings = []
+    for i in range(count):
+        platform = 'eBay' if i % 3 else 'Depop'
+        listing_id = str(rng.randrange(10 ** 11, 10 ** 12))
+        listings.append({
+            'listing_id': listing_id,
+            'platform': platform,
+            'title': f"Vintage {rng.choice(TERMS).title()} Sweatshirt Size {rng.choice('SMLX')} & More",
+            'price': f"${rng.randrange(20, 400)}.00",
+            'url': f"https://www.ebay.com/itm/{listing_id}?hash=item" if platform == 'eBay' else f"https://www.depop.com/products/seller-{listing_id}/",
+            'image_url': '' if i % 7 == 0 else f"//i.ebayimg.com/images/g/{listing_id}/s-l500.jpg",
+            'search_term': rng.choice(TERMS),
+        })
+    return listings
+
+
+def bench(renderer, listings, repeat=5):
+    runs = max(1, 2000 // len(listings))
+    best = min(timeit.repeat(lambda: renderer(listings), number=runs, repeat=repeat)) / runs
+    return best * 1000
+
+
+def main():
+    print(f"{'listings':>8} {'html ms':>10} {'text ms':>10} {'html us/listing':>16} {'html KB':>9}")
+    for size in SIZES:
+        listings = synthetic_listings(size)
+        html_ms = bench(render_html, listings)
+        text_ms = bench(render_text, listings)
+        print(f"{size:>8} {html_ms:>10.2f} {text_ms:>10.2f} {html_ms * 1000 / size:>16.1f} {len(render_html(listings)) / 1024:>9.0f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+# End-to-end load test
+# Runs full monitoring cycles against the local mock marketplace with the search
+# term list multiplied, reporting cycle time, search throughput and the slowest
+# stages. Nothing touches ebay.com, depop.com or a mail server.
+# Run from the repository root: python -m benchmarks.load_test [--multiplier 10] [--cycles 2]
+
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+from mock_marketplace import MockMarketplace
+
+# Suffixes turning each search term into distinct terms that still match their listings
+TERM_VARIANTS = ('', 'xl', 'large', 'medium', 'small', 'usa', 'faded', 'blank', 'rare', 'heavyweight')
+
+
+def expand_terms(terms, multiplier):
+    """multiplier distinct variants of every term (beyond len(TERM_VARIANTS), numbered)"""
+    expanded = []
+    for i in range(multiplier):
+        suffix = TERM_VARIANTS[i % len(TERM_VARIANTS)]
+        if i >= len(TERM_VARIANTS):
+            suffix = f"{suffix} lot{i // len(TERM_VARIANTS)}".strip()
+        expanded.extend(f"{term} {suffix}".strip() for term in terms)
+    return expanded
+
+
+class CountingDelivery:
+    """Stands in for EmailDelivery: accepts every message and counts it"""
+
+    def __init__(self):
+        self.messages = 0
+
+    def send_all(self, messages):
+        self.messages += len(messages)
+        return [True] * len(messages)
+
+    def close(self):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load-test whole monitoring cycles against mock_marketplace.py')
+    parser.add_argument('--multiplier', type=int, default=10, help='variants of every SEARCH_TERMS entry (default 10)')
+    parser.add_argument('--cycles', type=int, default=2, help='monitoring cycles to run (default 2)')
+    parser.add_argument('--pause', type=float, default=0, help='seconds between cycles, so new listings arrive')
+    parser.add_argument('--latency-ms', type=float, help='mock response latency (default MOCK_LATENCY_MS or 150)')
+    parser.add_argument('--arrivals-per-hour', type=float, help='new listings per term per hour (default MOCK_ARRIVALS_PER_HOUR or 6)')
+    parser.add_argument('--challenge-rate', type=float, help='share of searches answered with a challenge page')
+    parser.add_argument('--heavy-page-rate', type=float, help='share of HTML pages padded to MOCK_HEAVY_PAGE_MB')
+    parser.add_argument('--rate', type=float, default=0, help='requests per second the bot may send the mock (default unlimited)')
+    parser.add_argument('--shards', type=int, default=1, help='worker processes to spread the terms over (default 1 = no sharding)')
+    parser.add_argument('--verbose', action='store_true', help="show the bot's own log output")
+    args = parser.parse_args(argv)
+
+    marketplace = MockMarketplace(
+        latency_ms=args.latency_ms, arrivals_per_hour=args.arrivals_per_hour,
+        challenge_rate=args.challenge_rate, heavy_page_rate=args.heavy_page_rate
+    ).start()
+    os.environ.update(marketplace.env())
+    # Collapsing overlapping terms would hide most of the multiplied load
+    os.environ.setdefault('QUERY_PLANNING', 'off')
+    # The mock is not ebay.com or depop.com, so it falls under the default rate limit
+    os.environ['RATE_LIMIT_DEFAULT'] = str(args.rate)
+    os.environ['SHARD_WORKERS'] = str(args.shards)
+
+    # The bot keeps its database, log and caches in the working directory
+    workdir = tempfile.mkdtemp(prefix='rwscraper-load-')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        from main import VintageClothingMonitorBot, SEARCH_TERMS
+        from cycle_profiler import cycle_profiler
+        if not args.verbose:
+            logging.disable(logging.WARNING)
+
+        terms = expand_terms(SEARCH_TERMS, args.multiplier)
+        bot = VintageClothingMonitorBot()
+        bot.email_delivery.close()
+        bot.email_delivery = CountingDelivery()
+        print(f"Mock marketplace at {marketplace.url}; {len(terms)} terms ({len(SEARCH_TERMS)} x {args.multiplier})"
+              + (f" on {args.shards} worker processes" if args.shards > 1 else ""))
+        try:
+            for cycle in range(1, args.cycles + 1):
+                if cycle > 1 and args.pause:
+                    time.sleep(args.pause)
+                requests_before = dict(marketplace.stats)
+                emails_before = bot.email_delivery.messages
+                started = time.monotonic()
+                summary = bot.run_monitoring_cycle(terms) or {}
+                wall = time.monotonic() - started
+                served = {key: marketplace.stats[key] - requests_before[key] for key in marketplace.stats}
+
+                print(f"\nCycle {cycle}: {wall:.1f}s wall, {len(terms) / wall:.1f} terms/s")
+                print(f"  listings checked {summary.get('listings_checked', 0)}, new {summary.get('new_listings', 0)}, "
+                      f"emails {bot.email_delivery.messages - emails_before}")
+                print(f"  mock: {served['requests']} requests ({served['ebay_pages']} eBay pages, {served['depop_api']} Depop API, "
+                      f"{served['depop_pages']} Depop pages), {served['challenges']} challenges, {served['heavy_pages']} heavy pages")
+                print(f"  {'span':<28} {'calls':>6} {'total s':>9} {'mean ms':>9} {'max ms':>9}")
+                for span in cycle_profiler.report()['spans'][:8]:
+                    print(f"  {span['name']:<28} {span['count']:>6} {span['total_s']:>9.2f} {span['mean_ms']:>9.1f} {span['max_ms']:>9.1f}")
+        finally:
+            bot.close()
+    finally:
+        logging.disable(logging.NOTSET)
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+        marketplace.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
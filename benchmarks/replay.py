@@ -0,0 +1,226 @@
+# Offline replay benchmark
+# Replays saved eBay and Depop search pages from benchmarks/fixtures through the
+# extraction paths, the matcher, the dedup database and the email renderer, and
+# reports latency and throughput per stage. Nothing touches the network.
+# Run from the repository root: python -m benchmarks.replay [--runs N] [--browser]
+#
+# To refresh a fixture, save a live page over it: the eBay results HTML
+# (_sop=10), a Depop search API response, or the JSON inside a Depop search
+# page's <script id="__NEXT_DATA__"> tag.
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import statistics
+import time
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+EBAY_FIXTURE = ('ebay_search.html', 'vintage champion reverse weave')
+DEPOP_API_FIXTURE = ('depop_search.json', '80s north face puffer jacket')
+DEPOP_NEXT_DATA_FIXTURE = ('depop_next_data.json', 'vintage black levi trucker')
+
+EMAIL_BATCH = 50  # Listings per email, as sent by the outbox
+
+
+def load_fixture(name, binary=False):
+    with open(os.path.join(FIXTURES_DIR, name), 'rb' if binary else 'r', encoding=None if binary else 'utf-8') as f:
+        return f.read()
+
+
+def measure(func, runs):
+    """Run func runs times; returns (items per run, list of seconds per run)"""
+    func()  # Warm-up: imports, compiled term rules, page cache
+    durations = []
+    items = 0
+    for _ in range(runs):
+        started = time.perf_counter()
+        items = func()
+        durations.append(time.perf_counter() - started)
+    return items, durations
+
+
+def summarize(stage, items, durations):
+    durations = sorted(durations)
+    median = statistics.median(durations)
+    p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+    return {
+        'stage': stage,
+        'items': items,
+        'runs': len(durations),
+        'median_ms': round(median * 1000, 3),
+        'p95_ms': round(p95 * 1000, 3),
+        'us_per_item': round(median * 1e6 / items, 1) if items else None,
+        'items_per_s': round(items / median) if items and median else None,
+    }
+
+
+def scaled_batch(listings, size, tag):
+    """size copies of the parsed listings with unique IDs, so every one is new to the database"""
+    batch = []
+    for i in range(size):
+        listing = dict(listings[i % len(listings)])
+        listing['listing_id'] = f"{listing['listing_id']}{tag}{i}"
+        batch.append(listing)
+    return batch
+
+
+def start_headless_chrome():
+    """Headless Chrome from ./chromedriver or PATH; None when unavailable (never downloads a driver)"""
+    try:
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service
+    except ImportError:
+        return None, 'selenium not installed'
+    driver_path = './chromedriver' if os.path.exists('./chromedriver') else shutil.which('chromedriver')
+    if not driver_path:
+        return None, 'chromedriver not found'
+    options = webdriver.ChromeOptions()
+    for arg in ('--headless=new', '--no-sandbox', '--disable-dev-shm-usage', '--disable-gpu', '--blink-settings=imagesEnabled=false'):
+        options.add_argument(arg)
+    try:
+        return webdriver.Chrome(service=Service(driver_path), options=options), None
+    except Exception as e:
+        return None, f"Chrome failed to start: {e}"
+
+
+def run(runs=20, batch_size=1000, browser=False):
+    from ebay_scraper import EbayScraper
+    from depop_scraper import DepopScraper
+
+    ebay_page = load_fixture(EBAY_FIXTURE[0], binary=True)
+    depop_api = json.loads(load_fixture(DEPOP_API_FIXTURE[0]))
+    next_data = json.loads(load_fixture(DEPOP_NEXT_DATA_FIXTURE[0]))
+
+    results = []
+    skipped = {}
+    ebay = EbayScraper()
+    depop = DepopScraper()
+    parsed = {}
+
+    def ebay_parse():
+        parsed['ebay'], _ = ebay._parse_listings(ebay_page, EBAY_FIXTURE[1])
+        return len(parsed['ebay'])
+    results.append(summarize('ebay.parse_html', *measure(ebay_parse, runs)))
+
+    def depop_api_parse():
+        parsed['depop_api'] = depop._parse_api_response(depop_api, DEPOP_API_FIXTURE[1])
+        return len(parsed['depop_api'])
+    results.append(summarize('depop.parse_api', *measure(depop_api_parse, runs)))
+
+    try:
+        from depop_selenium_scraper import DepopSeleniumScraper
+        # The extractor only walks JSON; skip __init__ so no browser is started
+        depop_browser = DepopSeleniumScraper.__new__(DepopSeleniumScraper)
+
+        def depop_next_data():
+            parsed['depop_next'] = depop_browser._extract_products_from_json(next_data, DEPOP_NEXT_DATA_FIXTURE[1])
+            return len(parsed['depop_next'])
+        results.append(summarize('depop.parse_next_data', *measure(depop_next_data, runs)))
+    except ImportError as e:
+        skipped['depop.parse_next_data'] = str(e)
+
+    if browser:
+        driver, reason = start_headless_chrome()
+        if driver is None:
+            skipped['ebay.selenium_js'] = reason
+        else:
+            try:
+                from ebay_selenium_scraper import EbaySeleniumScraper
+                ebay_browser = EbaySeleniumScraper.__new__(EbaySeleniumScraper)
+                ebay_browser.driver = driver
+                driver.get('file://' + os.path.join(FIXTURES_DIR, EBAY_FIXTURE[0]))
+                results.append(summarize(
+                    'ebay.selenium_js',
+                    *measure(lambda: len(ebay_browser._extract_listings_selenium(EBAY_FIXTURE[1])), runs)
+                ))
+            finally:
+                driver.quit()
+    else:
+        skipped['ebay.selenium_js'] = 'pass --browser to run the JS extractor in headless Chrome'
+
+    listings = parsed['ebay'] + parsed['depop_api'] + parsed.get('depop_next', [])
+    if not listings:
+        raise RuntimeError("The fixtures produced no listings - check they match the extractors")
+
+    # The bot opens champion_listings.db and its log in the working directory
+    workdir = tempfile.mkdtemp(prefix='rwscraper-replay-')
+    cwd = os.getcwd()
+    os.environ.setdefault('INLINE_IMAGES', 'off')
+    os.environ.setdefault('QUERY_PLANNING', 'off')
+    os.chdir(workdir)
+    try:
+        from main import VintageClothingMonitorBot
+        bot = VintageClothingMonitorBot()
+        try:
+            titles = [listing['title'] for listing in listings]
+
+            def match_terms():
+                for title in titles:
+                    bot.matcher.match_terms(title)
+                return len(titles)
+            results.append(summarize('matcher.match_terms', *measure(match_terms, runs)))
+
+            # Fresh IDs every run, so each batch is all-new and takes the insert path
+            batches = iter([scaled_batch(listings, batch_size, f"n{run}x") for run in range(runs + 1)])
+
+            def record_new():
+                bot.record_new_listings(next(batches), notify=True)
+                return batch_size
+            results.append(summarize('db.record_new', *measure(record_new, runs)))
+
+            # The same IDs every run: answered by the seen filter / lookups, nothing inserted
+            repeat = scaled_batch(listings, batch_size, 'r')
+            bot.record_new_listings(repeat, notify=False)
+
+            def record_repeat():
+                bot.record_new_listings(repeat, notify=False)
+                return batch_size
+            results.append(summarize('db.record_repeat', *measure(record_repeat, runs)))
+
+            email_listings = scaled_batch(listings, EMAIL_BATCH, 'e')
+
+            def create_html():
+                bot.create_html_email(email_listings)
+                return EMAIL_BATCH
+            results.append(summarize('email.create_html', *measure(create_html, runs)))
+        finally:
+            bot.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return results, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay saved search pages through the scrape-to-email pipeline')
+    parser.add_argument('--runs', type=int, default=20, help='timed runs per stage (default 20)')
+    parser.add_argument('--batch', type=int, default=1000, help='listings per dedup batch (default 1000)')
+    parser.add_argument('--browser', action='store_true', help='also time the Selenium JS extractor on the eBay fixture via file://')
+    parser.add_argument('--json', action='store_true', help='print the results as one JSON object')
+    args = parser.parse_args(argv)
+
+    # Keep the bot's per-stage logging out of the table
+    import logging
+    logging.disable(logging.INFO)
+    results, skipped = run(args.runs, args.batch, args.browser)
+    logging.disable(logging.NOTSET)
+
+    if args.json:
+        print(json.dumps({'results': results, 'skipped': skipped}))
+        return 0
+    print(f"{'stage':<24} {'items':>6} {'median ms':>10} {'p95 ms':>9} {'us/item':>9} {'items/s':>10}")
+    for row in results:
+        us_per_item = f"{row['us_per_item']:.1f}" if row['us_per_item'] is not None else '-'
+        items_per_s = f"{row['items_per_s']:,}" if row['items_per_s'] is not None else '-'
+        print(f"{row['stage']:<24} {row['items']:>6} {row['median_ms']:>10.2f} {row['p95_ms']:>9.2f} {us_per_item:>9} {items_per_s:>10}")
+    for stage, reason in skipped.items():
+        print(f"{stage:<24} skipped: {reason}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
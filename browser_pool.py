@@ -0,0 +1,202 @@
+# Warm browser pool
+# Keeps Selenium scrapers alive across searches, cycles and the seeding path,
+# recycling tabs between searches and restarting Chrome only when it is unhealthy
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from scrape_scheduler import browser_budget
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _create_scraper(platform):
+    if platform == 'eBay':
+        from ebay_selenium_scraper import EbaySeleniumScraper
+        return EbaySeleniumScraper()
+    if platform == 'Depop':
+        from depop_selenium_scraper import DepopSeleniumScraper
+        return DepopSeleniumScraper()
+    raise ValueError(f"No Selenium scraper for platform {platform}")
+
+
+def recycle_tab(driver):
+    """Swap the working tab for a fresh one, releasing the old renderer's memory"""
+    old_handle = driver.current_window_handle
+    driver.switch_to.new_window('tab')
+    new_handle = driver.current_window_handle
+    driver.switch_to.window(old_handle)
+    driver.close()
+    driver.switch_to.window(new_handle)
+
+
+def driver_alive(driver):
+    """True if the browser still answers commands (no crashed tab or dead session)"""
+    if driver is None:
+        return False
+    try:
+        driver.execute_script('return 1')
+        return True
+    except Exception:
+        return False
+
+
+class BrowserPool:
+    """Long-lived Selenium scrapers leased out per platform
+
+    Browsers are started on first use and handed back idle after each lease
+    instead of being quit. Between searches only the tab is replaced; the
+    Chrome process is restarted when it stops responding or when
+    ``needs_restart(scraper)`` reports excessive memory growth. The pool never
+    keeps more browsers than the memory budget allows - an idle browser of
+    another platform is retired to make room, and with every browser leased
+    ``acquire`` waits for a release.
+    """
+
+    def __init__(self, max_browsers=None, factory=_create_scraper):
+        self.max_browsers = max_browsers if max_browsers is not None else browser_budget()
+        self.factory = factory
+        self.needs_restart = lambda scraper: False  # e.g. MemoryWatchdog.over_limit
+        self._idle = {}
+        self._leased = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)  # Notified whenever a lease ends
+        self.restarts = 0
+
+    def acquire(self, platform):
+        """Lease a warm, healthy scraper for ``platform``, waiting while the whole budget is leased"""
+        retire = None
+        with self._available:
+            waited = False
+            while True:
+                idle = self._idle.setdefault(platform, [])
+                scraper = idle.pop() if idle else None
+                if scraper is not None or self._total() < self.max_browsers:
+                    break
+                retire = self._pop_idle_other(platform)
+                if retire is not None:
+                    break
+                if not waited:
+                    logger.info(f"Browser pool: all {self.max_browsers} browser(s) leased - waiting for one ({platform})")
+                    waited = True
+                self._available.wait()
+            self._leased += 1
+
+        if retire is not None:
+            logger.info("Browser pool at capacity - retiring an idle browser of another platform")
+            self._quit(retire)
+
+        try:
+            if scraper is None:
+                start = time.monotonic()
+                scraper = self.factory(platform)
+                logger.info(f"Browser pool started a {platform} browser in {time.monotonic() - start:.1f}s")
+            elif not driver_alive(scraper.driver):
+                logger.warning(f"Pooled {platform} browser is unresponsive - restarting it")
+                self.restart(scraper)
+        except Exception:
+            with self._available:
+                self._leased -= 1
+                self._available.notify()
+            raise
+        return scraper
+
+    def release(self, platform, scraper):
+        """Return a scraper to the pool with a fresh tab, restarting it if unhealthy
+
+        A browser that would leave the pool over its budget (e.g. after
+        ``max_browsers`` was lowered) is quit instead of kept idle.
+        """
+        try:
+            if not driver_alive(scraper.driver) or self.needs_restart(scraper):
+                self.restart(scraper)
+            else:
+                self.recycle(scraper)
+        except Exception as e:
+            logger.warning(f"Could not recycle {platform} browser, quitting it: {e}")
+            self._quit(scraper)
+            scraper = None
+        surplus = None
+        with self._available:
+            self._leased -= 1
+            if scraper is not None and scraper.driver is not None:
+                if self._total() < self.max_browsers:
+                    self._idle.setdefault(platform, []).append(scraper)
+                else:
+                    surplus = scraper
+            self._available.notify()
+        if surplus is not None:
+            logger.info(f"Browser pool over its budget of {self.max_browsers} - quitting an idle {platform} browser")
+            self._quit(surplus)
+
+    @contextmanager
+    def lease(self, platform):
+        scraper = self.acquire(platform)
+        try:
+            yield scraper
+        finally:
+            self.release(platform, scraper)
+
+    def recycle(self, scraper):
+        """Replace the scraper's tab, falling back to a browser restart if that fails"""
+        if not driver_alive(scraper.driver):
+            self.restart(scraper)
+            return
+        try:
+            recycle_tab(scraper.driver)
+        except Exception as e:
+            logger.warning(f"Tab recycle failed ({e}) - restarting browser")
+            self.restart(scraper)
+
+    def restart(self, scraper):
+        """Restart the Chrome process behind a scraper"""
+        self.restarts += 1
+        metrics.driver_restarts.inc(platform=getattr(scraper, 'platform', 'unknown'))
+        try:
+            scraper.close()
+        except Exception as e:
+            logger.debug(f"Error closing browser before restart: {e}")
+        scraper.setup_driver()
+
+    def shutdown(self):
+        """Quit every idle browser (call when the bot exits)"""
+        with self._lock:
+            scrapers = [s for idle in self._idle.values() for s in idle]
+            self._idle = {}
+        for scraper in scrapers:
+            self._quit(scraper)
+        if scrapers:
+            logger.info(f"Browser pool shut down {len(scrapers)} browser(s)")
+
+    def _total(self):
+        return self._leased + sum(len(idle) for idle in self._idle.values())
+
+    def _pop_idle_other(self, platform):
+        for other, idle in self._idle.items():
+            if other != platform and idle:
+                return idle.pop(0)
+        return None
+
+    def _quit(self, scraper):
+        try:
+            scraper.close()
+        except Exception as e:
+            logger.debug(f"Error quitting pooled browser: {e}")
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def default_pool():
+    """Process-wide pool shared by the scheduler, seeding and the HTTP engines' fallbacks"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            from memory_watchdog import memory_watchdog
+            _default_pool = BrowserPool()
+            _default_pool.needs_restart = memory_watchdog.over_limit
+        return _default_pool
@@ -0,0 +1,193 @@
+# Challenge circuit breaker
+# Stops scraping a platform after consecutive bot-challenge pages, pauses it with
+# exponential backoff (kept in the database, so it also holds across one-cycle
+# runs), and hands out a new browser fingerprint / HTTP session before resuming
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+# Desktop Chrome user agents; each resume after a trip moves to the next one
+USER_AGENTS = (
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36',
+)
+
+
+class _Breaker:
+    def __init__(self, platform):
+        self.platform = platform
+        self.state = CLOSED
+        self.consecutive = 0  # Challenges in a row
+        self.trips = 0  # Trips since the platform last worked; sets the backoff
+        self.open_until = 0.0
+        self.generation = 0  # Fingerprint generation, bumped on every resume
+
+
+class CircuitBreakers:
+    """Per-platform challenge circuit breakers
+
+    ``threshold`` consecutive challenges open a platform's breaker for
+    ``pause`` seconds, doubling with every further trip up to ``max_pause``.
+    After the pause the breaker is half-open: scraping resumes with a new
+    fingerprint generation, one more challenge re-opens it at once and a
+    normal response closes it. Trips, resumes and closes are logged to the
+    challenge_events table.
+    """
+
+    def __init__(self, threshold=None, pause=None, max_pause=None):
+        self.threshold = max(1, int(threshold if threshold is not None else os.getenv('CHALLENGE_BREAKER_THRESHOLD', '3')))
+        self.pause = float(pause if pause is not None else os.getenv('CHALLENGE_BREAKER_PAUSE', '600'))
+        self.max_pause = float(max_pause if max_pause is not None else os.getenv('CHALLENGE_BREAKER_MAX_PAUSE', '14400'))
+        self.conn = None
+        self.db_lock = None
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    @property
+    def enabled(self):
+        return self.pause > 0
+
+    def attach(self, conn, lock):
+        """Persist breaker state and events in the bot's database, restoring any open pause"""
+        self.conn, self.db_lock = conn, lock
+        with lock:
+            rows = conn.execute(
+                'SELECT platform, state, consecutive, trips, open_until, generation FROM circuit_breakers'
+            ).fetchall()
+        with self._lock:
+            for platform, state, consecutive, trips, open_until, generation in rows:
+                breaker = self._get(platform)
+                breaker.state, breaker.consecutive, breaker.trips = state, consecutive, trips
+                breaker.open_until, breaker.generation = open_until, generation
+                if state == OPEN and open_until > time.time():
+                    logger.warning(f"{platform} is paused by the challenge circuit breaker until {datetime.fromtimestamp(open_until):%H:%M:%S}")
+                metrics.circuit_open.set(1 if state == OPEN else 0, platform=platform)
+
+    def _get(self, platform):
+        breaker = self._breakers.get(platform)
+        if breaker is None:
+            breaker = self._breakers[platform] = _Breaker(platform)
+        return breaker
+
+    def generation(self, platform):
+        with self._lock:
+            return self._get(platform).generation
+
+    def user_agent(self, platform):
+        """User agent for the platform's current fingerprint generation"""
+        return USER_AGENTS[self.generation(platform) % len(USER_AGENTS)]
+
+    def allow(self, platform):
+        """True unless the platform is paused; the first call after a pause resumes it with a new fingerprint"""
+        if not self.enabled:
+            return True
+        with self._lock:
+            breaker = self._get(platform)
+            self._sync(breaker)
+            if breaker.state != OPEN:
+                return True
+            if time.time() < breaker.open_until:
+                return False
+            breaker.state = HALF_OPEN
+            breaker.generation += 1
+            self._save(breaker, 'resume', f"fingerprint generation {breaker.generation}")
+        logger.info(f"{platform}: challenge pause over - resuming with a new fingerprint (generation {breaker.generation})")
+        metrics.circuit_open.set(0, platform=platform)
+        return True
+
+    def paused_until(self, platform):
+        """Unix time the platform's pause ends (0 when it is not paused)"""
+        with self._lock:
+            breaker = self._get(platform)
+            return breaker.open_until if breaker.state == OPEN else 0.0
+
+    def record_challenge(self, platform, detail=''):
+        """A search was answered with a challenge page; returns True if this opened the breaker"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            breaker = self._get(platform)
+            if breaker.state == OPEN:
+                return False  # Searches already in flight when it tripped
+            breaker.consecutive += 1
+            if breaker.state == CLOSED and breaker.consecutive < self.threshold:
+                return False
+            breaker.trips += 1
+            pause = min(self.max_pause, self.pause * 2 ** (breaker.trips - 1))
+            breaker.state = OPEN
+            breaker.open_until = time.time() + pause
+            self._save(breaker, 'trip', f"{breaker.consecutive} consecutive challenges, paused {pause:.0f}s; last: {detail}"[:500])
+        logger.warning(
+            f"{platform}: {breaker.consecutive} consecutive challenge pages - pausing it for {pause:.0f}s "
+            f"(trip {breaker.trips}, until {datetime.fromtimestamp(breaker.open_until):%H:%M:%S})"
+        )
+        metrics.circuit_trips.inc(platform=platform)
+        metrics.circuit_open.set(1, platform=platform)
+        return True
+
+    def record_success(self, platform):
+        """A search got a normal results page"""
+        with self._lock:
+            breaker = self._get(platform)
+            if breaker.state == CLOSED and breaker.consecutive == 0:
+                return
+            closing = breaker.state == HALF_OPEN
+            breaker.state = CLOSED
+            breaker.consecutive = 0
+            breaker.trips = 0
+            self._save(breaker, 'close' if closing else None, f"fingerprint generation {breaker.generation}")
+        if closing:
+            logger.info(f"{platform}: searches are getting through again - challenge circuit breaker closed")
+
+    def _sync(self, breaker):
+        """Pick up trips and resumes recorded by other processes sharing the database (sharded workers)
+
+        Only a newer row is taken: a later pause end means another process
+        tripped, a higher generation means it resumed. The consecutive count
+        is never saved between trips, so it always stays this process's own.
+        """
+        if self.conn is None:
+            return
+        with self.db_lock:
+            row = self.conn.execute(
+                'SELECT state, trips, open_until, generation FROM circuit_breakers WHERE platform = ?',
+                (breaker.platform,)
+            ).fetchone()
+        if row is None:
+            return
+        state, trips, open_until, generation = row
+        if open_until > breaker.open_until or generation > breaker.generation:
+            breaker.state, breaker.trips, breaker.consecutive = state, trips, 0
+            breaker.open_until = max(open_until, breaker.open_until)
+            breaker.generation = max(generation, breaker.generation)
+
+    def _save(self, breaker, event=None, detail=''):
+        """Write the breaker's state (and an event row) if attached to a database; called with self._lock held"""
+        if self.conn is None:
+            return
+        with self.db_lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO circuit_breakers (platform, state, consecutive, trips, open_until, generation) VALUES (?, ?, ?, ?, ?, ?)',
+                (breaker.platform, breaker.state, breaker.consecutive, breaker.trips, breaker.open_until, breaker.generation)
+            )
+            if event:
+                self.conn.execute(
+                    'INSERT INTO challenge_events (platform, event, detail) VALUES (?, ?, ?)',
+                    (breaker.platform, event, detail)
+                )
+
+
+# Shared by the scrapers (which report challenges), the scheduler and the browser pool
+circuit_breakers = CircuitBreakers()
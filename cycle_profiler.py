@@ -0,0 +1,174 @@
+# Cycle profiler
+# Aggregates named timing spans (driver startup, navigation, waits, extraction,
+# matching, database, email) across every thread of a monitoring cycle and emits
+# a per-cycle report as a log table and a JSON line, with optional cProfile dumps
+
+import os
+import json
+import time
+import pstats
+import cProfile
+import logging
+import functools
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class CycleProfiler:
+    """Thread-safe per-cycle span timings
+
+    Spans are flat: each name accumulates call count, total and max seconds.
+    Spans may nest and run on several threads at once, so totals are busy time
+    and can add up to more than the cycle's wall time.
+    """
+
+    def __init__(self, enabled=True, report_path='', cprofile_dir=''):
+        self.enabled = enabled
+        self.report_path = report_path
+        self.cprofile_dir = cprofile_dir
+        self._lock = threading.Lock()
+        self._stats = {}  # name -> [count, total seconds, max seconds]
+        self._profiles = []  # Finished cProfile.Profile objects of this cycle
+        self._started = time.monotonic()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.getenv('PROFILING', 'on').lower() != 'off',
+            report_path=os.getenv('PROFILE_REPORT_PATH', 'cycle_profile.jsonl'),
+            cprofile_dir=os.getenv('PROFILE_CPROFILE_DIR', '')
+        )
+
+    def record(self, name, seconds):
+        with self._lock:
+            stat = self._stats.get(name)
+            if stat is None:
+                self._stats[name] = [1, seconds, seconds]
+            else:
+                stat[0] += 1
+                stat[1] += seconds
+                if seconds > stat[2]:
+                    stat[2] = seconds
+
+    def merge(self, spans):
+        """Add the spans of another process's report() (a sharded worker's cycle) to this cycle"""
+        with self._lock:
+            for span in spans:
+                stat = self._stats.setdefault(span['name'], [0, 0.0, 0.0])
+                stat[0] += span['count']
+                stat[1] += span['total_s']
+                stat[2] = max(stat[2], span['max_ms'] / 1000)
+
+    @contextmanager
+    def _span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def span(self, name):
+        """Context manager timing one occurrence of name"""
+        return self._span(name) if self.enabled else nullcontext()
+
+    def timed(self, name):
+        """Decorator timing every call of a function as span name"""
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - started)
+            return wrapper
+        return decorate
+
+    @contextmanager
+    def thread_profile(self):
+        """cProfile the calling thread while PROFILE_CPROFILE_DIR is set (cProfile is per-thread)"""
+        if not self.cprofile_dir:
+            yield
+            return
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                self._profiles.append(profile)
+
+    def reset(self):
+        """Start a new cycle"""
+        with self._lock:
+            self._stats = {}
+            self._profiles = []
+        self._started = time.monotonic()
+
+    def report(self, label='cycle', extra=None):
+        """Timing report of the cycle so far: wall time and spans by total time"""
+        wall = time.monotonic() - self._started
+        with self._lock:
+            stats = {name: list(stat) for name, stat in self._stats.items()}
+        spans = [
+            {
+                'name': name,
+                'count': count,
+                'total_s': round(total, 3),
+                'mean_ms': round(total / count * 1000, 1),
+                'max_ms': round(peak * 1000, 1),
+                'share': round(total / wall, 3) if wall else 0.0,
+            }
+            for name, (count, total, peak) in sorted(stats.items(), key=lambda item: item[1][1], reverse=True)
+        ]
+        report = {'label': label, 'finished_at': datetime.now().isoformat(timespec='seconds'), 'wall_s': round(wall, 2), 'spans': spans}
+        if extra:
+            report.update(extra)
+        return report
+
+    def finish_cycle(self, label='cycle', extra=None):
+        """Log, persist and return the cycle's report, dumping cProfile stats if enabled"""
+        if not self.enabled:
+            return None
+        report = self.report(label, extra)
+
+        logger.info(f"Cycle timing ({report['wall_s']}s wall):")
+        logger.info(f"  {'span':<28} {'calls':>6} {'total s':>9} {'mean ms':>9} {'max ms':>9} {'% wall':>7}")
+        for span in report['spans']:
+            logger.info(
+                f"  {span['name']:<28} {span['count']:>6} {span['total_s']:>9.2f} "
+                f"{span['mean_ms']:>9.1f} {span['max_ms']:>9.1f} {span['share'] * 100:>6.1f}%"
+            )
+
+        if self.report_path:
+            try:
+                with open(self.report_path, 'a') as f:
+                    f.write(json.dumps(report) + '\n')
+            except OSError as e:
+                logger.warning(f"Could not write cycle profile to {self.report_path}: {e}")
+
+        self._dump_cprofile()
+        return report
+
+    def _dump_cprofile(self):
+        with self._lock:
+            profiles, self._profiles = self._profiles, []
+        if not profiles:
+            return
+        os.makedirs(self.cprofile_dir, exist_ok=True)
+        path = os.path.join(self.cprofile_dir, f"cycle-{datetime.now():%Y%m%d-%H%M%S}.prof")
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
+        logger.info(f"cProfile stats for {len(profiles)} thread(s) written to {path} (view with python -m pstats)")
+
+
+# Shared by the scheduler, scrapers, database and email code
+cycle_profiler = CycleProfiler.from_env()
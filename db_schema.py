@@ -0,0 +1,271 @@
+# Database schema
+# Versioned migrations for champion_listings.db, tracked in PRAGMA user_version
+# and applied in order, each in its own transaction, when the bot connects
+
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+PRICE_AMOUNT_RE = re.compile(r'\d[\d,]*(?:\.\d+)?')
+CURRENCY_CODE_RE = re.compile(r'\b(USD|CAD|AUD|GBP|EUR|JPY|NZD|CHF|SEK|DKK|NOK|PLN|HKD|SGD)\b')
+
+# eBay prefixes non-US dollars with a region ("C $30.00"); longest prefixes first
+CURRENCY_PREFIXES = [
+    ('US $', 'USD'),
+    ('C $', 'CAD'),
+    ('AU $', 'AUD'),
+    ('NZ $', 'NZD'),
+    ('HK $', 'HKD'),
+    ('$', 'USD'),
+    ('£', 'GBP'),
+    ('€', 'EUR'),
+    ('¥', 'JPY'),
+]
+
+
+def parse_price(text):
+    """(min, max, currency) from a displayed price such as '$45.00 to $60.00' or '12.50 GBP'
+
+    Amounts are None when the text holds no number; a single price has min == max.
+    """
+    amounts = [float(amount.replace(',', '')) for amount in PRICE_AMOUNT_RE.findall(text or '')]
+    if not amounts:
+        return None, None, None
+    code = CURRENCY_CODE_RE.search(text)
+    currency = code.group(1) if code else None
+    if currency is None:
+        currency = next((code for prefix, code in CURRENCY_PREFIXES if prefix in text), None)
+    return min(amounts), max(amounts), currency
+
+
+def _baseline(cursor):
+    """The original single-table schema, for databases created before versioning"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS seen_listings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            listing_id TEXT UNIQUE,
+            platform TEXT,
+            title TEXT,
+            price TEXT,
+            url TEXT,
+            image_url TEXT,
+            search_term TEXT,
+            first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _normalized_listings(cursor):
+    """Key listings on (platform, listing_id), parse prices and move term matches to listing_terms"""
+    cursor.execute('''
+        CREATE TABLE listings_v2 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            platform TEXT NOT NULL,
+            listing_id TEXT NOT NULL,
+            title TEXT,
+            price TEXT,
+            price_min REAL,
+            price_max REAL,
+            currency TEXT,
+            url TEXT,
+            image_url TEXT,
+            search_term TEXT,
+            first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (platform, listing_id)
+        )
+    ''')
+    rows = cursor.execute('''
+        SELECT id, COALESCE(platform, ''), listing_id, title, price, url, image_url, search_term, first_seen
+        FROM seen_listings WHERE listing_id IS NOT NULL
+    ''').fetchall()
+    cursor.executemany('''
+        INSERT INTO listings_v2
+        (id, platform, listing_id, title, price, price_min, price_max, currency, url, image_url, search_term, first_seen)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [row[:5] + parse_price(row[4]) + row[5:] for row in rows])
+    cursor.execute('DROP TABLE seen_listings')
+    cursor.execute('ALTER TABLE listings_v2 RENAME TO seen_listings')
+
+    # Every search term a listing matches, not just the one whose search found it
+    cursor.execute('''
+        CREATE TABLE listing_terms (
+            search_term TEXT NOT NULL,
+            listing_rowid INTEGER NOT NULL REFERENCES seen_listings (id) ON DELETE CASCADE,
+            PRIMARY KEY (search_term, listing_rowid)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        INSERT INTO listing_terms (search_term, listing_rowid)
+        SELECT search_term, id FROM seen_listings WHERE search_term IS NOT NULL
+    ''')
+
+    # Covering indexes: arrival counts per term since a date (poll scheduler), per-term
+    # history, and a listing's terms when joining from seen_listings
+    cursor.execute('CREATE INDEX idx_seen_first_seen ON seen_listings (first_seen, search_term)')
+    cursor.execute('CREATE INDEX idx_seen_term ON seen_listings (search_term, first_seen)')
+    cursor.execute('CREATE INDEX idx_listing_terms_listing ON listing_terms (listing_rowid, search_term)')
+    cursor.execute('ANALYZE')
+    logger.info(f"Migrated {len(rows)} listings to the (platform, listing_id) schema")
+
+
+def _retention_tables(cursor):
+    """Hashed IDs of listings aged out by the retention job, and maintenance bookkeeping"""
+    # An INTEGER PRIMARY KEY is the table's rowid, so each retired listing costs ~10 bytes
+    cursor.execute('CREATE TABLE retired_listings (key INTEGER PRIMARY KEY)')
+    cursor.execute('CREATE TABLE db_maintenance (task TEXT PRIMARY KEY, last_run REAL NOT NULL)')
+
+
+def _circuit_breaker_tables(cursor):
+    """Challenge circuit breaker state per platform, and a log of its trips and resumes"""
+    cursor.execute('''
+        CREATE TABLE circuit_breakers (
+            platform TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            consecutive INTEGER NOT NULL,
+            trips INTEGER NOT NULL,
+            open_until REAL NOT NULL,
+            generation INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE challenge_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            platform TEXT NOT NULL,
+            occurred_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            event TEXT NOT NULL,
+            detail TEXT
+        )
+    ''')
+
+
+def _depop_slug_ids(cursor):
+    """Key Depop listings on their URL slug; the API client used to store the numeric product id"""
+    has_watermarks = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_watermarks'"
+    ).fetchone() is not None
+    rows = cursor.execute(
+        "SELECT id, listing_id, url FROM seen_listings WHERE platform = 'Depop' AND url LIKE '%/products/%'"
+    ).fetchall()
+    renamed = merged = 0
+    for rowid, listing_id, url in rows:
+        match = re.search(r'/products/([\w-]+)', url)
+        if not match or match.group(1) == listing_id:
+            continue
+        slug = match.group(1)
+        existing = cursor.execute(
+            "SELECT id FROM seen_listings WHERE platform = 'Depop' AND listing_id = ?", (slug,)
+        ).fetchone()
+        if existing is None:
+            cursor.execute('UPDATE seen_listings SET listing_id = ? WHERE id = ?', (slug, rowid))
+            renamed += 1
+        else:
+            # Seen by both engines: keep the slug row, with the terms of both
+            cursor.execute(
+                'INSERT OR IGNORE INTO listing_terms (search_term, listing_rowid) '
+                'SELECT search_term, ? FROM listing_terms WHERE listing_rowid = ?', (existing[0], rowid)
+            )
+            cursor.execute('DELETE FROM listing_terms WHERE listing_rowid = ?', (rowid,))
+            cursor.execute('DELETE FROM seen_listings WHERE id = ?', (rowid,))
+            merged += 1
+        if has_watermarks:
+            cursor.execute('UPDATE OR IGNORE search_watermarks SET listing_id = ? WHERE listing_id = ?', (slug, listing_id))
+    logger.info(f"Re-keyed {renamed} Depop listings on their URL slug ({merged} duplicates merged)")
+
+
+def _outbox_platform_key(cursor):
+    """Key queued notifications on (platform, listing_id) like seen_listings, instead of listing_id alone"""
+    if cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'notification_outbox'"
+    ).fetchone() is None:
+        return  # Outbox.init_tables creates it with the composite key
+    cursor.execute('''
+        CREATE TABLE outbox_v2 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            platform TEXT NOT NULL,
+            listing_id TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            batch_key TEXT,
+            enqueued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (platform, listing_id)
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO outbox_v2 (id, platform, listing_id, payload, batch_key, enqueued_at)
+        SELECT id, COALESCE(json_extract(payload, '$.platform'), ''), listing_id, payload, batch_key, enqueued_at
+        FROM notification_outbox WHERE listing_id IS NOT NULL
+    ''')
+    cursor.execute('DROP TABLE notification_outbox')
+    cursor.execute('ALTER TABLE outbox_v2 RENAME TO notification_outbox')
+    cursor.execute('CREATE INDEX idx_outbox_batch ON notification_outbox (batch_key)')
+
+
+def _platform_watermarks(cursor):
+    """Key search watermarks on (platform, query), so one platform's IDs never trim away the other's"""
+    cursor.execute('''
+        CREATE TABLE watermarks_v2 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            platform TEXT NOT NULL,
+            query TEXT NOT NULL,
+            listing_id TEXT NOT NULL,
+            seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (platform, query, listing_id)
+        )
+    ''')
+    if cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_watermarks'"
+    ).fetchone() is not None:
+        # eBay item IDs are numeric; Depop IDs are URL slugs since migration 5
+        cursor.execute('''
+            INSERT INTO watermarks_v2 (id, platform, query, listing_id, seen_at)
+            SELECT id, CASE WHEN listing_id GLOB '*[^0-9]*' THEN 'Depop' ELSE 'eBay' END, query, listing_id, seen_at
+            FROM search_watermarks
+        ''')
+        cursor.execute('DROP TABLE search_watermarks')
+    cursor.execute('ALTER TABLE watermarks_v2 RENAME TO search_watermarks')
+
+
+# (version, description, migration) - append only; never edit a released migration
+MIGRATIONS = [
+    (1, 'baseline seen_listings table', _baseline),
+    (2, 'composite key, parsed prices and listing_terms', _normalized_listings),
+    (3, 'retired listing hashes and maintenance log', _retention_tables),
+    (4, 'challenge circuit breakers and event log', _circuit_breaker_tables),
+    (5, 'Depop listings keyed on their URL slug', _depop_slug_ids),
+    (6, 'notification outbox keyed on (platform, listing_id)', _outbox_platform_key),
+    (7, 'search watermarks keyed on (platform, query)', _platform_watermarks),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Apply every pending migration; returns the resulting schema version
+
+    The connection must be in autocommit mode (isolation_level=None). A failed
+    migration rolls back entirely and leaves the database at the previous version.
+    """
+    version = schema_version(conn)
+    if version > LATEST_VERSION:
+        raise RuntimeError(f"champion_listings.db is at schema version {version}, newer than this code ({LATEST_VERSION})")
+
+    for target, description, migration in MIGRATIONS:
+        if target <= version:
+            continue
+        logger.info(f"Applying database migration {target}: {description}")
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            migration(cursor)
+            # user_version lives in the database header and commits with the migration
+            cursor.execute(f'PRAGMA user_version = {int(target)}')
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        version = target
+    return version
@@ -1,292 +1,262 @@
-# Depop Scraper for Champion Reverse Weave Listings
-# Searches Depop for new listings and extracts relevant information
+# Depop Scraper - async JSON API client
+# Fetches Depop search results as JSON with cursor pagination over a shared
+# aiohttp session, falling back to the Selenium scraper when the API refuses a term
 
-import requests
-from bs4 import BeautifulSoup
+import os
+import json
 import time
+import asyncio
 import logging
-from urllib.parse import quote, urljoin
-import re
-from fake_useragent import UserAgent
-import json
+
+import aiohttp
+
+from browser_pool import default_pool
+from rate_limiter import rate_limiter
+from circuit_breaker import circuit_breakers
+from listing_matcher import matches_search_term
+from cycle_profiler import cycle_profiler
+from metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+# Preferred image sizes, largest first (Depop keys previews by pixel width)
+IMAGE_SIZES = ('640', '480', '320', '210', '150')
+
+
+class DepopApiError(Exception):
+    """The search API refused or returned something unparseable for a term"""
+
+    def __init__(self, message, challenged=False):
+        super().__init__(message)
+        self.challenged = challenged  # Refused with 403/429 - Depop's bot protection
+
+
 class DepopScraper:
+    uses_browser = False
+
     def __init__(self):
-        self.base_url = "https://www.depop.com"
-        self.search_url = "https://www.depop.com/search"
-        self.api_url = "https://webapi.depop.com/api/v1/search/products"
-        self.session = requests.Session()
-        self.ua = UserAgent()
-        
-        # Set headers to mimic a real browser more convincingly
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-            'Sec-Fetch-Dest': 'document',
-            'Sec-Fetch-Mode': 'navigate',
-            'Sec-Fetch-Site': 'none',
-            'Cache-Control': 'max-age=0',
-        })
-    
-    def search_listings(self, search_terms, max_pages=2):
-        """Search Depop for listings matching the given search terms"""
+        # DEPOP_BASE_URL / DEPOP_API_URL point the scraper at a stand-in such as mock_marketplace.py
+        self.base_url = os.getenv('DEPOP_BASE_URL', "https://www.depop.com").rstrip('/')
+        self.api_url = os.getenv('DEPOP_API_URL', "https://webapi.depop.com/api/v3/search/products/")
+        self.concurrency = int(os.getenv('DEPOP_API_CONCURRENCY', '4'))
+        self.driver = True  # No browser needed; keeps the scheduler's driver check happy
+
+    def search_listings(self, search_terms, max_pages=1, per_term_limit=20, term_delay=0, watermarks=None):
+        """Search Depop for listings matching the given search terms
+
+        All terms are fetched concurrently (bounded by DEPOP_API_CONCURRENCY)
+        over one keep-alive session; terms the API rejects are retried through
+        the Selenium scraper. ``term_delay`` is accepted for interface parity -
+        every request is paced by the shared rate limiter. With a WatermarkStore,
+        each term stops at its already-seen products and follows the cursor
+        only while every product is new, instead of reading per_term_limit.
+        Nothing is fetched while Depop is paused by the challenge circuit breaker.
+        """
+        if not circuit_breakers.allow('Depop'):
+            logger.warning(f"Depop is paused after repeated challenge pages - skipping {len(search_terms)} terms")
+            return []
+        results = asyncio.run(self._search_all(search_terms, max_pages, per_term_limit, watermarks))
+
         all_listings = []
-        
-        for search_term in search_terms:
-            logger.info(f"Searching Depop for: {search_term}")
-            
-            try:
-                listings = self._search_single_term(search_term, max_pages)
-                all_listings.extend(listings)
-                
-                # Be respectful - add delay between searches
-                time.sleep(3)
-                
-            except Exception as e:
-                logger.error(f"Error searching for '{search_term}': {e}")
-                continue
-        
+        for search_term, listings in zip(search_terms, results):
+            if isinstance(listings, DepopApiError):
+                listings = self._search_with_selenium(search_term, max_pages, per_term_limit, watermarks, listings.challenged)
+            all_listings.extend(listings)
+
         logger.info(f"Found {len(all_listings)} total Depop listings")
         return all_listings
-    
-    def _search_single_term(self, search_term, max_pages):
-        """Search for a single term and return listings"""
+
+    async def _search_all(self, search_terms, max_pages, per_term_limit, watermarks=None):
+        """Fetch every term concurrently, returning listings per term (or the DepopApiError it failed with)"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=20)
+        headers = {
+            # Each resume after a challenge pause gets the next user agent
+            'User-Agent': circuit_breakers.user_agent('Depop'),
+            'Accept': 'application/json',
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Origin': self.base_url,
+            'Referer': f"{self.base_url}/",
+        }
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
+            tasks = [
+                self._search_term(
+                    session, semaphore, term, max_pages, per_term_limit,
+                    watermarks.get('Depop', term) if watermarks is not None else None
+                )
+                for term in search_terms
+            ]
+            return await asyncio.gather(*tasks)
+
+    async def _search_term(self, session, semaphore, search_term, max_pages, limit, watermark=None):
+        """Follow the result cursor for one term until max_pages, limit or the watermark is reached"""
+        if watermark is not None:
+            # Known products end the scan, so the total cap no longer bounds the work
+            limit = float('inf')
         listings = []
-        
-        for page in range(1, max_pages + 1):
+        cursor = None
+
+        async with semaphore:
+            started = time.monotonic()
             try:
-                page_listings = self._get_page_listings(search_term, page)
-                listings.extend(page_listings)
-                
-                # If we got fewer than expected results, we might be on the last page
-                if len(page_listings) < 20:  # Depop typically shows 20 items per page
-                    break
-                    
-                time.sleep(2)  # Be respectful
-                
+                for page in range(max_pages):
+                    params = {
+                        'what': search_term,
+                        'sort': 'newlyListed',
+                        'itemsPerPage': int(min(limit, 24)),
+                        'country': 'us',
+                        'currency': 'USD',
+                    }
+                    if cursor:
+                        params['cursor'] = cursor
+
+                    await rate_limiter.acquire_async(self.api_url)
+                    data = await self._fetch_json(session, params)
+                    if watermark is not None:
+                        watermark.new_page()
+                    listings.extend(self._parse_api_response(data, search_term, watermark))
+
+                    cursor = (data.get('meta') or {}).get('cursor')
+                    has_more = (data.get('meta') or {}).get('hasMore', bool(cursor))
+                    if len(listings) >= limit or not cursor or not has_more:
+                        break
+                    if watermark is not None and not watermark.want_next_page:
+                        break
             except Exception as e:
-                logger.error(f"Error getting page {page} for '{search_term}': {e}")
-                break
-        
+                # Any failure (a malformed response as much as a refusal) only sends this term to the fallback
+                if not isinstance(e, DepopApiError):
+                    e = DepopApiError(f"unexpected {type(e).__name__}: {e}")
+                if watermark is not None:
+                    watermark.fail()  # Pages already read are dropped with the term
+                logger.warning(f"Depop API failed for '{search_term}': {e}")
+                metrics.search_failures.inc(platform='Depop')
+                return e
+            metrics.search_seconds.observe(time.monotonic() - started, platform='Depop', term=search_term)
+        circuit_breakers.record_success('Depop')
+
+        if watermark is None:
+            listings = listings[:limit]
+        logger.info(f"Found {len(listings)} Depop listings for '{search_term}' via API")
         return listings
-    
-    def _get_page_listings(self, search_term, page):
-        """Get listings from a specific page using Depop's API"""
-        params = {
-            'query': search_term,
-            'page': page,
-            'limit': 20,
-            'sort': 'newest'  # Sort by newest first
-        }
-        
+
+    async def _fetch_json(self, session, params):
         try:
-            response = self.session.get(self.api_url, params=params, timeout=15)
-            response.raise_for_status()
-            
-            data = response.json()
-            return self._parse_api_response(data, search_term)
-            
-        except requests.RequestException as e:
-            logger.error(f"API request failed for page {page}: {e}")
-            # Fallback to web scraping if API fails
-            return self._fallback_web_scrape(search_term, page)
+            with cycle_profiler.span('http.api_get'):
+                async with session.get(self.api_url, params=params) as response:
+                    rate_limiter.observe(self.api_url, response.status)
+                    if response.status in (403, 429):
+                        metrics.challenge_pages.inc(platform='Depop')
+                    if response.status != 200:
+                        raise DepopApiError(f"status {response.status}", challenged=response.status in (403, 429))
+                    return await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise DepopApiError(f"request failed: {e}")
         except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error for page {page}: {e}")
-            return self._fallback_web_scrape(search_term, page)
-    
-    def _parse_api_response(self, data, search_term):
+            raise DepopApiError(f"invalid JSON: {e}")
+
+    @cycle_profiler.timed('http.parse')
+    def _parse_api_response(self, data, search_term, watermark=None):
         """Parse listings from the API response"""
         listings = []
-        
-        try:
-            products = data.get('products', [])
-            
-            for product in products:
-                try:
-                    listing_data = self._extract_product_data(product, search_term)
-                    if listing_data:
-                        listings.append(listing_data)
-                except Exception as e:
-                    logger.debug(f"Error parsing product: {e}")
+
+        for product in data.get('products') or []:
+            # Products are newest first - stop once the search's known listings are reached
+            if watermark is not None:
+                if watermark.reached:
+                    break
+                if product.get('slug') and watermark.observe(product['slug']):
                     continue
-                    
-        except Exception as e:
-            logger.error(f"Error parsing API response: {e}")
-        
+            try:
+                listing_data = self._extract_product_data(product, search_term)
+                if listing_data:
+                    listings.append(listing_data)
+            except Exception as e:
+                logger.debug(f"Error parsing product: {e}")
+                if watermark is not None:
+                    watermark.fail()  # Observed but not returned
+                continue
+
         return listings
-    
+
     def _extract_product_data(self, product, search_term):
-        """Extract data from a single product"""
-        try:
-            # Get product ID
-            product_id = str(product.get('id', ''))
-            if not product_id:
-                return None
-            
-            # Get title
-            title = product.get('title', 'No title')
-            
-            # Get price
-            price_info = product.get('price', {})
-            price_amount = price_info.get('amount', 0)
-            price_currency = price_info.get('currency', 'USD')
-            price = f"${price_amount}" if price_currency == 'USD' else f"{price_amount} {price_currency}"
-            
-            # Get image URL
-            images = product.get('images', [])
-            image_url = images[0].get('url', '') if images else ''
-            
-            # Get product URL
-            product_url = f"{self.base_url}/products/{product.get('slug', '')}"
-            
-            # Filter for Champion reverse weave items
-            if not self._is_champion_reverse_weave(title):
-                return None
-            
-            return {
-                'listing_id': product_id,
-                'platform': 'Depop',
-                'title': title,
-                'price': price,
-                'url': product_url,
-                'image_url': image_url,
-                'search_term': search_term
-            }
-            
-        except Exception as e:
-            logger.debug(f"Error extracting product data: {e}")
+        """Extract data from a single product (v3 and legacy v1 response shapes)
+
+        The listing ID is the product's URL slug, the same ID the Selenium
+        scraper reads from product links, so both engines dedup the same listing.
+        """
+        slug = product.get('slug', '')
+        if not slug:
             return None
-    
-    def _fallback_web_scrape(self, search_term, page):
-        """Fallback to web scraping if API fails"""
-        listings = []
-        
-        try:
-            # Try different search approaches
-            search_urls = [
-                f"https://www.depop.com/search/?q={search_term.replace(' ', '+')}",
-                f"https://www.depop.com/search/?q={search_term.replace(' ', '%20')}",
-                f"https://www.depop.com/search/?q={search_term}"
-            ]
-            
-            for search_url in search_urls:
-                try:
-                    logger.info(f"Trying Depop URL: {search_url}")
-                    response = self.session.get(search_url, timeout=15)
-                    
-                    if response.status_code == 200:
-                        soup = BeautifulSoup(response.content, 'html.parser')
-                        
-                        # Try different selectors for product cards
-                        selectors = [
-                            'div[data-testid="product-card"]',
-                            'div[class*="product-card"]',
-                            'div[class*="ProductCard"]',
-                            'a[href*="/products/"]'
-                        ]
-                        
-                        for selector in selectors:
-                            cards = soup.select(selector)
-                            if cards:
-                                logger.info(f"Found {len(cards)} items with selector: {selector}")
-                                
-                                for card in cards[:10]:  # Limit to first 10
-                                    try:
-                                        listing_data = self._extract_card_data(card, search_term)
-                                        if listing_data:
-                                            listings.append(listing_data)
-                                    except Exception as e:
-                                        logger.debug(f"Error parsing card: {e}")
-                                        continue
-                                break
-                        
-                        if listings:
-                            break
-                            
-                except Exception as e:
-                    logger.debug(f"Failed with URL {search_url}: {e}")
-                    continue
-                    
-        except Exception as e:
-            logger.error(f"Web scraping fallback failed: {e}")
-        
-        return listings
-    
-    def _extract_card_data(self, card, search_term):
-        """Extract data from a product card"""
+
+        title = (product.get('title') or '').strip()
+        if not title:
+            # v3 search results carry a description instead of a title
+            description = (product.get('description') or '').strip()
+            title = description.splitlines()[0][:100] if description else slug.replace('-', ' ').title()
+
+        # Filter items based on search term to ensure relevance
+        if not self._matches_search_term(f"{title} {slug}".lower(), search_term):
+            return None
+
+        return {
+            'listing_id': slug,
+            'platform': 'Depop',
+            'title': title,
+            'price': self._format_price(product),
+            'url': f"{self.base_url}/products/{slug}/",
+            'image_url': self._pick_image(product),
+            'search_term': search_term
+        }
+
+    def _format_price(self, product):
+        price_info = product.get('price') or {}
+        amount = price_info.get('discountedPriceAmount') or price_info.get('priceAmount') or price_info.get('amount')
+        currency = price_info.get('currencyName') or price_info.get('currency') or 'USD'
+        if not amount:
+            pricing = product.get('pricing') or {}
+            price_data = pricing.get(pricing.get('final_price_key', 'original_price')) or {}
+            amount = price_data.get('total_price')
+        if not amount:
+            return 'Price not available'
+        return f"${amount}" if currency == 'USD' else f"{amount} {currency}"
+
+    def _pick_image(self, product):
+        previews = [product.get('preview') or {}]
+        previews.extend(product.get('pictures') or [])
+        for preview in previews:
+            for size in IMAGE_SIZES:
+                if preview.get(size):
+                    return preview[size]
+        images = product.get('images') or []
+        return images[0].get('url', '') if images else ''
+
+    @cycle_profiler.timed('match')
+    def _matches_search_term(self, title, search_term):
+        """Same relevance filter as the Selenium scraper"""
+        return matches_search_term(title, search_term)
+
+    def _search_with_selenium(self, search_term, max_pages, per_term_limit, watermarks=None, challenged=False):
+        """Run one term through a warm pooled Selenium browser after an API failure
+
+        The browser reports its own outcome to the circuit breaker; without one
+        an API refusal counts as the challenge.
+        """
+        if not circuit_breakers.allow('Depop'):
+            return []
         try:
-            # Get product link
-            link_elem = card.find('a')
-            if not link_elem:
-                return None
-            
-            href = link_elem.get('href', '')
-            if not href:
-                return None
-            
-            # Extract product ID from URL
-            product_id = href.split('/')[-1] if href else ''
-            if not product_id:
-                return None
-            
-            # Get title
-            title_elem = card.find('h3') or card.find('h2')
-            title = title_elem.get_text(strip=True) if title_elem else "No title"
-            
-            # Get price
-            price_elem = card.find('span', {'data-testid': 'price'})
-            price = price_elem.get_text(strip=True) if price_elem else "Price not available"
-            
-            # Get image
-            img_elem = card.find('img')
-            image_url = img_elem.get('src', '') if img_elem else ''
-            
-            # Convert relative URLs to absolute
-            if image_url.startswith('//'):
-                image_url = 'https:' + image_url
-            elif image_url.startswith('/'):
-                image_url = urljoin(self.base_url, image_url)
-            
-            # Get product URL
-            product_url = urljoin(self.base_url, href)
-            
-            # Filter for Champion reverse weave items
-            if not self._is_champion_reverse_weave(title):
-                return None
-            
-            return {
-                'listing_id': product_id,
-                'platform': 'Depop',
-                'title': title,
-                'price': price,
-                'url': product_url,
-                'image_url': image_url,
-                'search_term': search_term
-            }
-            
+            with default_pool().lease('Depop') as scraper:
+                if scraper.driver is not None:
+                    return scraper.search_listings(
+                        [search_term], max_pages=max_pages, per_term_limit=per_term_limit, term_delay=0,
+                        watermarks=watermarks
+                    )
         except Exception as e:
-            logger.debug(f"Error extracting card data: {e}")
-            return None
-    
-    def _is_champion_reverse_weave(self, title):
-        """Check if the title indicates this is a Champion reverse weave item"""
-        title_lower = title.lower()
-        
-        # Must contain "champion" and "reverse weave"
-        champion_keywords = ['champion']
-        reverse_weave_keywords = ['reverse weave', 'reverse-weave', 'reverseweave']
-        
-        has_champion = any(keyword in title_lower for keyword in champion_keywords)
-        has_reverse_weave = any(keyword in title_lower for keyword in reverse_weave_keywords)
-        
-        # Additional filters to avoid irrelevant items
-        exclude_keywords = ['not champion', 'like champion', 'similar to champion', 'champion style']
-        has_exclude = any(keyword in title_lower for keyword in exclude_keywords)
-        
-        return has_champion and has_reverse_weave and not has_exclude
+            logger.error(f"Selenium fallback failed for '{search_term}': {e}")
+        if challenged:
+            circuit_breakers.record_challenge('Depop', f"'{search_term}' refused by the API, no Selenium fallback")
+        return []
+
+    def close(self):
+        """Nothing to release - each search_listings call owns its session"""
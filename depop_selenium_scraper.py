@@ -2,25 +2,39 @@ from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, NoSuchElementException
 from webdriver_manager.chrome import ChromeDriverManager
 import time
 import logging
 import re
 import os
+from page_readiness import page_readiness
+from browser_pool import recycle_tab
+from memory_watchdog import memory_watchdog
+from rate_limiter import rate_limiter
+from circuit_breaker import circuit_breakers
+from listing_matcher import matches_search_term
+from cycle_profiler import cycle_profiler
+from metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+PRODUCT_LINK_SELECTOR = "a[href*='/products/']"
+
 class DepopSeleniumScraper:
+	platform = 'Depop'
+	
 	def __init__(self):
-		self.base_url = "https://www.depop.com"
+		self.base_url = os.getenv('DEPOP_BASE_URL', "https://www.depop.com").rstrip('/')
 		self.driver = None
+		self.fingerprint = None  # Circuit breaker generation the browser was started for
 		self.setup_driver()
 	
+	@cycle_profiler.timed('selenium.setup_driver')
 	def setup_driver(self):
 		options = Options()
+		# A new fingerprint (user agent and fresh profile) after every challenge pause
+		self.fingerprint = circuit_breakers.generation(self.platform)
 		# Resource-optimized options for Railway/Docker
 		options.add_argument('--no-sandbox')
 		options.add_argument('--disable-dev-shm-usage')
@@ -38,7 +52,7 @@ class DepopSeleniumScraper:
 		
 		# Stealth options
 		options.add_argument('--disable-blink-features=AutomationControlled')
-		options.add_argument('--user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
+		options.add_argument(f'--user-agent={circuit_breakers.user_agent(self.platform)}')
 		
 		# Page load strategy - don't wait for all resources to load
 		options.page_load_strategy = 'eager'  # Only wait for DOM, not all resources
@@ -151,89 +165,116 @@ class DepopSeleniumScraper:
 			logger.error(f"Failed to initialize Depop Chrome driver: {e}")
 			self.driver = None
 	
-	def search_listings(self, search_terms, max_pages=1, per_term_limit=40):
+	def search_listings(self, search_terms, max_pages=1, per_term_limit=40, term_delay=0, watermarks=None):
+		"""Search Depop in the browser; ``term_delay`` is accepted for interface parity - page loads are rate limited
+
+		Stops while Depop is paused by the challenge circuit breaker, and restarts
+		Chrome with the new fingerprint when it resumes.
+		"""
 		if not self.driver:
 			return []
 		all_listings = []
 		for i, term in enumerate(search_terms):
+			if not circuit_breakers.allow(self.platform):
+				logger.warning(f"Depop is paused after repeated challenge pages - skipping {len(search_terms) - i} terms")
+				break
+			if self.fingerprint != circuit_breakers.generation(self.platform):
+				logger.info("Restarting Chrome with a new fingerprint after the challenge pause")
+				self.close()
+				self.setup_driver()
+				metrics.driver_restarts.inc(platform=self.platform)
+				if self.driver is None:
+					logger.error("Failed to restart Depop driver")
+					break
 			try:
 				logger.info(f"Searching Depop with Selenium for: {term}")
-				found = self._search_term(term, max_pages=max_pages, limit=per_term_limit)
+				watermark = watermarks.get(self.platform, term) if watermarks is not None else None
+				found = self._search_term(term, max_pages=max_pages, limit=per_term_limit, watermark=watermark)
 				all_listings.extend(found)
 				
-				# Restart driver every 8 searches to prevent session timeouts
-				if (i + 1) % 8 == 0:
-					logger.info("Restarting Depop driver to prevent session timeout")
-					self.close()
-					time.sleep(3)
-					self.setup_driver()
+				# Recycle the browser when its measured memory crosses BROWSER_RSS_LIMIT_MB;
+				# without RSS readings fall back to every 8 searches
+				if (i + 1) < len(search_terms) and self._should_recycle(i + 1, 8):
+					self._recycle_tab()
 					if self.driver is None:
 						logger.error("Failed to restart Depop driver")
 						break
-				
-				time.sleep(2)
 			except Exception as e:
 				logger.error(f"Depop search error for '{term}': {e}")
+				if watermarks is not None:
+					watermarks.fail(self.platform, [term])
 				# Try to restart driver on error
 				try:
 					self.close()
 					time.sleep(2)
 					self.setup_driver()
+					metrics.driver_restarts.inc(platform=self.platform)
 				except Exception as restart_error:
 					logger.error(f"Failed to restart driver: {restart_error}")
 		return all_listings
 	
-	def _search_term(self, term, max_pages=1, limit=40):
+	def _search_term(self, term, max_pages=1, limit=40, watermark=None):
 		results = []
 		page = 1
 		while page <= max_pages and len(results) < limit:
+			if watermark is not None:
+				watermark.new_page()
 			try:
 				search_url = f"{self.base_url}/search/?q={term.replace(' ', '+')}&sort=newest"
 				logger.info(f"Navigating to: {search_url}")
+				rate_limiter.acquire(search_url)
 				try:
 					self.driver.set_page_load_timeout(30)  # 30 second timeout
-					self.driver.get(search_url)
+					with cycle_profiler.span('selenium.get'):
+						self.driver.get(search_url)
 				except TimeoutException:
 					logger.warning(f"Page load timeout for '{term}', but continuing...")
 					# Page might still be partially loaded, continue anyway
 				
-				# Wait for page to load with explicit wait
-				try:
-					WebDriverWait(self.driver, 10).until(
-						EC.presence_of_element_located((By.CSS_SELECTOR, "a[href*='/products/']"))
-					)
-				except TimeoutException:
+				# Wait until product links render and the DOM settles instead of a fixed delay
+				readiness = page_readiness.wait_for_listings(self.driver, 'Depop', PRODUCT_LINK_SELECTOR)
+				if not readiness['ready']:
 					logger.warning(f"Timeout waiting for products to appear for '{term}', but continuing...")
-				
-				# Small delay to ensure JavaScript has executed
-				time.sleep(2)
+				current_url = self.driver.current_url
+				challenged = 'challenge' in current_url
+				rate_limiter.observe(search_url, challenge=challenged)
+				if challenged:
+					logger.warning(f"Redirected to challenge page: {current_url}")
+					metrics.challenge_pages.inc(platform=self.platform)
+					circuit_breakers.record_challenge(self.platform, current_url)
+					break
+				circuit_breakers.record_success(self.platform)
 			except TimeoutException as e:
 				logger.warning(f"Timeout error for '{term}': {e}. Skipping this search term.")
 				break  # Skip to next term instead of reconnecting
 			except Exception as e:
 				logger.warning(f"Session error for '{term}', attempting to reconnect: {e}")
+				metrics.tab_crashes.inc(platform=self.platform)
 				try:
 					self.close()
 					time.sleep(2)
 					self.setup_driver()
+					metrics.driver_restarts.inc(platform=self.platform)
 					if self.driver is None:
 						logger.error(f"Failed to reconnect for '{term}'")
 						break
 					search_url = f"{self.base_url}/search/?q={term.replace(' ', '+')}&sort=newest"
 					logger.info(f"Reconnected, navigating to: {search_url}")
+					rate_limiter.acquire(search_url)
 					try:
 						self.driver.set_page_load_timeout(30)
 						self.driver.get(search_url)
-						time.sleep(2)
+						page_readiness.wait_for_listings(self.driver, 'Depop', PRODUCT_LINK_SELECTOR)
 					except TimeoutException:
 						logger.warning(f"Reconnect page load timeout for '{term}', but continuing...")
 				except Exception as reconnect_error:
 					logger.error(f"Failed to reconnect for '{term}': {reconnect_error}")
 					break
 			
+			extract_started = time.perf_counter()
 			try:
 				# Get all product links
-				items = self.driver.find_elements(By.CSS_SELECTOR, "a[href*='/products/']")
+				items = self.driver.find_elements(By.CSS_SELECTOR, PRODUCT_LINK_SELECTOR)
 				logger.info(f"Found {len(items)} Depop product links")
 				
 				seen_ids = set()
@@ -252,6 +293,13 @@ class DepopSeleniumScraper:
 							continue
 						seen_ids.add(pid)
 						
+						# Links are newest first - stop once the search's known listings are reached
+						if watermark is not None:
+							if watermark.observe(pid):
+								if watermark.reached:
+									break
+								continue
+						
 						# Extract title from URL slug (this is the key insight!)
 						clean_href = href.rstrip('/')
 						slug = clean_href.split('/')[-1]
@@ -295,15 +343,23 @@ class DepopSeleniumScraper:
 							
 					except Exception as e:
 						logger.debug(f"Error processing Depop item: {e}")
+						if watermark is not None:
+							watermark.fail()
 						continue
 			except Exception as e:
 				logger.warning(f"Error processing Depop page for '{term}': {e}")
+				if watermark is not None:
+					watermark.fail()
 				# Try to continue with next page or break if it's a session issue
 				if "invalid session id" in str(e).lower():
 					logger.error(f"Session lost for '{term}', stopping search")
 					break
+			finally:
+				cycle_profiler.record('selenium.extract', time.perf_counter() - extract_started)
 			
 			logger.info(f"Found {len(results)} Depop listings for '{term}'")
+			if watermark is not None and not watermark.want_next_page:
+				break
 			page += 1
 			
 		return results
@@ -322,11 +378,10 @@ class DepopSeleniumScraper:
 								if isinstance(product, dict):
 									title = product.get('title', '')
 									slug = product.get('slug', '')
-									product_id = product.get('id', '')
 									
 									# Use title or slug for filtering
 									search_text = f"{title} {slug}".lower()
-									if self._matches_search_term(search_text, term):
+									if slug and self._matches_search_term(search_text, term):
 										# Get price
 										price = 'Price not available'
 										pricing = product.get('pricing', {})
@@ -345,7 +400,7 @@ class DepopSeleniumScraper:
 											image_url = preview.get('640', preview.get('480', preview.get('320', '')))
 										
 										products.append({
-											'listing_id': str(product_id),
+											'listing_id': slug,
 											'platform': 'Depop',
 											'title': title or slug.replace('-', ' ').title(),
 											'price': price,
@@ -366,82 +421,33 @@ class DepopSeleniumScraper:
 		
 		return products
 	
+	@cycle_profiler.timed('match')
 	def _matches_search_term(self, title, search_term):
-		"""Check if the title matches the search term criteria"""
-		title_lower = title.lower() if isinstance(title, str) else str(title).lower()
-		search_lower = search_term.lower()
-		
-		# Extract key brand/product words from search term
-		search_words = search_lower.split()
-		
-		# Define category patterns
-		champion_patterns = ['champion']
-		reverse_weave_patterns = ['reverse weave', 'reverse-weave', 'reverseweave']
-		north_face_patterns = ['north face', 'northface']
-		puffer_patterns = ['puffer', 'down jacket', 'down', 'nuptse', 'mountain jacket']
-		levi_patterns = ['levi', 'levis', 'levi\'s']
-		pendleton_patterns = ['pendleton']
-		board_shirt_patterns = ['board shirt', 'wool shirt', 'flannel']
-		loop_collar_patterns = ['loop collar', 'loop-collar']
-		vintage_patterns = ['vintage', '80s', '90s', 'retro']
-		usa_patterns = ['made in usa', 'made in u.s.a.', 'usa', 'u.s.a.']
-		
-		# Check for exclude keywords
-		exclude_keywords = ['not ', 'like ', 'similar to ', ' style', 'inspired']
-		if any(exclude in title_lower for exclude in exclude_keywords):
-			# Check if it's a false positive
-			if 'not champion' in title_lower and 'champion' not in search_lower:
-				return False
-		
-		# Champion Reverse Weave matching
-		if 'champion' in search_lower and 'reverse' in search_lower:
-			has_champion = any(p in title_lower for p in champion_patterns)
-			has_reverse_weave = any(p in title_lower for p in reverse_weave_patterns)
-			return has_champion and has_reverse_weave
-		
-		# North Face matching
-		if any(nf in search_lower for nf in north_face_patterns):
-			has_north_face = any(p in title_lower for p in north_face_patterns)
-			# If search includes puffer/down, require it
-			if any(p in search_lower for p in puffer_patterns):
-				has_puffer = any(p in title_lower for p in puffer_patterns)
-				return has_north_face and has_puffer
-			return has_north_face
-		
-		# Levi's matching
-		if any(levi in search_lower for levi in levi_patterns):
-			has_levi = any(p in title_lower for p in levi_patterns)
-			# If search includes "black", require it
-			if 'black' in search_lower:
-				has_black = 'black' in title_lower
-				if not has_black:
-					return False
-			# If search includes "made in usa", require it
-			if 'usa' in search_lower or 'made in' in search_lower:
-				has_usa = any(p in title_lower for p in usa_patterns)
-				if not has_usa:
-					return False
-			return has_levi
-		
-		# Pendleton matching
-		if any(pend in search_lower for pend in pendleton_patterns):
-			has_pendleton = any(p in title_lower for p in pendleton_patterns)
-			# If search includes board shirt or loop collar, prefer it
-			if 'board shirt' in search_lower or 'loop collar' in search_lower:
-				has_specific = any(p in title_lower for p in board_shirt_patterns + loop_collar_patterns)
-				return has_pendleton and (has_specific or 'shirt' in title_lower)
-			return has_pendleton
-		
-		# Generic matching: require at least 2 key words from search term
-		important_words = [w for w in search_words if w not in ['vintage', '80s', '90s', 'the', 'a', 'an', 'and', 'or']]
-		if len(important_words) >= 2:
-			matches = sum(1 for word in important_words if word in title_lower)
-			return matches >= 2
-		
-		# Fallback: require at least one key word
-		return any(word in title_lower for word in important_words if len(word) > 3)
+		"""Check if the title matches the search term criteria (rules are compiled once per term)"""
+		return matches_search_term(title, search_term)
+	
+	def _should_recycle(self, searches_done, fallback_every):
+		"""True when the browser is over the RSS limit (or, if unmeasurable, on a fixed interval)"""
+		rss_mb = memory_watchdog.sample_mb(self)
+		if rss_mb is None:
+			return searches_done % fallback_every == 0
+		if rss_mb > memory_watchdog.limit_mb:
+			logger.info(f"Browser at {rss_mb:.0f} MB exceeds {memory_watchdog.limit_mb:.0f} MB limit - recycling")
+			memory_watchdog.record_recycle()
+			return True
+		return False
+
+	def _recycle_tab(self):
+		"""Release renderer memory by replacing the tab, restarting Chrome only if that fails"""
+		try:
+			recycle_tab(self.driver)
+		except Exception as e:
+			logger.warning(f"Depop tab recycle failed ({e}), restarting driver")
+			self.close()
+			self.setup_driver()
 	
 	def close(self):
 		if self.driver:
 			self.driver.quit()
 			logger.info("Depop Chrome driver closed")
+			self.driver = None
@@ -1,199 +1,287 @@
-# eBay Scraper for Champion Reverse Weave Listings
-# Searches eBay for new listings and extracts relevant information
+# eBay Scraper - browser-free HTTP engine
+# Fetches eBay search pages with a pooled requests session and parses them with lxml,
+# falling back to the Selenium scraper only when eBay serves a challenge page
 
-import requests
-from bs4 import BeautifulSoup
-import time
-import logging
-from urllib.parse import quote, urljoin
+import os
 import re
-from fake_useragent import UserAgent
+import logging
+from urllib.parse import urljoin
+
+import requests
+from lxml import etree, html as lxml_html
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from browser_pool import default_pool
+from rate_limiter import rate_limiter
+from circuit_breaker import circuit_breakers
+from listing_matcher import matches_search_term
+from cycle_profiler import cycle_profiler
+from metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+
+def _has_class(name):
+    """XPath predicate equivalent to the CSS class selector .name"""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# XPath translations of the selectors used by EbaySeleniumScraper._extract_listings_selenium.
+# Unions return nodes in document order, matching querySelector on a selector list.
+ITEM_XPATH = etree.XPath(
+    "//li[contains(@class, 's-card')] | //div[contains(@class, 's-item')] | //li[contains(@class, 's-item')]"
+)
+LINK_XPATH = etree.XPath(
+    "(.//a[contains(@class, 's-item__link')] | .//a[contains(@href, '/itm/')])[1]"
+)
+TITLE_XPATH = etree.XPath(
+    f"(.//*[{_has_class('s-card__title')}] | .//h3 | .//h2 | .//a[{_has_class('s-item__link')}])[1]"
+)
+PRICE_XPATH = etree.XPath(
+    f"(.//*[{_has_class('s-card__price')}] | .//span[contains(@class, 'price')])[1]"
+)
+IMAGE_XPATH = etree.XPath("(.//img)[1]")
+
+ITEM_ID_RE = re.compile(r'/itm/(\d+)')
+CHALLENGE_MARKERS = ('challenge', 'splashui')
+
+
+class ChallengePageError(Exception):
+    """eBay answered with a bot-challenge page instead of search results"""
+
+
 class EbayScraper:
+    uses_browser = False
+    max_items_per_page = 25  # Same cap as the Selenium extractor when only the first page is wanted
+    page_size = 60  # Listings per results page, requested explicitly as _ipg (eBay allows 60, 120 or 240)
+
     def __init__(self):
-        self.base_url = "https://www.ebay.com"
-        self.search_url = "https://www.ebay.com/sch/i.html"
-        self.session = requests.Session()
-        self.ua = UserAgent()
-        
-        # Set headers to mimic a real browser
-        self.session.headers.update({
-            'User-Agent': self.ua.random,
+        # EBAY_BASE_URL points the scraper at a stand-in such as mock_marketplace.py
+        self.base_url = os.getenv('EBAY_BASE_URL', "https://www.ebay.com").rstrip('/')
+        self.search_url = f"{self.base_url}/sch/i.html"
+        self.fingerprint = None  # Circuit breaker generation the session was built for
+        self.session = self._build_session()
+        self.driver = True  # No browser needed; keeps the scheduler's driver check happy
+
+    def _build_session(self):
+        """Keep-alive session with a connection pool sized for concurrent workers"""
+        self.fingerprint = circuit_breakers.generation('eBay')
+        session = requests.Session()
+        pool_size = int(os.getenv('EBAY_HTTP_POOL_SIZE', '10'))
+        retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504), allowed_methods=('GET',))
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=retry)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({
+            'User-Agent': circuit_breakers.user_agent('eBay'),
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
+            'Accept-Language': 'en-US,en;q=0.9',
             'Accept-Encoding': 'gzip, deflate',
             'Connection': 'keep-alive',
             'Upgrade-Insecure-Requests': '1',
         })
-    
-    def search_listings(self, search_terms, max_pages=3):
-        """Search eBay for listings matching the given search terms"""
+        return session
+
+    def search_listings(self, search_terms, max_pages=1, term_delay=0, watermarks=None):
+        """Search eBay for listings matching the given search terms
+
+        ``term_delay`` is accepted for interface parity - every page request
+        is paced by the shared rate limiter. With a WatermarkStore, each term
+        stops at its already-seen listings and only pages through while every
+        card is new. Terms are skipped while eBay is paused by the challenge
+        circuit breaker.
+        """
         all_listings = []
-        
-        for search_term in search_terms:
-            logger.info(f"Searching eBay for: {search_term}")
-            
+
+        for i, search_term in enumerate(search_terms):
+            if not circuit_breakers.allow('eBay'):
+                logger.warning(f"eBay is paused after repeated challenge pages - skipping {len(search_terms) - i} terms")
+                break
+            if self.fingerprint != circuit_breakers.generation('eBay'):
+                # Resuming after a pause: drop the challenged session's cookies and user agent
+                self.session.close()
+                self.session = self._build_session()
+            logger.info(f"Searching eBay (HTTP) for: {search_term}")
+            watermark = watermarks.get('eBay', search_term) if watermarks is not None else None
+
             try:
-                listings = self._search_single_term(search_term, max_pages)
-                all_listings.extend(listings)
-                
-                # Be respectful - add delay between searches
-                time.sleep(2)
-                
+                listings = self._search_single_term(search_term, max_pages, watermark)
+                circuit_breakers.record_success('eBay')
+            except ChallengePageError as e:
+                logger.warning(f"eBay challenge for '{search_term}' ({e}), falling back to Selenium")
+                metrics.challenge_pages.inc(platform='eBay')
+                if watermark is not None:
+                    watermark.fail()  # Pages read before the challenge are not returned
+                listings = self._search_with_selenium(search_term, max_pages, watermarks)
             except Exception as e:
                 logger.error(f"Error searching for '{search_term}': {e}")
-                continue
-        
+                if watermark is not None:
+                    watermark.fail()
+                listings = []
+            all_listings.extend(listings)
+
         logger.info(f"Found {len(all_listings)} total eBay listings")
-        
-        # Debug: Log first few listings if any found
-        if all_listings:
-            logger.info("Sample eBay listings found:")
-            for i, listing in enumerate(all_listings[:3]):
-                logger.info(f"  {i+1}. {listing['title'][:50]}... - {listing['price']}")
-        
         return all_listings
-    
-    def _search_single_term(self, search_term, max_pages):
+
+    def _search_single_term(self, search_term, max_pages, watermark=None):
         """Search for a single term and return listings"""
         listings = []
-        
+
+        # Newest-only mode reads the first 25 cards; deeper searches and watermarked
+        # searches (which stop at known listings on their own) read whole pages
+        limit = self.max_items_per_page if max_pages == 1 and watermark is None else None
+
         for page in range(1, max_pages + 1):
-            try:
-                page_listings = self._get_page_listings(search_term, page)
-                listings.extend(page_listings)
-                
-                # If we got fewer than expected results, we might be on the last page
-                if len(page_listings) < 50:  # eBay typically shows 50 items per page
-                    break
-                    
-                time.sleep(1)  # Be respectful
-                
-            except Exception as e:
-                logger.error(f"Error getting page {page} for '{search_term}': {e}")
+            if watermark is not None:
+                watermark.new_page()
+            page_listings, item_count = self._get_page_listings(search_term, page, limit, watermark)
+            listings.extend(page_listings)
+
+            # If the page was not full we are on the last page
+            if item_count < self.page_size:
                 break
-        
+            if watermark is not None and not watermark.want_next_page:
+                break
+
+        logger.info(f"Found {len(listings)} listings for '{search_term}'")
         return listings
-    
-    def _get_page_listings(self, search_term, page):
-        """Get listings from a specific page"""
+
+    def _get_page_listings(self, search_term, page, limit=None, watermark=None):
+        """Fetch and parse one search results page, returning (listings, items on page)"""
         params = {
             '_nkw': search_term,
             '_pgn': page,
+            '_ipg': self.page_size,
             '_sop': 10  # Sort by newly listed
         }
-        
+
+        rate_limiter.acquire(self.search_url)
         try:
-            response = self.session.get(self.search_url, params=params, timeout=10)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
-            return self._parse_listings(soup, search_term)
-            
+            with cycle_profiler.span('http.get'):
+                response = self.session.get(self.search_url, params=params, timeout=15)
         except requests.RequestException as e:
-            logger.error(f"Request failed for page {page}: {e}")
-            return []
-    
-    def _parse_listings(self, soup, search_term):
-        """Parse listings from the search results page"""
+            logger.error(f"Request failed for '{search_term}' page {page}: {e}")
+            return [], 0
+
+        challenged = self._is_challenge(response)
+        rate_limiter.observe(self.search_url, response.status_code, challenged)
+        if challenged:
+            raise ChallengePageError(response.url)
+        if response.status_code != 200:
+            logger.error(f"eBay returned status {response.status_code} for '{search_term}' page {page}")
+            return [], 0
+
+        return self._parse_listings(response.content, search_term, limit, watermark)
+
+    def _is_challenge(self, response):
+        """Detect eBay's bot-challenge interstitials"""
+        if any(marker in response.url for marker in CHALLENGE_MARKERS):
+            return True
+        if any(marker in r.headers.get('Location', '') for r in response.history for marker in CHALLENGE_MARKERS):
+            return True
+        if response.status_code in (403, 429):
+            return True
+        # Some challenges are served in place with a 200
+        return b'splashui' in response.content[:20000] and b's-item' not in response.content and b's-card' not in response.content
+
+    @cycle_profiler.timed('http.parse')
+    def _parse_listings(self, content, search_term, limit=None, watermark=None):
+        """Parse listings from the search results page, returning (listings, items on page)"""
         listings = []
-        
-        # Find all listing items - eBay uses dynamic class names
-        listing_items = soup.find_all('div', class_=lambda x: x and 's-item' in x)
-        
-        for item in listing_items:
+        seen_ids = set()
+        tree = lxml_html.fromstring(content)
+
+        for item in ITEM_XPATH(tree):
+            if limit is not None and len(seen_ids) >= limit:
+                break
+            if watermark is not None and watermark.reached:
+                break
             try:
-                listing_data = self._extract_listing_data(item, search_term)
+                listing_data = self._extract_listing_data(item, search_term, seen_ids, watermark)
                 if listing_data:
                     listings.append(listing_data)
             except Exception as e:
                 logger.debug(f"Error parsing listing: {e}")
+                if watermark is not None:
+                    watermark.fail()  # The card may have been observed without being returned
                 continue
-        
-        return listings
-    
-    def _extract_listing_data(self, item, search_term):
-        """Extract data from a single listing item"""
-        try:
-            # Get listing ID from the item
-            listing_id = None
-            link_elem = item.find('a', {'class': 's-item__link'})
-            if link_elem:
-                href = link_elem.get('href', '')
-                # Extract item ID from URL
-                id_match = re.search(r'/itm/(\d+)', href)
-                if id_match:
-                    listing_id = id_match.group(1)
-            
-            if not listing_id:
-                return None
-            
-            # Get title - try multiple selectors
-            title_elem = (item.find('h3', {'class': 's-item__title'}) or 
-                         item.find('h3') or 
-                         item.find('h2') or 
-                         item.find('a', {'class': 's-item__link'}))
-            title = title_elem.get_text(strip=True) if title_elem else "No title"
-            
-            # Skip if it's not a real listing (eBay sometimes shows ads)
-            if "Shop on eBay" in title or "Daily Deals" in title:
-                return None
-            
-            # Get price - try multiple selectors
-            price_elem = (item.find('span', {'class': 's-item__price'}) or 
-                         item.find('span', class_=lambda x: x and 'price' in x.lower()) or
-                         item.find('span', class_=lambda x: x and 'cost' in x.lower()))
-            price = price_elem.get_text(strip=True) if price_elem else "Price not available"
-            
-            # Get image URL
-            img_elem = item.find('img', {'class': 's-item__image'})
-            image_url = img_elem.get('src', '') if img_elem else ''
-            
-            # Convert relative URLs to absolute
+
+        return listings, len(seen_ids)
+
+    def _extract_listing_data(self, item, search_term, seen_ids, watermark=None):
+        """Extract data from a single listing card"""
+        links = LINK_XPATH(item)
+        if not links:
+            return None
+        href = links[0].get('href', '')
+        id_match = ITEM_ID_RE.search(href)
+        if not id_match:
+            return None
+        listing_id = id_match.group(1)
+        # Nested s-item wrappers match the item selector more than once per card
+        if listing_id in seen_ids:
+            return None
+
+        titles = TITLE_XPATH(item)
+        title = titles[0].text_content().strip() if titles else ''
+        if not title or 'Shop on eBay' in title or 'Daily Deals' in title:
+            return None
+        seen_ids.add(listing_id)
+        if watermark is not None and watermark.observe(listing_id):
+            return None
+
+        prices = PRICE_XPATH(item)
+        price = prices[0].text_content().strip() if prices else 'Price not available'
+
+        image_url = ''
+        images = IMAGE_XPATH(item)
+        if images:
+            image_url = images[0].get('src') or images[0].get('data-src') or ''
             if image_url.startswith('//'):
                 image_url = 'https:' + image_url
             elif image_url.startswith('/'):
-                image_url = urljoin(self.base_url, image_url)
-            
-            # Get listing URL
-            listing_url = link_elem.get('href', '') if link_elem else ''
-            if listing_url.startswith('/'):
-                listing_url = urljoin(self.base_url, listing_url)
-            
-            # Filter for Champion reverse weave items
-            if not self._is_champion_reverse_weave(title):
-                logger.debug(f"Filtered out: {title[:50]}... (not Champion reverse weave)")
-                return None
-            
-            return {
-                'listing_id': listing_id,
-                'platform': 'eBay',
-                'title': title,
-                'price': price,
-                'url': listing_url,
-                'image_url': image_url,
-                'search_term': search_term
-            }
-            
-        except Exception as e:
-            logger.debug(f"Error extracting listing data: {e}")
+                image_url = 'https://i.ebayimg.com' + image_url
+
+        if href.startswith('/'):
+            href = urljoin(self.base_url, href)
+
+        # Filter items based on search term to ensure relevance
+        if not self._matches_search_term(title.lower(), search_term):
             return None
-    
-    def _is_champion_reverse_weave(self, title):
-        """Check if the title indicates this is a Champion reverse weave item"""
-        title_lower = title.lower()
-        
-        # Must contain "champion" and "reverse weave"
-        champion_keywords = ['champion']
-        reverse_weave_keywords = ['reverse weave', 'reverse-weave', 'reverseweave']
-        
-        has_champion = any(keyword in title_lower for keyword in champion_keywords)
-        has_reverse_weave = any(keyword in title_lower for keyword in reverse_weave_keywords)
-        
-        # Additional filters to avoid irrelevant items
-        exclude_keywords = ['not champion', 'like champion', 'similar to champion', 'champion style']
-        has_exclude = any(keyword in title_lower for keyword in exclude_keywords)
-        
-        return has_champion and has_reverse_weave and not has_exclude
+
+        return {
+            'listing_id': listing_id,
+            'platform': 'eBay',
+            'title': title,
+            'price': price,
+            'url': href,
+            'image_url': image_url,
+            'search_term': search_term
+        }
+
+    @cycle_profiler.timed('match')
+    def _matches_search_term(self, title, search_term):
+        """Same relevance filter as the Selenium scraper"""
+        return matches_search_term(title, search_term)
+
+    def _search_with_selenium(self, search_term, max_pages, watermarks=None):
+        """Run one term through a warm pooled Selenium browser after a challenge
+
+        The browser reports its own outcome to the circuit breaker; without one
+        the HTTP challenge counts.
+        """
+        if not circuit_breakers.allow('eBay'):
+            return []
+        try:
+            with default_pool().lease('eBay') as scraper:
+                if scraper.driver is not None:
+                    return scraper.search_listings([search_term], max_pages=max_pages, term_delay=0, watermarks=watermarks)
+        except Exception as e:
+            logger.error(f"Selenium fallback failed for '{search_term}': {e}")
+        circuit_breakers.record_challenge('eBay', f"'{search_term}' over HTTP, no Selenium fallback")
+        return []
+
+    def close(self):
+        """Release pooled connections"""
+        self.session.close()
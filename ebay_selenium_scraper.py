@@ -5,8 +5,6 @@ from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, NoSuchElementException
 from webdriver_manager.chrome import ChromeDriverManager
 import time
@@ -14,18 +12,36 @@ import logging
 import re
 import os
 from urllib.parse import urljoin
+from page_readiness import page_readiness
+from browser_pool import recycle_tab
+from memory_watchdog import memory_watchdog
+from rate_limiter import rate_limiter
+from circuit_breaker import circuit_breakers
+from listing_matcher import matches_search_term
+from cycle_profiler import cycle_profiler
+from metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+# Search result cards, old (s-item) and current (s-card) eBay layouts
+LISTING_CARD_SELECTOR = "li.s-card, li[class*='s-card'], div[class*='s-item'], div.s-item, li.s-item"
+
 class EbaySeleniumScraper:
+    platform = 'eBay'
+    
     def __init__(self):
-        self.base_url = "https://www.ebay.com"
+        self.base_url = os.getenv('EBAY_BASE_URL', "https://www.ebay.com").rstrip('/')
         self.driver = None
+        self.fingerprint = None  # Circuit breaker generation the browser was started for
         self.setup_driver()
     
+    @cycle_profiler.timed('selenium.setup_driver')
     def setup_driver(self):
         """Setup Chrome driver with stealth options"""
         chrome_options = Options()
+        # A new fingerprint (user agent and fresh profile) after every challenge pause
+        self.fingerprint = circuit_breakers.generation(self.platform)
+        user_agent = circuit_breakers.user_agent(self.platform)
         
         # Resource-optimized options for Railway/Docker
         chrome_options.add_argument('--no-sandbox')
@@ -47,7 +63,7 @@ class EbaySeleniumScraper:
         chrome_options.add_argument('--disable-blink-features=AutomationControlled')
         chrome_options.add_argument('--disable-web-security')
         chrome_options.add_argument('--disable-features=VizDisplayCompositor')
-        chrome_options.add_argument('--user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
+        chrome_options.add_argument(f'--user-agent={user_agent}')
         
         # Use headless mode in server environments (Docker, cloud platforms)
         # Set HEADLESS=false in .env to disable headless mode for local debugging
@@ -158,7 +174,7 @@ class EbaySeleniumScraper:
             # Execute stealth scripts
             self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
             self.driver.execute_cdp_cmd('Network.setUserAgentOverride', {
-                "userAgent": 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+                "userAgent": user_agent
             })
             
             # Set window size to look more natural
@@ -170,8 +186,13 @@ class EbaySeleniumScraper:
             logger.info("Make sure Chrome is installed")
             self.driver = None
     
-    def search_listings(self, search_terms, max_pages=2):
-        """Search eBay for listings using Selenium"""
+    def search_listings(self, search_terms, max_pages=2, term_delay=0, watermarks=None):
+        """Search eBay for listings using Selenium
+
+        ``term_delay`` is accepted for interface parity - page loads are paced
+        by the shared rate limiter. Stops while eBay is paused by the challenge
+        circuit breaker, and restarts Chrome with the new fingerprint when it resumes.
+        """
         if not self.driver:
             logger.error("Driver not initialized")
             return []
@@ -179,45 +200,59 @@ class EbaySeleniumScraper:
         all_listings = []
         
         for i, search_term in enumerate(search_terms):
+            if not circuit_breakers.allow(self.platform):
+                logger.warning(f"eBay is paused after repeated challenge pages - skipping {len(search_terms) - i} terms")
+                break
+            if self.fingerprint != circuit_breakers.generation(self.platform):
+                logger.info("Restarting Chrome with a new fingerprint after the challenge pause")
+                self.close()
+                self.setup_driver()
+                metrics.driver_restarts.inc(platform=self.platform)
+                if self.driver is None:
+                    logger.error("Failed to restart eBay driver")
+                    break
             logger.info(f"Searching eBay with Selenium for: {search_term}")
             
             try:
-                listings = self._search_single_term_selenium(search_term, max_pages)
+                watermark = watermarks.get(self.platform, search_term) if watermarks is not None else None
+                listings = self._search_single_term_selenium(search_term, max_pages, watermark)
                 all_listings.extend(listings)
                 
-                # Restart driver every 5 searches to prevent tab crashes (memory issues)
-                if (i + 1) % 5 == 0 and (i + 1) < len(search_terms):
-                    logger.info("Restarting eBay driver to prevent tab crashes")
-                    self.close()
-                    time.sleep(3)
-                    self.setup_driver()
+                # Recycle the browser when its measured memory crosses BROWSER_RSS_LIMIT_MB
+                # (prevents tab crashes); without RSS readings fall back to every 5 searches
+                if (i + 1) < len(search_terms) and self._should_recycle(i + 1, 5):
+                    self._recycle_tab()
                     if self.driver is None:
                         logger.error("Failed to restart eBay driver")
                         break
                 
-                # Be respectful - add delay between searches
-                time.sleep(3)
-                
             except Exception as e:
+                if watermarks is not None:
+                    watermarks.fail(self.platform, [search_term])
                 error_msg = str(e)
                 # Check if it's a tab crash or session error
                 if 'tab crashed' in error_msg.lower() or 'session' in error_msg.lower() or 'invalid session' in error_msg.lower():
                     logger.warning(f"Tab/session error for '{search_term}'. Attempting to restart driver...")
+                    metrics.tab_crashes.inc(platform=self.platform)
                     try:
                         self.close()
                         time.sleep(3)
                         self.setup_driver()
+                        metrics.driver_restarts.inc(platform=self.platform)
                         if self.driver is None:
                             logger.error(f"Failed to restart driver after error for '{search_term}'. Skipping this search term.")
                             continue  # Skip this term instead of breaking
                         # Retry the search after restart (only once)
                         try:
                             logger.info(f"Retrying search for '{search_term}' after driver restart...")
-                            listings = self._search_single_term_selenium(search_term, max_pages)
+                            watermark = watermarks.get(self.platform, search_term) if watermarks is not None else None
+                            listings = self._search_single_term_selenium(search_term, max_pages, watermark)
                             all_listings.extend(listings)
                             logger.info(f"Successfully retried search for '{search_term}'")
                         except Exception as retry_error:
                             logger.error(f"Retry failed for '{search_term}': {retry_error}. Skipping this search term.")
+                            if watermarks is not None:
+                                watermarks.fail(self.platform, [search_term])
                             continue  # Skip this term after failed retry
                     except Exception as restart_error:
                         logger.error(f"Failed to restart driver for '{search_term}': {restart_error}. Skipping this search term.")
@@ -229,7 +264,7 @@ class EbaySeleniumScraper:
         logger.info(f"Found {len(all_listings)} total eBay listings with Selenium")
         return all_listings
     
-    def _search_single_term_selenium(self, search_term, max_pages):
+    def _search_single_term_selenium(self, search_term, max_pages, watermark=None):
         """Search for a single term using Selenium"""
         listings = []
         
@@ -243,10 +278,12 @@ class EbaySeleniumScraper:
             search_url = f"{self.base_url}/sch/i.html?_nkw={search_term.replace(' ', '+')}&_sop=10"
             logger.info(f"Navigating to: {search_url}")
             
+            rate_limiter.acquire(search_url)
             try:
                 # Set page load timeout to prevent hanging
                 self.driver.set_page_load_timeout(30)
-                self.driver.get(search_url)
+                with cycle_profiler.span('selenium.get'):
+                    self.driver.get(search_url)
             except Exception as nav_error:
                 error_msg = str(nav_error).lower()
                 if 'tab crashed' in error_msg or 'session' in error_msg or 'timeout' in error_msg:
@@ -254,31 +291,37 @@ class EbaySeleniumScraper:
                     raise  # Re-raise to trigger restart in search_listings
                 raise
             
-            # Wait for page to load and JavaScript to execute
-            time.sleep(5)
-            
-            # Wait for listings to appear
-            try:
-                WebDriverWait(self.driver, 10).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, "div[class*='s-item']"))
-                )
-            except TimeoutException:
+            # Wait until the listing cards render and the DOM settles, bounded by
+            # the learned per-site load time (hard ceiling READINESS_CEILING)
+            readiness = page_readiness.wait_for_listings(
+                self.driver, 'eBay', LISTING_CARD_SELECTOR, abort_url_markers=('challenge', 'splashui')
+            )
+            if not readiness['ready'] and not readiness['aborted']:
                 logger.warning("Timeout waiting for listings to load")
             
             # Check if we got redirected to a challenge page
             current_url = self.driver.current_url
-            if 'challenge' in current_url or 'splashui' in current_url:
+            challenged = 'challenge' in current_url or 'splashui' in current_url
+            rate_limiter.observe(search_url, challenge=challenged)
+            if challenged:
                 logger.warning(f"Redirected to challenge page: {current_url}")
+                metrics.challenge_pages.inc(platform=self.platform)
+                circuit_breakers.record_challenge(self.platform, current_url)
                 return []
+            circuit_breakers.record_success(self.platform)
             
             # Try to find listings with multiple approaches
-            listings = self._extract_listings_selenium(search_term)
+            listings = self._extract_listings_selenium(search_term, watermark)
             
             logger.info(f"Found {len(listings)} listings for '{search_term}'")
             
         except TimeoutException:
             logger.warning(f"Timeout waiting for page to load for '{search_term}'")
+            if watermark is not None:
+                watermark.fail()
         except Exception as e:
+            if watermark is not None:
+                watermark.fail()
             error_msg = str(e).lower()
             if 'tab crashed' in error_msg or 'session' in error_msg:
                 logger.error(f"Tab crashed in Selenium search for '{search_term}': {e}")
@@ -287,7 +330,7 @@ class EbaySeleniumScraper:
         
         return listings
     
-    def _extract_listings_selenium(self, search_term):
+    def _extract_listings_selenium(self, search_term, watermark=None):
         """Extract listings using Selenium - optimized for speed"""
         listings = []
         
@@ -345,7 +388,8 @@ class EbaySeleniumScraper:
             # Temporarily disable implicit wait for faster execution
             self.driver.implicitly_wait(0)
             try:
-                items_data = self.driver.execute_script(script)
+                with cycle_profiler.span('selenium.extract'):
+                    items_data = self.driver.execute_script(script)
             finally:
                 self.driver.implicitly_wait(2)  # Restore to 2 seconds
             
@@ -357,6 +401,12 @@ class EbaySeleniumScraper:
             
             # Process the extracted data
             for item_data in items_data:
+                # Cards are newest first - stop once the search's known listings are reached
+                if watermark is not None:
+                    if watermark.reached:
+                        break
+                    if watermark.observe(item_data['id']):
+                        continue
                 try:
                     # Filter items based on search term
                     if not self._matches_search_term(item_data.get('title', '').lower(), search_term):
@@ -373,12 +423,16 @@ class EbaySeleniumScraper:
                     })
                 except Exception as e:
                     logger.debug(f"Error processing item data: {e}")
+                    if watermark is not None:
+                        watermark.fail()
                     continue
             
             logger.info(f"Found {len(listings)} listings for '{search_term}'")
                     
         except Exception as e:
             logger.error(f"Error extracting listings: {e}")
+            if watermark is not None:
+                watermark.fail()  # The slower fallback extraction does not consult it
             # Fallback to slower method if JavaScript fails
             logger.info("Falling back to slower extraction method...")
             return self._extract_listings_selenium_fallback(search_term)
@@ -547,84 +601,34 @@ class EbaySeleniumScraper:
             logger.debug(f"Error extracting item data: {e}")
             return None
     
+    @cycle_profiler.timed('match')
     def _matches_search_term(self, title, search_term):
-        """Check if the title matches the search term criteria"""
-        title_lower = title.lower()
-        search_lower = search_term.lower()
-        
-        # Extract key brand/product words from search term
-        search_words = search_lower.split()
-        
-        # Define category patterns
-        champion_patterns = ['champion']
-        reverse_weave_patterns = ['reverse weave', 'reverse-weave', 'reverseweave']
-        north_face_patterns = ['north face', 'northface']
-        puffer_patterns = ['puffer', 'down jacket', 'down', 'nuptse', 'mountain jacket']
-        levi_patterns = ['levi', 'levis', 'levi\'s']
-        pendleton_patterns = ['pendleton']
-        board_shirt_patterns = ['board shirt', 'wool shirt', 'flannel']
-        loop_collar_patterns = ['loop collar', 'loop-collar']
-        vintage_patterns = ['vintage', '80s', '90s', 'retro']
-        usa_patterns = ['made in usa', 'made in u.s.a.', 'usa', 'u.s.a.']
-        
-        # Check for exclude keywords
-        exclude_keywords = ['not ', 'like ', 'similar to ', ' style', 'inspired']
-        if any(exclude in title_lower for exclude in exclude_keywords):
-            # Check if it's a false positive (e.g., "not champion" but still relevant)
-            if 'not champion' in title_lower and 'champion' not in search_lower:
-                return False
-        
-        # Champion Reverse Weave matching
-        if 'champion' in search_lower and 'reverse' in search_lower:
-            has_champion = any(p in title_lower for p in champion_patterns)
-            has_reverse_weave = any(p in title_lower for p in reverse_weave_patterns)
-            return has_champion and has_reverse_weave
-        
-        # North Face matching
-        if any(nf in search_lower for nf in north_face_patterns):
-            has_north_face = any(p in title_lower for p in north_face_patterns)
-            # If search includes puffer/down, require it
-            if any(p in search_lower for p in puffer_patterns):
-                has_puffer = any(p in title_lower for p in puffer_patterns)
-                return has_north_face and has_puffer
-            return has_north_face
-        
-        # Levi's matching
-        if any(levi in search_lower for levi in levi_patterns):
-            has_levi = any(p in title_lower for p in levi_patterns)
-            # If search includes "black", require it
-            if 'black' in search_lower:
-                has_black = 'black' in title_lower
-                if not has_black:
-                    return False
-            # If search includes "made in usa", require it
-            if 'usa' in search_lower or 'made in' in search_lower:
-                has_usa = any(p in title_lower for p in usa_patterns)
-                if not has_usa:
-                    return False
-            return has_levi
-        
-        # Pendleton matching
-        if any(pend in search_lower for pend in pendleton_patterns):
-            has_pendleton = any(p in title_lower for p in pendleton_patterns)
-            # If search includes board shirt or loop collar, prefer it
-            if 'board shirt' in search_lower or 'loop collar' in search_lower:
-                has_specific = any(p in title_lower for p in board_shirt_patterns + loop_collar_patterns)
-                return has_pendleton and (has_specific or 'shirt' in title_lower)
-            return has_pendleton
-        
-        # Generic matching: require at least 2 key words from search term
-        # (excluding common words like "vintage", "80s", etc.)
-        important_words = [w for w in search_words if w not in ['vintage', '80s', '90s', 'the', 'a', 'an', 'and', 'or']]
-        if len(important_words) >= 2:
-            matches = sum(1 for word in important_words if word in title_lower)
-            return matches >= 2
-        
-        # Fallback: require at least one key word
-        return any(word in title_lower for word in important_words if len(word) > 3)
+        """Check if the title matches the search term criteria (rules are compiled once per term)"""
+        return matches_search_term(title, search_term)
+    
+    def _should_recycle(self, searches_done, fallback_every):
+        """True when the browser is over the RSS limit (or, if unmeasurable, on a fixed interval)"""
+        rss_mb = memory_watchdog.sample_mb(self)
+        if rss_mb is None:
+            return searches_done % fallback_every == 0
+        if rss_mb > memory_watchdog.limit_mb:
+            logger.info(f"Browser at {rss_mb:.0f} MB exceeds {memory_watchdog.limit_mb:.0f} MB limit - recycling")
+            memory_watchdog.record_recycle()
+            return True
+        return False
+
+    def _recycle_tab(self):
+        """Release renderer memory by replacing the tab, restarting Chrome only if that fails"""
+        try:
+            recycle_tab(self.driver)
+        except Exception as e:
+            logger.warning(f"eBay tab recycle failed ({e}), restarting driver")
+            self.close()
+            self.setup_driver()
     
     def close(self):
         """Close the browser driver"""
         if self.driver:
             self.driver.quit()
             logger.info("Chrome driver closed")
+            self.driver = None
@@ -0,0 +1,262 @@
+# Email delivery
+# Sends notification batches over a persistent Resend session or SMTP connection,
+# concurrently where the transport allows, remembering which transport last worked
+
+import os
+import ssl
+import base64
+import time
+import smtplib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.mime.image import MIMEImage
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cycle_profiler import cycle_profiler
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+RESEND_URL = "https://api.resend.com/emails"
+
+
+class RateLimitedError(Exception):
+    """Resend kept answering 429 after every retry"""
+
+
+class EmailDelivery:
+    """Delivers rendered emails through Resend or SMTP
+
+    Transports are tried in order (Resend, SMTP with STARTTLS on 587, SMTP over
+    SSL on 465) and the first one that succeeds is tried first for every later
+    message. The Resend session and the SMTP login are kept open across
+    batches and cycles. Resend messages go out on up to ``concurrency``
+    threads; a 429 pauses every sender for the advertised Retry-After (or an
+    exponential backoff). SMTP messages share one connection and are sent one
+    at a time.
+    """
+
+    def __init__(self, concurrency=None, max_retries=None):
+        self.resend_api_key = os.getenv('RESEND_API_KEY')
+        self.recipient_email = os.getenv('RECIPIENT_EMAIL')
+        self.from_email = os.getenv('RESEND_FROM_EMAIL', 'onboarding@resend.dev')
+        self.smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
+        self.smtp_port = int(os.getenv('SMTP_PORT', '587'))
+        self.email_user = os.getenv('EMAIL_USER')
+        self.email_password = os.getenv('EMAIL_PASSWORD')
+        self.concurrency = max(1, int(concurrency if concurrency is not None else os.getenv('EMAIL_CONCURRENCY', '4')))
+        self.max_retries = int(max_retries if max_retries is not None else os.getenv('EMAIL_MAX_RETRIES', '5'))
+
+        self.transport = None  # Last transport that delivered a message
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._smtp = None
+        self._smtp_mode = None
+        self._smtp_lock = threading.Lock()
+        self._pause_until = 0.0
+        self._pause_lock = threading.Lock()
+
+    def available_transports(self):
+        """Configured transports, the last successful one first"""
+        transports = []
+        if self.resend_api_key and self.recipient_email:
+            transports.append('resend')
+        if self.email_user and self.email_password and self.recipient_email:
+            if self.smtp_port == 587:
+                transports.append('smtp_starttls')
+            transports.append('smtp_ssl')
+        if self.transport in transports:
+            transports.remove(self.transport)
+            transports.insert(0, self.transport)
+        return transports
+
+    def send_all(self, messages):
+        """Deliver [(subject, html, text, attachments, idempotency_key)] and return per-message success
+
+        The first message settles the transport; the rest are then sent
+        concurrently over it (falling back per message if it stops working).
+        The idempotency key lets Resend drop a message it already accepted.
+        ``attachments`` is a list of (content_id, jpeg bytes) inline images.
+        """
+        if not messages:
+            return []
+        if not self.available_transports():
+            logger.error("Email configuration missing - set RESEND_API_KEY or EMAIL_USER/EMAIL_PASSWORD, and RECIPIENT_EMAIL")
+            return [False] * len(messages)
+
+        started = time.monotonic()
+        results = [self._deliver(*messages[0], label=f"1/{len(messages)}")]
+        rest = messages[1:]
+        if rest:
+            workers = self.concurrency if self.transport == 'resend' else 1
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='email') as executor:
+                results.extend(executor.map(
+                    lambda item: self._deliver(*item[1], label=f"{item[0] + 2}/{len(messages)}"),
+                    enumerate(rest)
+                ))
+
+        logger.info(f"Delivered {sum(results)}/{len(messages)} email(s) via {self.transport or 'no transport'} in {time.monotonic() - started:.1f}s")
+        return results
+
+    @cycle_profiler.timed('email.send')
+    def _deliver(self, subject, html, text=None, attachments=None, idempotency_key=None, label=''):
+        started = time.monotonic()
+        for transport in self.available_transports():
+            try:
+                if transport == 'resend':
+                    self._send_via_resend(subject, html, text, attachments, idempotency_key)
+                else:
+                    self._send_via_smtp(transport, subject, html, text, attachments, idempotency_key)
+            except Exception as e:
+                logger.error(f"Email {label} failed via {transport}: {e}")
+                continue
+            if self.transport != transport:
+                logger.info(f"Email transport selected: {transport}")
+                self.transport = transport
+            logger.info(f"Email {label} sent successfully via {transport}")
+            metrics.email_seconds.observe(time.monotonic() - started, transport=transport)
+            return True
+
+        metrics.email_failures.inc()
+        logger.error(f"Failed to send email {label} after all transports (SMTP server: {self.smtp_server}, port: {self.smtp_port})")
+        if 'resend' not in self.available_transports():
+            logger.error("Consider using Resend API (RESEND_API_KEY) which works better with Railway")
+        return False
+
+    def _resend_session(self):
+        with self._session_lock:
+            if self._session is None:
+                session = requests.Session()
+                session.headers.update({
+                    "Authorization": f"Bearer {self.resend_api_key}",
+                    "Content-Type": "application/json"
+                })
+                adapter = HTTPAdapter(pool_maxsize=self.concurrency)
+                session.mount('https://', adapter)
+                self._session = session
+            return self._session
+
+    def _wait_for_rate_limit(self):
+        with self._pause_lock:
+            delay = self._pause_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _pause(self, seconds):
+        """Hold back every sender thread, not just the one that was rate limited"""
+        with self._pause_lock:
+            self._pause_until = max(self._pause_until, time.monotonic() + seconds)
+
+    def _send_via_resend(self, subject, html, text=None, attachments=None, idempotency_key=None):
+        """Send one email through the Resend API, backing off on 429"""
+        payload = {
+            "from": self.from_email,
+            "to": [self.recipient_email],
+            "subject": subject,
+            "html": html
+        }
+        if text:
+            payload["text"] = text
+        if attachments:
+            payload["attachments"] = [
+                {"filename": f"{cid}.jpg", "content": base64.b64encode(data).decode('ascii'), "content_id": cid}
+                for cid, data in attachments
+            ]
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else None
+        session = self._resend_session()
+
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_rate_limit()
+            response = session.post(RESEND_URL, json=payload, headers=headers, timeout=30)
+            logger.debug(f"Resend API response status: {response.status_code}")
+
+            if response.status_code == 429:
+                try:
+                    delay = float(response.headers.get('retry-after', ''))
+                except ValueError:
+                    delay = min(30.0, 0.5 * 2 ** attempt)
+                logger.warning(f"Resend rate limit hit, backing off {delay:.1f}s (attempt {attempt + 1}/{self.max_retries + 1})")
+                self._pause(delay)
+                continue
+
+            if response.status_code != 200:
+                logger.error(f"Resend API returned status {response.status_code}: {response.text}")
+                response.raise_for_status()
+            return response.json()
+
+        raise RateLimitedError(f"still rate limited after {self.max_retries + 1} attempts")
+
+    def _smtp_connection(self, mode):
+        """The logged-in SMTP connection for mode, reconnecting if needed (caller holds _smtp_lock)"""
+        if self._smtp is not None and self._smtp_mode == mode:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (OSError, smtplib.SMTPException):
+                pass
+        self._close_smtp()
+
+        if mode == 'smtp_starttls':
+            server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=30)
+            server.starttls()
+        else:
+            server = smtplib.SMTP_SSL(self.smtp_server, 465, timeout=30, context=ssl.create_default_context())
+        server.login(self.email_user, self.email_password)
+        self._smtp, self._smtp_mode = server, mode
+        return server
+
+    def _send_via_smtp(self, mode, subject, html, text=None, attachments=None, idempotency_key=None):
+        body = MIMEMultipart('alternative')
+        # The last alternative is the preferred one, so plain text goes first
+        if text:
+            body.attach(MIMEText(text, 'plain'))
+        body.attach(MIMEText(html, 'html'))
+
+        if attachments:
+            # multipart/related ties the cid: references in the HTML to the inline images
+            msg = MIMEMultipart('related')
+            msg.attach(body)
+            for cid, data in attachments:
+                image = MIMEImage(data, 'jpeg')
+                image.add_header('Content-ID', f"<{cid}>")
+                image.add_header('Content-Disposition', 'inline', filename=f"{cid}.jpg")
+                msg.attach(image)
+        else:
+            msg = body
+        msg['Subject'] = subject
+        msg['From'] = self.email_user
+        msg['To'] = self.recipient_email
+        if idempotency_key:
+            # A stable Message-ID lets mail clients collapse a resent batch
+            msg['Message-ID'] = f"<{idempotency_key}@rwscraper>"
+
+        with self._smtp_lock:
+            try:
+                self._smtp_connection(mode).send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                # The server dropped the idle connection between noop and send - log in once more
+                self._close_smtp()
+                self._smtp_connection(mode).send_message(msg)
+
+    def _close_smtp(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (OSError, smtplib.SMTPException):
+            pass
+        self._smtp, self._smtp_mode = None, None
+
+    def close(self):
+        """Log out of SMTP and release pooled HTTP connections"""
+        with self._smtp_lock:
+            self._close_smtp()
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
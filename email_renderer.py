@@ -0,0 +1,190 @@
+# Email renderer
+# Renders notification emails from templates compiled once per process: the
+# static head, CSS and footer are prebuilt strings and each listing is one
+# positional %-substitution, joined at the end instead of concatenated piecewise
+
+import re
+
+EBAY_ITEM_ID_RE = re.compile(r'/itm/(\d+)')
+
+IMAGE_HOSTS = {
+    'ebay': 'https://i.ebayimg.com',
+    'depop': 'https://media.depop.com',
+}
+
+HTML_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+    <style>
+        body { font-family: Arial, sans-serif; margin: 15px; line-height: 1.4; }
+        .header { background: #3498db; color: white; padding: 15px; border-radius: 8px; margin-bottom: 20px; }
+        .search-group { margin: 15px 0; border: 1px solid #ddd; border-radius: 6px; overflow: hidden; }
+        .search-header { background: #f8f9fa; padding: 8px 12px; font-weight: bold; border-bottom: 1px solid #ddd; }
+        .listing { padding: 10px; border-bottom: 1px solid #eee; display: flex; align-items: center; }
+        .listing:last-child { border-bottom: none; }
+        .listing img { width: 80px; height: 80px; object-fit: cover; margin-right: 12px; border-radius: 4px; }
+        .listing-info { flex: 1; }
+        .price { font-size: 16px; font-weight: bold; color: #e74c3c; margin: 2px 0; }
+        .platform { background: #2ecc71; color: white; padding: 2px 6px; border-radius: 3px; font-size: 11px; margin-right: 8px; }
+        .title { font-size: 14px; margin: 2px 0; font-weight: bold; line-height: 1.3; }
+        .url { margin-top: 4px; }
+        .url a { color: #3498db; text-decoration: none; font-size: 12px; }
+        .no-image { width: 80px; height: 80px; background: #ecf0f1; border: 1px solid #bdc3c7; margin-right: 12px; display: flex; align-items: center; justify-content: center; color: #7f8c8d; font-size: 10px; border-radius: 4px; }
+        .summary { background: #f8f9fa; padding: 10px; border-radius: 4px; margin-bottom: 15px; }
+    </style>
+</head>
+<body>
+"""
+
+HEADER_TEMPLATE = """    <div class="header">
+        <h2 style="margin: 0;">🏆 New Vintage Clothing Listings</h2>
+        <p style="margin: 5px 0 0 0;">Found <strong>{count}</strong> new listings across <strong>{groups}</strong> search terms</p>
+{batch_line}    </div>
+"""
+
+BATCH_LINE_TEMPLATE = '        <p style="margin: 5px 0 0 0; font-size: 12px;">📧 Email {batch_num} of {total_batches}</p>\n'
+
+GROUP_OPEN_TEMPLATE = """    <div class="search-group">
+        <div class="search-header">🔍 {term} ({count} listings)</div>
+"""
+
+GROUP_CLOSE = "    </div>\n"
+
+# Positional: image, platform, title, price, url, target attribute
+LISTING_TEMPLATE = """        <div class="listing">
+            %s
+            <div class="listing-info">
+                <span class="platform">%s</span>
+                <div class="title">%s</div>
+                <div class="price">%s</div>
+                <div class="url">
+                    <a href="%s"%s style="color: #3498db; text-decoration: none; font-size: 12px;">View Listing →</a>
+                </div>
+            </div>
+        </div>
+"""
+
+IMAGE_TEMPLATE = '<img src="%s" alt="Listing Image" style="width: 80px; height: 80px; object-fit: cover; border-radius: 4px; display: block;" border="0">'
+NEW_TAB = ' target="_blank"'
+NO_IMAGE = '<div class="no-image">No Image</div>'
+
+HTML_FOOTER = """    <div style="margin-top: 20px; padding: 10px; background: #f8f9fa; border-radius: 4px; text-align: center;">
+        <small>This email was sent by your Vintage Clothing Monitor Bot</small>
+    </div>
+    <div style="margin-top: 10px; padding: 12px; background: #fff3cd; border-radius: 4px; font-size: 11px; color: #856404; line-height: 1.5;">
+        <strong>📱 Opening Links in eBay App:</strong><br>
+        <strong>Gmail limitation:</strong> Gmail on mobile opens all links in Chrome first (this is a Gmail security feature).<br>
+        <strong>Solution:</strong> After the link opens in Chrome, look for the blue "Open in eBay App" banner at the top of the page and tap it.<br>
+        <strong>Alternative:</strong> Use Apple Mail app (iOS) or configure Android: Settings → Apps → eBay → Open by default → Enable "Open supported links"
+    </div>
+</body>
+</html>
+"""
+
+TEXT_FOOTER = "\nThis email was sent by your Vintage Clothing Monitor Bot\n"
+
+
+def escape(text):
+    """HTML-escape text for element content and double-quoted attributes
+
+    Same entities as html.escape(quote=True) minus the apostrophe, but most
+    titles contain none of these characters and skip every replace.
+    """
+    if '&' in text:
+        text = text.replace('&', '&amp;')
+    if '<' in text:
+        text = text.replace('<', '&lt;')
+    if '>' in text:
+        text = text.replace('>', '&gt;')
+    if '"' in text:
+        text = text.replace('"', '&quot;')
+    return text
+
+
+def group_by_term(listings):
+    """Listings grouped by search term, in first-seen order"""
+    grouped = {}
+    for listing in listings:
+        grouped.setdefault(listing['search_term'], []).append(listing)
+    return grouped
+
+
+def image_src(listing):
+    """Absolute image URL (email clients cannot resolve relative ones), or ''"""
+    image_url = listing.get('image_url') or ''
+    if image_url.startswith('//'):
+        return 'https:' + image_url
+    if image_url.startswith('/'):
+        host = IMAGE_HOSTS.get(listing['platform'].lower())
+        return host + image_url if host else image_url
+    return image_url
+
+
+def listing_link(listing):
+    """(url, opens in new tab) for the View Listing link
+
+    eBay items link to the mobile web page, which shows an "Open in App"
+    banner - email clients often block deep links. Depop URLs work as-is.
+    """
+    url = listing.get('url', '')
+    platform = listing['platform'].lower()
+    if platform == 'ebay':
+        item_id = EBAY_ITEM_ID_RE.search(url)
+        if item_id:
+            return f"https://m.ebay.com/itm/{item_id.group(1)}", False
+        return url, True
+    return url, platform != 'depop'
+
+
+def render_html(listings, batch_num=1, total_batches=1, inline_images=None):
+    """HTML body for one batch of listings, grouped by search term
+
+    ``inline_images`` maps image URLs to the Content-IDs of attached
+    thumbnails; those images are referenced as cid: instead of hotlinked.
+    """
+    grouped = group_by_term(listings)
+    batch_line = BATCH_LINE_TEMPLATE.format(batch_num=batch_num, total_batches=total_batches) if total_batches > 1 else ''
+    parts = [HTML_HEAD, HEADER_TEMPLATE.format(count=len(listings), groups=len(grouped), batch_line=batch_line)]
+
+    badges = {}
+    append = parts.append
+    for search_term, term_listings in grouped.items():
+        append(GROUP_OPEN_TEMPLATE.format(term=escape(search_term.title()), count=len(term_listings)))
+        for listing in term_listings:
+            platform = listing['platform']
+            badge = badges.get(platform)
+            if badge is None:
+                badge = badges[platform] = escape(platform.upper())
+            src = image_src(listing)
+            if inline_images and src in inline_images:
+                src = 'cid:' + inline_images[src]
+            url, new_tab = listing_link(listing)
+            append(LISTING_TEMPLATE % (
+                IMAGE_TEMPLATE % escape(src) if src else NO_IMAGE,
+                badge,
+                escape(listing['title']),
+                escape(listing['price']),
+                escape(url),
+                NEW_TAB if new_tab else ''
+            ))
+        append(GROUP_CLOSE)
+
+    parts.append(HTML_FOOTER)
+    return ''.join(parts)
+
+
+def render_text(listings, batch_num=1, total_batches=1):
+    """Plain-text alternative of render_html for clients that do not show HTML"""
+    grouped = group_by_term(listings)
+    parts = [f"New Vintage Clothing Listings\nFound {len(listings)} new listings across {len(grouped)} search terms\n"]
+    if total_batches > 1:
+        parts.append(f"Email {batch_num} of {total_batches}\n")
+
+    for search_term, term_listings in grouped.items():
+        parts.append(f"\n== {search_term.title()} ({len(term_listings)} listings) ==\n")
+        for listing in term_listings:
+            url, _ = listing_link(listing)
+            parts.append(f"\n[{listing['platform'].upper()}] {listing['title']}\n{listing['price']}\n{url}\n")
+
+    parts.append(TEXT_FOOTER)
+    return ''.join(parts)
@@ -0,0 +1,154 @@
+# Listing relevance matcher
+# Compiles each search term once into a rule and evaluates titles against every
+# configured term in a single regex pass
+
+import re
+import threading
+
+# Category patterns (shared by every rule)
+CHAMPION_PATTERNS = ('champion',)
+REVERSE_WEAVE_PATTERNS = ('reverse weave', 'reverse-weave', 'reverseweave')
+NORTH_FACE_PATTERNS = ('north face', 'northface')
+PUFFER_PATTERNS = ('puffer', 'down jacket', 'down', 'nuptse', 'mountain jacket')
+LEVI_PATTERNS = ('levi', 'levis', "levi's")
+PENDLETON_PATTERNS = ('pendleton',)
+BOARD_SHIRT_PATTERNS = ('board shirt', 'wool shirt', 'flannel')
+LOOP_COLLAR_PATTERNS = ('loop collar', 'loop-collar')
+USA_PATTERNS = ('made in usa', 'made in u.s.a.', 'usa', 'u.s.a.')
+
+# Words that don't count towards a generic match
+STOP_WORDS = frozenset(['vintage', '80s', '90s', 'the', 'a', 'an', 'and', 'or'])
+
+NOT_CHAMPION = 'not champion'
+
+
+class SearchTermRule:
+    """A search term compiled into literal requirements on a lower-cased title
+
+    ``requirements`` is a list of (patterns, min_count): at least ``min_count``
+    entries of ``patterns`` (counted with repetition) must occur in the title.
+    """
+
+    def __init__(self, term, requirements, reject_not_champion):
+        self.term = term
+        self.requirements = requirements
+        self.reject_not_champion = reject_not_champion
+        literals = {p for patterns, _ in requirements for p in patterns}
+        if reject_not_champion:
+            literals.add(NOT_CHAMPION)
+        self.literals = frozenset(literals)
+
+    @classmethod
+    def compile(cls, search_term):
+        search_lower = search_term.lower()
+        search_words = search_lower.split()
+        reject_not_champion = 'champion' not in search_lower
+
+        # Champion Reverse Weave
+        if 'champion' in search_lower and 'reverse' in search_lower:
+            requirements = [(CHAMPION_PATTERNS, 1), (REVERSE_WEAVE_PATTERNS, 1)]
+
+        # North Face - if the search includes puffer/down, require it
+        elif any(nf in search_lower for nf in NORTH_FACE_PATTERNS):
+            requirements = [(NORTH_FACE_PATTERNS, 1)]
+            if any(p in search_lower for p in PUFFER_PATTERNS):
+                requirements.append((PUFFER_PATTERNS, 1))
+
+        # Levi's - "black" and "made in usa" in the search are required in the title
+        elif any(levi in search_lower for levi in LEVI_PATTERNS):
+            requirements = [(LEVI_PATTERNS, 1)]
+            if 'black' in search_lower:
+                requirements.append((('black',), 1))
+            if 'usa' in search_lower or 'made in' in search_lower:
+                requirements.append((USA_PATTERNS, 1))
+
+        # Pendleton - board shirt / loop collar searches need a shirt-like title
+        elif any(pend in search_lower for pend in PENDLETON_PATTERNS):
+            requirements = [(PENDLETON_PATTERNS, 1)]
+            if 'board shirt' in search_lower or 'loop collar' in search_lower:
+                requirements.append((BOARD_SHIRT_PATTERNS + LOOP_COLLAR_PATTERNS + ('shirt',), 1))
+
+        else:
+            important_words = tuple(w for w in search_words if w not in STOP_WORDS)
+            if len(important_words) >= 2:
+                # Generic: at least 2 key words from the search term
+                requirements = [(important_words, 2)]
+            else:
+                # Fallback: at least one key word longer than 3 characters
+                requirements = [(tuple(w for w in important_words if len(w) > 3), 1)]
+
+        return cls(search_term, requirements, reject_not_champion)
+
+    def evaluate(self, present):
+        """Decide the match given the set of literals found in the title"""
+        if self.reject_not_champion and NOT_CHAMPION in present:
+            return False
+        for patterns, min_count in self.requirements:
+            if sum(1 for p in patterns if p in present) < min_count:
+                return False
+        return True
+
+    def matches(self, title_lower):
+        """Evaluate against a single title by checking only this rule's literals"""
+        return self.evaluate({literal for literal in self.literals if literal in title_lower})
+
+    @property
+    def signature(self):
+        """Hashable form of the rule - terms with equal signatures accept exactly the same titles"""
+        return (tuple((tuple(patterns), n) for patterns, n in self.requirements), self.reject_not_champion)
+
+
+_rules = {}
+_rules_lock = threading.Lock()
+
+
+def compile_term(search_term):
+    """Compiled rule for a search term, cached for the life of the process"""
+    rule = _rules.get(search_term)
+    if rule is None:
+        rule = SearchTermRule.compile(search_term)
+        with _rules_lock:
+            _rules[search_term] = rule
+    return rule
+
+
+def matches_search_term(title, search_term):
+    """Check if the title matches the search term criteria"""
+    title_lower = title.lower() if isinstance(title, str) else str(title).lower()
+    return compile_term(search_term).matches(title_lower)
+
+
+class ListingMatcher:
+    """Evaluates a title against every configured search term in one pass
+
+    All literals from all rules are combined into one alternation inside a
+    lookahead, so a single scan finds the longest literal starting at each
+    position. Shorter literals are recovered through a precomputed map of
+    which literals are substrings of which.
+    """
+
+    def __init__(self, search_terms):
+        self.rules = [compile_term(term) for term in search_terms]
+        self.rules_by_term = {rule.term: rule for rule in self.rules}
+        literals = sorted({lit for rule in self.rules for lit in rule.literals}, key=len, reverse=True)
+        self._pattern = re.compile('(?=(' + '|'.join(re.escape(lit) for lit in literals) + '))') if literals else None
+        self._implied = {lit: frozenset(other for other in literals if other in lit) for lit in literals}
+
+    def literals_in(self, title_lower):
+        if self._pattern is None:
+            return frozenset()
+        present = set()
+        for hit in set(self._pattern.findall(title_lower)):
+            present |= self._implied[hit]
+        return present
+
+    def match_terms(self, title):
+        """Every configured search term the title matches, in configuration order"""
+        present = self.literals_in(title.lower())
+        return [rule.term for rule in self.rules if rule.evaluate(present)]
+
+    def matches(self, title, search_term):
+        rule = self.rules_by_term.get(search_term)
+        if rule is None:
+            return matches_search_term(title, search_term)
+        return rule.evaluate(self.literals_in(title.lower()))
@@ -4,17 +4,26 @@
 
 import os
 import sqlite3
-import smtplib
-import ssl
 import schedule
 import time
-import requests
-import re
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.image import MIMEImage
+import threading
 from datetime import datetime
 from dotenv import load_dotenv
+from listing_matcher import ListingMatcher
+from query_planner import QueryPlanner
+from watermarks import WatermarkStore
+from poll_scheduler import AdaptivePollScheduler
+from email_delivery import EmailDelivery
+from email_renderer import render_html, render_text, image_src
+from thumbnail_cache import ThumbnailCache
+from outbox import Outbox, OutboxWorker
+from db_schema import migrate, parse_price
+from retention import RetentionJob, retired_key
+from seen_filter import SeenFilter
+from circuit_breaker import circuit_breakers
+from sharding import ShardCoordinator
+from cycle_profiler import cycle_profiler
+from metrics import metrics
 import logging
 
 # Load environment variables
@@ -85,530 +94,583 @@ SEARCH_TERMS = [
     "vintage shadow plaid arrow shirt"
 ]
 
+# SEARCH_TERMS_FILE (one term per line, # for comments) replaces the list above
+if os.getenv('SEARCH_TERMS_FILE'):
+    with open(os.getenv('SEARCH_TERMS_FILE')) as f:
+        SEARCH_TERMS = [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
 class VintageClothingMonitorBot:
+    # SQLite caps bound parameters per statement (999 on older builds)
+    DB_QUERY_CHUNK = 500
+    
     def __init__(self):
         self.db_path = 'champion_listings.db'
+        self.conn = None
+        self.db_lock = threading.RLock()
+        self.last_memory_report = {}
+        self.last_covered_terms = []  # Terms the last scrape searched, fanned-out group members included
+        self.poller = None  # AdaptivePollScheduler, created by start_monitoring
+        self.email_delivery = EmailDelivery()
+        # Thumbnails embedded as inline attachments instead of hotlinked full-size images
+        self.thumbnails = None
+        if os.getenv('INLINE_IMAGES', 'on').lower() != 'off':
+            if ThumbnailCache.available():
+                self.thumbnails = ThumbnailCache()
+            else:
+                logger.warning("Pillow not installed - emails will hotlink listing images")
+        self.matcher = ListingMatcher(SEARCH_TERMS)
+        # Per-platform plans survive across cycles so coverage audits can refine them
+        self.query_planners = {}
+        if os.getenv('QUERY_PLANNING', 'on').lower() != 'off':
+            self.query_planners = {
+                platform: QueryPlanner(SEARCH_TERMS, self.matcher, platform=platform)
+                for platform in ('eBay', 'Depop')
+            }
         self.init_database()
+        # New listings are queued for email in the transaction that marks them seen
+        self.outbox = Outbox(self.conn, self.db_lock)
+        self.outbox_worker = None  # Background sender, started by start_monitoring
+        # Old listings are aged out to hashed IDs so the database stays small
+        self.retention = RetentionJob(self.conn, self.db_lock)
+        # Challenge pauses are kept in the database so they also hold across one-cycle runs
+        circuit_breakers.attach(self.conn, self.db_lock)
+        # Bloom filter in front of the seen-listing lookups; listings it has never seen skip SQLite
+        self.seen_filter = None
+        if os.getenv('SEEN_FILTER', 'on').lower() != 'off':
+            self.seen_filter = SeenFilter(self.conn, self.db_lock)
+        # Newest-first searches stop at the listings they returned in earlier cycles
+        self.watermarks = None
+        if os.getenv('WATERMARK_MODE', 'on').lower() != 'off':
+            self.watermarks = WatermarkStore(self.conn, self.db_lock)
+        # SHARD_WORKERS > 1 hands each cycle's terms to that many worker processes
+        self.shards = None
+        if int(os.getenv('SHARD_WORKERS', '1')) > 1:
+            self.shards = ShardCoordinator(int(os.getenv('SHARD_WORKERS')), planners=self.query_planners.values())
+    
+    def _connect(self):
+        """Open the long-lived SQLite connection shared by all dedup queries"""
+        # isolation_level=None: transactions are managed explicitly so a whole
+        # scraped batch can be inserted under one BEGIN IMMEDIATE
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')  # Only takes effect on a new database; RetentionJob converts old ones
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')  # WAL makes NORMAL crash-safe, avoids an fsync per commit
+        conn.execute('PRAGMA cache_size=-8000')  # ~8 MB page cache
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
         
     def init_database(self):
         """Initialize SQLite database to track seen listings"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS seen_listings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                listing_id TEXT UNIQUE,
-                platform TEXT,
-                title TEXT,
-                price TEXT,
-                url TEXT,
-                image_url TEXT,
-                search_term TEXT,
-                first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
-        logger.info("Database initialized successfully")
+        with self.db_lock:
+            if self.conn is None:
+                self.conn = self._connect()
+            version = migrate(self.conn)
+        logger.info(f"Database initialized successfully (schema version {version})")
+    
+    def close(self):
+        """Shut down pooled browsers, checkpoint the WAL and close the connection"""
+        from browser_pool import default_pool
+        default_pool().shutdown()
+        if self.shards is not None:
+            self.shards.stop()
+        if self.outbox_worker is not None:
+            self.outbox_worker.stop()
+            self.outbox_worker = None
+        self.email_delivery.close()
+        if self.thumbnails is not None:
+            self.thumbnails.close()
+            self.thumbnails = None
+        
+        with self.db_lock:
+            if self.conn is None:
+                return
+            if self.seen_filter is not None:
+                self.seen_filter.save()
+            try:
+                # Fold the WAL back in so copies of champion_listings.db (e.g. the
+                # GitHub Actions artifact) contain every committed row
+                self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            except sqlite3.Error as e:
+                logger.warning(f"WAL checkpoint failed on close: {e}")
+            self.conn.close()
+            self.conn = None
     
     def is_database_empty(self):
         """Check if the database is empty (new deployment)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM seen_listings')
-        count = cursor.fetchone()[0]
-        conn.close()
-        return count == 0
+        with self.db_lock:
+            listing = self.conn.execute('SELECT 1 FROM seen_listings LIMIT 1').fetchone()
+            retired = self.conn.execute('SELECT 1 FROM retired_listings LIMIT 1').fetchone()
+        return listing is None and retired is None
     
-    def seed_database_with_current_listings(self):
-        """On first run after deployment, scrape and mark all current listings as seen without sending emails"""
-        logger.info("Database appears empty - seeding with current listings to prevent duplicate emails...")
-        
-        # Import scrapers
-        try:
+    def _build_scrape_jobs(self, depop_per_term_limit=20):
+        """Describe the per-platform worker pools used by the scrape scheduler"""
+        from scrape_scheduler import PlatformJob
+        from browser_pool import default_pool
+        
+        # Watermarked searches stop at known listings, so deeper pages are only
+        # read for bursty terms whose whole first page is new
+        watermark_kwargs = {'watermarks': self.watermarks} if self.watermarks is not None else {}
+        ebay_pages = int(os.getenv('MAX_PAGES_EBAY', '3')) if self.watermarks is not None else 1
+        
+        # eBay defaults to the browser-free HTTP engine (a few MB per worker instead
+        # of a Chrome instance); it falls back to Selenium only on challenge pages
+        if os.getenv('EBAY_ENGINE', 'http').lower() == 'selenium':
             from ebay_selenium_scraper import EbaySeleniumScraper
+            ebay_job = PlatformJob(
+                'eBay', EbaySeleniumScraper,
+                workers=int(os.getenv('EBAY_WORKERS', '1')),
+                search_kwargs={'max_pages': 1, **watermark_kwargs},  # Only newest listings (sorted by _sop=10)
+                recycle_every=5,  # Fresh tab to prevent tab crashes (memory issues)
+                pool=default_pool(),  # Warm browsers shared across cycles and seeding
+                planner=self.query_planners.get('eBay')
+            )
+        else:
+            from ebay_scraper import EbayScraper
+            ebay_job = PlatformJob(
+                'eBay', EbayScraper,
+                workers=int(os.getenv('EBAY_HTTP_WORKERS', '4')),
+                search_kwargs={'max_pages': ebay_pages, **watermark_kwargs},
+                uses_browser=False,
+                planner=self.query_planners.get('eBay')
+            )
+        
+        # Depop defaults to the async JSON API client, which fetches every term
+        # concurrently in one call and uses Selenium only for terms the API refuses
+        if os.getenv('DEPOP_ENGINE', 'api').lower() == 'selenium':
             from depop_selenium_scraper import DepopSeleniumScraper
-        except ImportError as e:
-            logger.error(f"Failed to import scrapers for seeding: {e}")
-            return
+            depop_job = PlatformJob(
+                'Depop', DepopSeleniumScraper,
+                workers=int(os.getenv('DEPOP_WORKERS', '1')),
+                search_kwargs={'max_pages': 1, 'per_term_limit': depop_per_term_limit, **watermark_kwargs},  # Only newest listings
+                recycle_every=8,  # Fresh tab to prevent session timeouts
+                pool=default_pool(),
+                planner=self.query_planners.get('Depop')
+            )
+        else:
+            from depop_scraper import DepopScraper
+            depop_job = PlatformJob(
+                'Depop', DepopScraper,
+                workers=1,
+                search_kwargs={
+                    'max_pages': int(os.getenv('MAX_PAGES_DEPOP', '3' if self.watermarks is not None else '1')),
+                    'per_term_limit': depop_per_term_limit,
+                    **watermark_kwargs
+                },
+                uses_browser=False,
+                chunk_size=0,
+                planner=self.query_planners.get('Depop')
+            )
         
-        ebay_scraper = None
-        depop_scraper = None
+        return [ebay_job, depop_job]
+    
+    def _scrape_all_platforms(self, depop_per_term_limit=20, terms=None):
+        """Scrape eBay and Depop concurrently, returning {platform: listings}"""
+        from scrape_scheduler import ScrapeScheduler
         
+        from memory_watchdog import memory_watchdog
+        
+        scheduler = ScrapeScheduler(self._build_scrape_jobs(depop_per_term_limit))
+        memory_watchdog.reset()
         try:
-            ebay_scraper = EbaySeleniumScraper()
-            depop_scraper = DepopSeleniumScraper()
-        except Exception as e:
-            logger.error(f"Failed to initialize scrapers for seeding: {e}")
+            return scheduler.run(terms or SEARCH_TERMS)
+        except Exception:
+            if self.watermarks is not None:
+                self.watermarks.discard()
+            raise
+        finally:
+            self.last_memory_report = memory_watchdog.summary()
+    
+    def _settle_watermarks(self, recorded):
+        """Advance search watermarks only when every scraped listing was stored"""
+        if self.watermarks is None:
+            return
+        if not recorded:
+            self.watermarks.discard()
+            return
+        try:
+            self.watermarks.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to update search watermarks: {e}")
+    
+    def seed_database_with_current_listings(self, terms=None):
+        """On first run after deployment, scrape and mark all current listings as seen without sending emails"""
+        logger.info("Database appears empty - seeding with current listings to prevent duplicate emails...")
+        if self.shards is not None:
+            self.shards.run(terms or SEARCH_TERMS, seed=True)
             return
-        
-        total_marked = 0
         
         try:
-            # Scrape eBay and mark all as seen
-            logger.info("Seeding eBay listings...")
-            try:
-                ebay_listings = ebay_scraper.search_listings(SEARCH_TERMS)
-                for listing in ebay_listings:
-                    if not self.is_listing_seen(listing['listing_id']):
-                        self.mark_listing_seen(listing)
-                        total_marked += 1
-                logger.info(f"Marked {len(ebay_listings)} eBay listings as seen")
-            except Exception as e:
-                logger.error(f"Error seeding eBay listings: {e}")
-            
-            # Scrape Depop and mark all as seen
-            logger.info("Seeding Depop listings...")
-            try:
-                depop_listings = depop_scraper.search_listings(SEARCH_TERMS, max_pages=1, per_term_limit=30)
-                for listing in depop_listings:
-                    if not self.is_listing_seen(listing['listing_id']):
-                        self.mark_listing_seen(listing)
-                        total_marked += 1
-                logger.info(f"Marked {len(depop_listings)} Depop listings as seen")
-            except Exception as e:
-                logger.error(f"Error seeding Depop listings: {e}")
+            results = self._scrape_all_platforms(depop_per_term_limit=30, terms=terms)
+        except ImportError as e:
+            logger.error(f"Failed to import scrapers for seeding: {e}")
+            return
         
-        finally:
-            # Clean up
-            try:
-                if ebay_scraper and hasattr(ebay_scraper, 'close'):
-                    ebay_scraper.close()
-            except Exception as e:
-                logger.error(f"Error closing eBay scraper during seeding: {e}")
-            
+        total_marked = 0
+        recorded = True
+        for platform, listings in results.items():
             try:
-                if depop_scraper and hasattr(depop_scraper, 'close'):
-                    depop_scraper.close()
+                total_marked += len(self.record_new_listings(listings, notify=False))
+                logger.info(f"Marked {len(listings)} {platform} listings as seen")
             except Exception as e:
-                logger.error(f"Error closing Depop scraper during seeding: {e}")
+                logger.error(f"Error seeding {platform} listings: {e}")
+                recorded = False
+        self._settle_watermarks(recorded)
         
         logger.info(f"Database seeding complete - marked {total_marked} listings as seen. Future runs will only send new listings.")
     
-    def is_listing_seen(self, listing_id):
+    def is_listing_seen(self, platform, listing_id):
         """Check if a listing has already been seen"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT 1 FROM seen_listings WHERE listing_id = ?', (listing_id,))
-        result = cursor.fetchone()
-        
-        conn.close()
+        if self.seen_filter is not None and (platform, listing_id) not in self.seen_filter:
+            return False
+        with self.db_lock:
+            result = self.conn.execute(
+                'SELECT 1 FROM seen_listings WHERE platform = ? AND listing_id = ?', (platform, listing_id)
+            ).fetchone() or self.conn.execute(
+                'SELECT 1 FROM retired_listings WHERE key = ?', (retired_key(platform, listing_id),)
+            ).fetchone()
         return result is not None
     
     def mark_listing_seen(self, listing_data):
         """Mark a listing as seen in the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-                INSERT INTO seen_listings 
-                (listing_id, platform, title, price, url, image_url, search_term)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                listing_data['listing_id'],
-                listing_data['platform'],
-                listing_data['title'],
-                listing_data['price'],
-                listing_data['url'],
-                listing_data['image_url'],
-                listing_data['search_term']
-            ))
-            conn.commit()
-            logger.info(f"Marked listing {listing_data['listing_id']} as seen")
-        except sqlite3.IntegrityError:
-            logger.debug(f"Listing {listing_data['listing_id']} already exists in database")
-        finally:
-            conn.close()
+        with self.db_lock:
+            cursor = self.conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.execute(self.INSERT_LISTING_SQL.replace('INSERT OR IGNORE', 'INSERT'), self._listing_row(listing_data))
+                self._insert_listing_terms(cursor, [listing_data])
+                cursor.execute('COMMIT')
+                if self.seen_filter is not None:
+                    self.seen_filter.add([(listing_data['platform'], listing_data['listing_id'])])
+                logger.info(f"Marked listing {listing_data['listing_id']} as seen")
+            except sqlite3.IntegrityError:
+                cursor.execute('ROLLBACK')
+                logger.debug(f"Listing {listing_data['listing_id']} already exists in database")
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
     
-    def send_email_notification(self, new_listings):
-        """Send email notification with new listings - splits into batches of ~50"""
-        if not new_listings:
-            logger.info("No new listings to send")
-            return
-        
-        # Split listings into batches of ~50 per email
-        batch_size = 50
-        total_batches = (len(new_listings) + batch_size - 1) // batch_size
-        
-        logger.info(f"Sending {len(new_listings)} listings in {total_batches} email(s) ({batch_size} per email)")
-        
-        for batch_num in range(total_batches):
-            start_idx = batch_num * batch_size
-            end_idx = min(start_idx + batch_size, len(new_listings))
-            batch = new_listings[start_idx:end_idx]
-            
-            batch_info = f" (Batch {batch_num + 1}/{total_batches})" if total_batches > 1 else ""
-            logger.info(f"Sending email{batch_info} with {len(batch)} listings...")
-            
-            # Try Resend API first (works with Railway network restrictions)
-            resend_api_key = os.getenv('RESEND_API_KEY')
-            recipient_email = os.getenv('RECIPIENT_EMAIL')
-            from_email = os.getenv('RESEND_FROM_EMAIL', 'onboarding@resend.dev')
-            
-            if resend_api_key and recipient_email:
-                try:
-                    self._send_via_resend(batch, resend_api_key, from_email, recipient_email, batch_num + 1, total_batches)
-                    logger.info(f"Email batch {batch_num + 1}/{total_batches} sent successfully")
-                    # Small delay between batches to avoid rate limiting
-                    if batch_num < total_batches - 1:
-                        time.sleep(2)
-                    continue
-                except Exception as e:
-                    logger.error(f"Resend API failed for batch {batch_num + 1}: {e}")
-                    logger.error(f"Response details: {str(e)}")
-                    # Try SMTP fallback for this batch
-            
-            # Fallback to SMTP (may not work on Railway)
-            smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
-            smtp_port = int(os.getenv('SMTP_PORT', '587'))
-            email_user = os.getenv('EMAIL_USER')
-            email_password = os.getenv('EMAIL_PASSWORD')
-            
-            if not all([email_user, email_password, recipient_email]):
-                logger.error(f"Email configuration missing for batch {batch_num + 1}. Skipping batch.")
-                continue
-            
-            # Create email message
-            msg = MIMEMultipart('alternative')
-            subject = f"New Vintage Clothing Listings - {len(batch)} items"
-            if total_batches > 1:
-                subject += f" (Part {batch_num + 1}/{total_batches})"
-            msg['Subject'] = subject
-            msg['From'] = email_user
-            msg['To'] = recipient_email
-            
-            # Create HTML content
-            html_content = self.create_html_email(batch, batch_num + 1, total_batches)
-            html_part = MIMEText(html_content, 'html')
-            msg.attach(html_part)
+    @cycle_profiler.timed('db.record_listings')
+    def record_new_listings(self, listings, notify=True):
+        """Return the listings not seen before and mark them all seen in a single transaction
+        
+        Duplicates inside the batch are collapsed (first occurrence wins). Seen
+        filter hits are confirmed in the database, once per chunk of IDs, as the
+        filter also hits on a small share of new listings; misses skip the
+        lookup. Each remaining listing is inserted with INSERT OR IGNORE and is
+        new only if its row went in, so a listing another worker recorded
+        meanwhile is not reported twice. Every insert runs under one commit
+        instead of one connect/fsync per listing. With notify, the new listings
+        are queued in the outbox in that same transaction, so a listing is
+        never marked seen without its email being owed.
+        """
+        batch = {}
+        for listing in listings:
+            batch.setdefault((listing['platform'], listing['listing_id']), listing)
+        if not batch:
+            return []
+        
+        lookup = list(batch)
+        if self.seen_filter is not None:
+            lookup = [key for key in lookup if key in self.seen_filter]
+        
+        with self.db_lock:
+            cursor = self.conn.cursor()
+            known = self._known_listings(cursor, lookup)
+            if self.seen_filter is not None and len(known) < len(lookup):
+                false_positives = len(lookup) - len(known)
+                metrics.seen_filter_false_positives.inc(false_positives)
+                logger.debug(f"Seen filter: {false_positives} new listings were filter hits")
+            candidates = [listing for key, listing in batch.items() if key not in known]
+            if not candidates:
+                logger.info(f"Marked 0 of {len(batch)} listings as seen ({len(batch)} already known)")
+                return []
             
-            # Send email - try multiple methods for Railway compatibility
+            cursor.execute('BEGIN IMMEDIATE')
             try:
-                # Try port 587 with STARTTLS first
-                if smtp_port == 587:
-                    try:
-                        server = smtplib.SMTP(smtp_server, smtp_port, timeout=30)
-                        server.starttls()
-                        server.login(email_user, email_password)
-                        server.send_message(msg)
-                        server.quit()
-                        logger.info(f"Email batch {batch_num + 1}/{total_batches} sent successfully via SMTP")
-                        if batch_num < total_batches - 1:
-                            time.sleep(2)
-                        continue
-                    except (OSError, smtplib.SMTPException) as e:
-                        logger.warning(f"Port 587 failed: {e}. Trying port 465 (SSL)...")
-                        # Fall through to try port 465
-                
-                # Try port 465 with SSL (more reliable on Railway)
-                try:
-                    context = ssl.create_default_context()
-                    server = smtplib.SMTP_SSL(smtp_server, 465, timeout=30, context=context)
-                    server.login(email_user, email_password)
-                    server.send_message(msg)
-                    server.quit()
-                    logger.info(f"Email batch {batch_num + 1}/{total_batches} sent successfully via SMTP (SSL)")
-                    if batch_num < total_batches - 1:
-                        time.sleep(2)
-                    continue
-                except Exception as ssl_error:
-                    logger.error(f"Port 465 (SSL) also failed for batch {batch_num + 1}: {ssl_error}")
-                    
-            except Exception as e:
-                logger.error(f"Failed to send email batch {batch_num + 1} after all attempts: {e}")
-                logger.error(f"SMTP Server: {smtp_server}, Port: {smtp_port}")
-                logger.error("Consider using Resend API (RESEND_API_KEY) which works better with Railway")
-                # Continue to next batch even if this one failed
+                new_listings = []
+                for listing in candidates:
+                    cursor.execute(self.INSERT_LISTING_SQL, self._listing_row(listing))
+                    if cursor.rowcount == 1:
+                        new_listings.append(listing)
+                self._insert_listing_terms(cursor, new_listings)
+                if notify:
+                    Outbox.enqueue(cursor, new_listings)
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            if self.seen_filter is not None:
+                self.seen_filter.add((listing['platform'], listing['listing_id']) for listing in new_listings)
+        
+        logger.info(f"Marked {len(new_listings)} of {len(batch)} listings as seen ({len(batch) - len(new_listings)} already known)")
+        return new_listings
     
-    def _send_via_resend(self, new_listings, api_key, from_email, recipient_email, batch_num=1, total_batches=1):
-        """Send email using Resend API (works with Railway network restrictions)"""
-        html_content = self.create_html_email(new_listings, batch_num, total_batches)
-        
-        url = "https://api.resend.com/emails"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        subject = f"New Vintage Clothing Listings - {len(new_listings)} items"
+    def _known_listings(self, cursor, keys):
+        """The (platform, listing_id) keys already in seen_listings or retired_listings"""
+        by_platform = {}
+        for platform, listing_id in keys:
+            by_platform.setdefault(platform, []).append(listing_id)
+        
+        known = set()
+        for platform, ids in by_platform.items():
+            for start in range(0, len(ids), self.DB_QUERY_CHUNK):
+                chunk = ids[start:start + self.DB_QUERY_CHUNK]
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(
+                    f'SELECT listing_id FROM seen_listings WHERE platform = ? AND listing_id IN ({placeholders})',
+                    [platform] + chunk
+                )
+                known.update((platform, row[0]) for row in cursor.fetchall())
+        
+        # Listings aged out by the retention job only survive as hashed IDs
+        hashed = {retired_key(*key): key for key in keys if key not in known}
+        hashes = list(hashed)
+        for start in range(0, len(hashes), self.DB_QUERY_CHUNK):
+            chunk = hashes[start:start + self.DB_QUERY_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f'SELECT key FROM retired_listings WHERE key IN ({placeholders})', chunk)
+            known.update(hashed[row[0]] for row in cursor.fetchall())
+        return known
+    
+    INSERT_LISTING_SQL = '''
+        INSERT OR IGNORE INTO seen_listings
+        (platform, listing_id, title, price, price_min, price_max, currency, url, image_url, search_term)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    
+    @staticmethod
+    def _listing_row(listing_data):
+        return (
+            listing_data['platform'],
+            listing_data['listing_id'],
+            listing_data['title'],
+            listing_data['price'],
+            *parse_price(listing_data['price']),
+            listing_data['url'],
+            listing_data['image_url'],
+            listing_data['search_term']
+        )
+    
+    def _insert_listing_terms(self, cursor, listings):
+        """Record every search term each listing matches in listing_terms (one matcher pass per title)"""
+        rows = []
+        for listing in listings:
+            terms = self.matcher.match_terms(listing['title'])
+            if listing['search_term'] not in terms:
+                terms.insert(0, listing['search_term'])
+            rows.extend((term, listing['platform'], listing['listing_id']) for term in terms)
+        cursor.executemany('''
+            INSERT OR IGNORE INTO listing_terms (search_term, listing_rowid)
+            SELECT ?, id FROM seen_listings WHERE platform = ? AND listing_id = ?
+        ''', rows)
+    
+    @cycle_profiler.timed('email.compose')
+    def _compose_email(self, listings, batch_num=1, total_batches=1):
+        """(subject, html, text, inline attachments) for one batch of ~50 listings"""
+        subject = f"New Vintage Clothing Listings - {len(listings)} items"
         if total_batches > 1:
             subject += f" (Part {batch_num}/{total_batches})"
         
-        payload = {
-            "from": from_email,
-            "to": [recipient_email],
-            "subject": subject,
-            "html": html_content
-        }
-        
+        inline_images, attachments = {}, {}
+        if self.thumbnails is not None:
+            try:
+                for url, (digest, data) in self.thumbnails.thumbnails(image_src(l) for l in listings).items():
+                    # One attachment per distinct image, however many listings share it
+                    inline_images[url] = digest[:24]
+                    attachments[digest[:24]] = data
+            except Exception as e:
+                logger.warning(f"Thumbnail cache unavailable, hotlinking images: {e}")
+                inline_images, attachments = {}, {}
+        
+        return (
+            subject,
+            self.create_html_email(listings, batch_num, total_batches, inline_images),
+            self.create_text_email(listings, batch_num, total_batches),
+            list(attachments.items())
+        )
+    
+    def deliver_notifications(self):
+        """Send everything waiting in the outbox now (used when no background worker runs)"""
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
-            
-            # Log response details for debugging
-            logger.debug(f"Resend API response status: {response.status_code}")
-            logger.debug(f"Resend API response headers: {dict(response.headers)}")
-            
-            # Check response
-            if response.status_code != 200:
-                error_detail = response.text
-                logger.error(f"Resend API returned status {response.status_code}: {error_detail}")
-                response.raise_for_status()
-            
-            response_data = response.json()
-            logger.info(f"Email sent successfully via Resend API. Response: {response_data}")
-            return response_data
-            
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Resend API request failed: {e}")
-            if hasattr(e, 'response') and e.response is not None:
-                logger.error(f"Response status: {e.response.status_code}")
-                logger.error(f"Response body: {e.response.text}")
-            raise
+            return self.outbox.drain(self.email_delivery, self._compose_email)
+        except Exception as e:
+            logger.error(f"Error delivering queued notifications: {e}")
+            return 0
     
-    def create_html_email(self, listings, batch_num=1, total_batches=1):
+    def create_html_email(self, listings, batch_num=1, total_batches=1, inline_images=None):
         """Create HTML email content with listings grouped by search term - Gmail optimized"""
-        # Group listings by search term
-        grouped_listings = {}
-        for listing in listings:
-            search_term = listing['search_term']
-            if search_term not in grouped_listings:
-                grouped_listings[search_term] = []
-            grouped_listings[search_term].append(listing)
-        
-        # Show all listings in this batch (already limited to ~50)
-        total_shown = 0
-        max_listings = len(listings)  # Show all in batch
-        
-        html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 15px; line-height: 1.4; }}
-                .header {{ background: #3498db; color: white; padding: 15px; border-radius: 8px; margin-bottom: 20px; }}
-                .search-group {{ margin: 15px 0; border: 1px solid #ddd; border-radius: 6px; overflow: hidden; }}
-                .search-header {{ background: #f8f9fa; padding: 8px 12px; font-weight: bold; border-bottom: 1px solid #ddd; }}
-                .listing {{ padding: 10px; border-bottom: 1px solid #eee; display: flex; align-items: center; }}
-                .listing:last-child {{ border-bottom: none; }}
-                .listing img {{ width: 80px; height: 80px; object-fit: cover; margin-right: 12px; border-radius: 4px; }}
-                .listing-info {{ flex: 1; }}
-                .price {{ font-size: 16px; font-weight: bold; color: #e74c3c; margin: 2px 0; }}
-                .platform {{ background: #2ecc71; color: white; padding: 2px 6px; border-radius: 3px; font-size: 11px; margin-right: 8px; }}
-                .title {{ font-size: 14px; margin: 2px 0; font-weight: bold; line-height: 1.3; }}
-                .url {{ margin-top: 4px; }}
-                .url a {{ color: #3498db; text-decoration: none; font-size: 12px; }}
-                .no-image {{ width: 80px; height: 80px; background: #ecf0f1; border: 1px solid #bdc3c7; margin-right: 12px; display: flex; align-items: center; justify-content: center; color: #7f8c8d; font-size: 10px; border-radius: 4px; }}
-                .summary {{ background: #f8f9fa; padding: 10px; border-radius: 4px; margin-bottom: 15px; }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <h2 style="margin: 0;">🏆 New Vintage Clothing Listings</h2>
-                <p style="margin: 5px 0 0 0;">Found <strong>{len(listings)}</strong> new listings across <strong>{len(grouped_listings)}</strong> search terms</p>
-                {f'<p style="margin: 5px 0 0 0; font-size: 12px;">📧 Email {batch_num} of {total_batches}</p>' if total_batches > 1 else ''}
-            </div>
-        """
+        return render_html(listings, batch_num, total_batches, inline_images)
+    
+    def create_text_email(self, listings, batch_num=1, total_batches=1):
+        """Plain-text alternative part for the same batch"""
+        return render_text(listings, batch_num, total_batches)
+    
+    def run_monitoring_cycle(self, terms=None):
+        """Run one monitoring cycle over the given search terms (all of them by default)
         
-        for search_term, term_listings in grouped_listings.items():
-            if total_shown >= max_listings:
-                html += f"""
-                <div class="summary">
-                    <strong>Note:</strong> Showing first {max_listings} listings to prevent email truncation. 
-                    Total found: {len(listings)} listings.
-                </div>
-                """
-                break
-                
-            html += f"""
-            <div class="search-group">
-                <div class="search-header">🔍 {search_term.title()} ({len(term_listings)} listings)</div>
-            """
-            
-            for listing in term_listings:  # Show all listings in this batch
-                if total_shown >= max_listings:
-                    break
-                    
-                # Handle missing images - ensure absolute URLs and proper email client compatibility
-                image_url = listing.get('image_url', '')
-                if image_url:
-                    # Ensure absolute URL
-                    if image_url.startswith('//'):
-                        image_url = 'https:' + image_url
-                    elif image_url.startswith('/'):
-                        # Relative URL - try to make it absolute based on platform
-                        if listing['platform'].lower() == 'ebay':
-                            image_url = 'https://i.ebayimg.com' + image_url
-                        elif listing['platform'].lower() == 'depop':
-                            image_url = 'https://media.depop.com' + image_url
-                    
-                    # Use img tag with proper attributes for email clients
-                    img_html = f'<img src="{image_url}" alt="Listing Image" style="width: 80px; height: 80px; object-fit: cover; border-radius: 4px; display: block;" border="0">'
-                else:
-                    img_html = '<div class="no-image">No Image</div>'
-                
-                # Create links optimized for mobile app opening
-                listing_url = listing.get('url', '')
-                
-                # Create links - email clients often block deep links, so we'll use mobile web URLs
-                # Mobile web URLs will show "Open in App" banners that work better than deep links
-                listing_url = listing.get('url', '')
-                
-                if listing['platform'].lower() == 'ebay':
-                    # Extract item ID from eBay URL (format: /itm/ITEM_ID)
-                    item_id_match = re.search(r'/itm/(\d+)', listing_url)
-                    if item_id_match:
-                        item_id = item_id_match.group(1)
-                        # Use mobile web URL - eBay's mobile site detects app and shows "Open in App" banner
-                        # This is more reliable than deep links which email clients often block
-                        mobile_url = f"https://m.ebay.com/itm/{item_id}"
-                        link_html = f'<a href="{mobile_url}" style="color: #3498db; text-decoration: none; font-size: 12px;">View Listing →</a>'
-                    else:
-                        link_html = f'<a href="{listing_url}" target="_blank" style="color: #3498db; text-decoration: none; font-size: 12px;">View Listing →</a>'
-                elif listing['platform'].lower() == 'depop':
-                    # Depop URLs work well as-is
-                    link_html = f'<a href="{listing_url}" style="color: #3498db; text-decoration: none; font-size: 12px;">View Listing →</a>'
-                else:
-                    link_html = f'<a href="{listing_url}" target="_blank" style="color: #3498db; text-decoration: none; font-size: 12px;">View Listing →</a>'
-                
-                html += f"""
-                <div class="listing">
-                    {img_html}
-                    <div class="listing-info">
-                        <span class="platform">{listing['platform'].upper()}</span>
-                        <div class="title">{listing['title']}</div>
-                        <div class="price">{listing['price']}</div>
-                        <div class="url">
-                            {link_html}
-                        </div>
-                    </div>
-                </div>
-                """
-                total_shown += 1
-            
-            html += "</div>"
-        
-        html += """
-            <div style="margin-top: 20px; padding: 10px; background: #f8f9fa; border-radius: 4px; text-align: center;">
-                <small>This email was sent by your Vintage Clothing Monitor Bot</small>
-            </div>
-            <div style="margin-top: 10px; padding: 12px; background: #fff3cd; border-radius: 4px; font-size: 11px; color: #856404; line-height: 1.5;">
-                <strong>📱 Opening Links in eBay App:</strong><br>
-                <strong>Gmail limitation:</strong> Gmail on mobile opens all links in Chrome first (this is a Gmail security feature).<br>
-                <strong>Solution:</strong> After the link opens in Chrome, look for the blue "Open in eBay App" banner at the top of the page and tap it.<br>
-                <strong>Alternative:</strong> Use Apple Mail app (iOS) or configure Android: Settings → Apps → eBay → Open by default → Enable "Open supported links"
-            </div>
-        </body>
-        </html>
+        Ends with the cycle's timing report (see cycle_profiler). Returns the
+        cycle's counts, or None if scraping failed.
         """
-        
-        return html
+        cycle_profiler.reset()
+        started = time.monotonic()
+        with cycle_profiler.thread_profile():
+            summary = self._monitoring_cycle(terms)
+        cycle_profiler.finish_cycle(extra=summary)
+        metrics.cycle_seconds.observe(time.monotonic() - started)
+        metrics.last_cycle.set(time.time())
+        self._update_db_metrics()
+        return summary
     
-    def run_monitoring_cycle(self):
-        """Run one complete monitoring cycle"""
-        logger.info("Starting monitoring cycle")
-        
-        new_listings = []
-        seen_in_cycle = set()  # Track listings seen in this cycle to prevent duplicates
-        ebay_scraper = None
-        depop_scraper = None
-        total_ebay_checked = 0
-        total_depop_checked = 0
+    def _update_db_metrics(self):
+        try:
+            with self.db_lock:
+                page_size = self.conn.execute('PRAGMA page_size').fetchone()[0]
+                page_count = self.conn.execute('PRAGMA page_count').fetchone()[0]
+            metrics.db_size.set(page_size * page_count)
+            metrics.outbox_pending.set(self.outbox.pending_count())
+        except sqlite3.Error as e:
+            logger.debug(f"Could not read database metrics: {e}")
+    
+    def _monitoring_cycle(self, terms=None):
+        """Scrape, record and notify; returns the cycle's counts (None if scraping failed)"""
+        logger.info("Starting monitoring cycle" + (f" for {len(terms)} due terms" if terms else ""))
         
-        # Import scrapers here to avoid circular imports
+        # Sharded, the worker processes scrape and record their own slices of the terms
         try:
-            from ebay_selenium_scraper import EbaySeleniumScraper
-            from depop_selenium_scraper import DepopSeleniumScraper
+            if self.shards is not None:
+                with cycle_profiler.span('cycle.shards'):
+                    checked, new_count = self.shards.run(terms or SEARCH_TERMS)
+                self.last_memory_report = self.shards.memory_report
+                self.last_covered_terms = [term for term in SEARCH_TERMS if term in self.shards.covered_terms]
+            else:
+                checked, new_listings = self.scrape_and_record(terms)
+                new_count = len(new_listings)
         except ImportError as e:
             logger.error(f"Failed to import scrapers: {e}")
             return
-        
-        # Initialize scrapers
-        try:
-            ebay_scraper = EbaySeleniumScraper()
-            depop_scraper = DepopSeleniumScraper()
         except Exception as e:
-            logger.error(f"Failed to initialize scrapers: {e}")
+            logger.error(f"Error running scrape scheduler: {e}")
             return
+        total_ebay_checked = checked.get('eBay', 0)
+        total_depop_checked = checked.get('Depop', 0)
         
-        try:
-            # Check eBay
-            logger.info("Checking eBay...")
-            try:
-                # Limit to 1 page and only newest listings (sorted by _sop=10)
-                # This ensures we only check the most recent listings
-                ebay_listings = ebay_scraper.search_listings(SEARCH_TERMS, max_pages=1)
-                total_ebay_checked = len(ebay_listings)
-                logger.info(f"Found {total_ebay_checked} eBay listings (checking newest only)")
-                for listing in ebay_listings:
-                    listing_id = listing['listing_id']
-                    # Check both database and current cycle to prevent duplicates
-                    if listing_id not in seen_in_cycle and not self.is_listing_seen(listing_id):
-                        new_listings.append(listing)
-                        seen_in_cycle.add(listing_id)
-                        self.mark_listing_seen(listing)
-                    else:
-                        logger.debug(f"Skipping duplicate listing: {listing_id}")
-            except Exception as e:
-                logger.error(f"Error scraping eBay: {e}")
-                # Continue with Depop even if eBay fails
-            
-            # Check Depop
-            logger.info("Checking Depop...")
-            try:
-                # Limit to 1 page and only 20 newest listings per term (sorted by newest)
-                # This ensures we only check the most recent listings
-                depop_listings = depop_scraper.search_listings(SEARCH_TERMS, max_pages=1, per_term_limit=20)
-                total_depop_checked = len(depop_listings)
-                logger.info(f"Found {total_depop_checked} Depop listings (checking newest only)")
-                for listing in depop_listings:
-                    listing_id = listing['listing_id']
-                    # Check both database and current cycle to prevent duplicates
-                    if listing_id not in seen_in_cycle and not self.is_listing_seen(listing_id):
-                        new_listings.append(listing)
-                        seen_in_cycle.add(listing_id)
-                        self.mark_listing_seen(listing)
-                    else:
-                        logger.debug(f"Skipping duplicate listing: {listing_id}")
-            except Exception as e:
-                logger.error(f"Error scraping Depop: {e}")
-                # Continue even if Depop fails
-        
-        finally:
-            # Clean up Selenium drivers to prevent memory leaks
-            try:
-                if hasattr(ebay_scraper, 'close'):
-                    ebay_scraper.close()
-            except Exception as e:
-                logger.error(f"Error closing eBay scraper: {e}")
-            
-            try:
-                if hasattr(depop_scraper, 'close'):
-                    depop_scraper.close()
-            except Exception as e:
-                logger.error(f"Error closing Depop scraper: {e}")
-        
-        # Send email if there are new listings
-        if new_listings:
-            logger.info(f"Found {len(new_listings)} NEW listings (duplicates filtered out)")
-            try:
-                self.send_email_notification(new_listings)
-            except Exception as e:
-                logger.error(f"Error sending email notification: {e}")
-                # Don't crash the bot if email fails
+        if new_count:
+            logger.info(f"Found {new_count} NEW listings (duplicates filtered out), queued for email")
         else:
             logger.info("No new listings found - all listings were already seen")
         
+        # The background worker sends on its own; without one (run_once.py) deliver
+        # now, which also retries batches left over from earlier failed sends
+        if self.outbox_worker is not None:
+            if new_count:
+                self.outbox_worker.notify()
+        else:
+            with cycle_profiler.span('cycle.notify'):
+                self.deliver_notifications()
+        
         # Log summary
         total_checked = total_ebay_checked + total_depop_checked
-        duplicates_filtered = total_checked - len(new_listings)
+        duplicates_filtered = total_checked - new_count
         if total_checked > 0:
-            logger.info(f"Summary: Checked {total_checked} listings ({total_ebay_checked} eBay, {total_depop_checked} Depop), {duplicates_filtered} were duplicates, {len(new_listings)} were new")
+            logger.info(f"Summary: Checked {total_checked} listings ({total_ebay_checked} eBay, {total_depop_checked} Depop), {duplicates_filtered} were duplicates, {new_count} were new")
+        
+        memory = self.last_memory_report
+        if memory.get('measured_terms'):
+            logger.info(f"Browser memory: peak {memory['peak_rss_mb']} MB, {memory['total_growth_mb']:+} MB over {memory['measured_terms']} terms, {memory['recycles']} recycle(s)")
+            for entry in memory['top_growth']:
+                logger.info(f"  {entry['platform']} '{entry['term']}': {entry['delta_mb']:+} MB (RSS {entry['rss_mb']} MB)")
+        
+        try:
+            with cycle_profiler.span('db.retention'):
+                self.retention.run()
+        except sqlite3.Error as e:
+            logger.warning(f"Retention job failed: {e}")
+        
+        # Keep the main database file current between cycles without blocking readers
+        try:
+            with self.db_lock, cycle_profiler.span('db.checkpoint'):
+                self.conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        except sqlite3.Error as e:
+            logger.warning(f"WAL checkpoint failed: {e}")
         
         logger.info("Monitoring cycle completed")
+        return {
+            'terms': len(terms) if terms else len(SEARCH_TERMS),
+            'listings_checked': total_checked,
+            'new_listings': new_count,
+        }
+    
+    def scrape_and_record(self, terms=None):
+        """Scrape the terms on every platform and mark what they found seen
+        
+        Returns ({platform: listings checked}, new listings). The new listings
+        are queued in the outbox; delivery is left to the caller. Raises if
+        scraping fails.
+        """
+        # eBay and Depop are scraped in parallel by per-platform worker pools;
+        # the scheduler owns the drivers and closes them when the queue drains
+        with cycle_profiler.span('cycle.scrape'):
+            results = self._scrape_all_platforms(depop_per_term_limit=20, terms=terms)
+        self.last_covered_terms = self.covered_terms(terms)
+        
+        ebay_listings = results.get('eBay', [])
+        depop_listings = results.get('Depop', [])
+        logger.info(f"Found {len(ebay_listings)} eBay listings and {len(depop_listings)} Depop listings (checking newest only)")
+        
+        # One set-based lookup + one transaction per platform batch; listings
+        # already marked earlier in this cycle are filtered the same way
+        new_listings = []
+        recorded = True
+        for platform, listings in (('eBay', ebay_listings), ('Depop', depop_listings)):
+            try:
+                platform_new = self.record_new_listings(listings)
+            except Exception as e:
+                logger.error(f"Error recording {platform} listings: {e}")
+                recorded = False
+                continue
+            new_listings.extend(platform_new)
+            self._count_listings(platform, listings, platform_new)
+        self._settle_watermarks(recorded)
+        return {'eBay': len(ebay_listings), 'Depop': len(depop_listings)}, new_listings
+    
+    @staticmethod
+    def _count_listings(platform, listings, new_listings):
+        """Scraped / new / duplicate counters per search term"""
+        scraped, new = {}, {}
+        for listing in listings:
+            scraped[listing['search_term']] = scraped.get(listing['search_term'], 0) + 1
+        for listing in new_listings:
+            new[listing['search_term']] = new.get(listing['search_term'], 0) + 1
+        for term, count in scraped.items():
+            metrics.listings_scraped.inc(count, platform=platform, term=term)
+            metrics.listings_new.inc(new.get(term, 0), platform=platform, term=term)
+            metrics.listings_duplicate.inc(count - new.get(term, 0), platform=platform, term=term)
+    
+    def covered_terms(self, terms=None):
+        """Terms every platform searches for a cycle over ``terms``
+
+        A query group is searched as a whole and its results fanned out to all
+        its members, so the members of every group a term belongs to count too;
+        a member only counts once each platform's plan groups it that way.
+        """
+        terms = list(SEARCH_TERMS if terms is None else terms)
+        if not self.query_planners:
+            return terms
+        covered = [set(planner.covered_terms(terms)) for planner in self.query_planners.values()]
+        return [term for term in SEARCH_TERMS if all(term in platform_terms for platform_terms in covered)]
+    
+    def run_due_terms(self):
+        """Scrape only the terms whose adaptive polling interval has elapsed"""
+        due = self.poller.due_terms()
+        if not due:
+            return
+        self.last_covered_terms = []
+        try:
+            self.run_monitoring_cycle(due)
+        finally:
+            # A failed poll waits a full interval too, rather than retrying every tick. Group
+            # members searched alongside a due term got fresh results too and are reset with it
+            self.poller.mark_polled(set(due).union(self.last_covered_terms))
     
     def start_monitoring(self):
         """Start the monitoring bot"""
@@ -623,8 +685,21 @@ class VintageClothingMonitorBot:
                 logger.error(f"Error seeding database: {e}")
                 logger.info("Continuing with normal monitoring - some duplicates may appear")
         
-        # Schedule to run every 2 hours
-        schedule.every(2).hours.do(self.run_monitoring_cycle)
+        # Optional Prometheus endpoint (METRICS_PORT)
+        metrics.start_server()
+        
+        # Email goes out from a background worker, so slow delivery never extends a scrape cycle
+        self.outbox_worker = OutboxWorker(self.outbox, self.email_delivery, self._compose_email)
+        self.outbox_worker.start()
+        
+        # Each term is polled on its own interval, derived from how often it gets new
+        # listings; POLLING_MODE=fixed restores one cycle over every term each 2 hours
+        adaptive = os.getenv('POLLING_MODE', 'adaptive').lower() != 'fixed'
+        if adaptive:
+            self.poller = AdaptivePollScheduler(SEARCH_TERMS, self.conn, self.db_lock)
+            schedule.every(int(os.getenv('POLL_TICK_MINUTES', '5'))).minutes.do(self.run_due_terms)
+        else:
+            schedule.every(2).hours.do(self.run_monitoring_cycle)
         
         # Run immediately on startup (but only new listings will be sent)
         try:
@@ -632,6 +707,8 @@ class VintageClothingMonitorBot:
         except Exception as e:
             logger.error(f"Error in initial monitoring cycle: {e}")
             logger.info("Bot will continue and retry on next scheduled run")
+        if adaptive:
+            self.poller.mark_polled(SEARCH_TERMS)
         
         # Keep the bot running with error handling
         while True:
@@ -640,6 +717,7 @@ class VintageClothingMonitorBot:
                 time.sleep(60)  # Check every minute
             except KeyboardInterrupt:
                 logger.info("Bot stopped by user")
+                self.close()
                 break
             except Exception as e:
                 logger.error(f"Unexpected error in main loop: {e}")
@@ -0,0 +1,163 @@
+# Browser memory watchdog
+# Samples the RSS of chromedriver and every Chrome process under it, so browsers
+# are recycled when they actually grow too large rather than on a fixed schedule
+
+import os
+import logging
+import threading
+
+try:
+    import psutil
+except ImportError:  # Optional - /proc is used on Linux when psutil is absent
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+def _proc_children_map():
+    """Map of parent pid -> child pids built from /proc (Linux only)"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # Field 4 is the ppid; the command name in field 2 may contain spaces
+        ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+
+def _proc_rss(pid):
+    with open(f'/proc/{pid}/statm') as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def process_tree_rss(pid):
+    """Total resident memory in bytes of a process and all its descendants, or None if unmeasurable"""
+    if psutil is not None:
+        try:
+            root = psutil.Process(pid)
+            total = root.memory_info().rss
+            for child in root.children(recursive=True):
+                try:
+                    total += child.memory_info().rss
+                except psutil.Error:
+                    continue
+            return total
+        except psutil.Error:
+            return None
+
+    if not os.path.isdir('/proc'):
+        return None
+    try:
+        children = _proc_children_map()
+        total = 0
+        stack = [pid]
+        while stack:
+            current = stack.pop()
+            try:
+                total += _proc_rss(current)
+            except OSError:
+                continue
+            stack.extend(children.get(current, ()))
+        return total
+    except OSError:
+        return None
+
+
+def driver_pid(driver):
+    """PID of the chromedriver process behind a Selenium driver"""
+    try:
+        return driver.service.process.pid
+    except AttributeError:
+        return None
+
+
+class MemoryWatchdog:
+    """Tracks browser RSS per term and decides when a browser must be recycled"""
+
+    def __init__(self, limit_mb):
+        self.limit_mb = limit_mb
+        self._lock = threading.Lock()
+        self.term_samples = []  # (platform, term, rss_before_mb, rss_after_mb)
+        self.recycles = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(limit_mb=float(os.getenv('BROWSER_RSS_LIMIT_MB', '600')))
+
+    def sample_mb(self, scraper):
+        """Current RSS of the scraper's chromedriver + Chrome process tree in MB, or None"""
+        driver = getattr(scraper, 'driver', None)
+        pid = driver_pid(driver) if driver is not None else None
+        if pid is None:
+            return None
+        rss = process_tree_rss(pid)
+        return rss / MB if rss is not None else None
+
+    def over_limit(self, scraper, rss_mb=None):
+        """True if the scraper's browser has crossed BROWSER_RSS_LIMIT_MB"""
+        if rss_mb is None:
+            rss_mb = self.sample_mb(scraper)
+        return rss_mb is not None and rss_mb > self.limit_mb
+
+    def record_term(self, platform, term, before_mb, after_mb):
+        with self._lock:
+            self.term_samples.append((platform, term, before_mb, after_mb))
+
+    def record_recycle(self):
+        with self._lock:
+            self.recycles += 1
+
+    def reset(self):
+        """Start a new cycle's telemetry"""
+        with self._lock:
+            self.term_samples = []
+            self.recycles = 0
+
+    def summary(self, top=5):
+        """Per-cycle memory telemetry: peak RSS, largest per-term growth and recycle count"""
+        with self._lock:
+            samples = [s for s in self.term_samples if s[2] is not None and s[3] is not None]
+            recycles = self.recycles
+        if not samples:
+            return {'measured_terms': 0, 'recycles': recycles}
+        deltas = sorted(samples, key=lambda s: s[3] - s[2], reverse=True)
+        return {
+            'measured_terms': len(samples),
+            'peak_rss_mb': round(max(s[3] for s in samples), 1),
+            'total_growth_mb': round(sum(s[3] - s[2] for s in samples), 1),
+            'top_growth': [
+                {'platform': p, 'term': t, 'delta_mb': round(after - before, 1), 'rss_mb': round(after, 1)}
+                for p, t, before, after in deltas[:top]
+            ],
+            'recycles': recycles,
+        }
+
+
+def merge_summaries(summaries, top=5):
+    """Combine MemoryWatchdog.summary() results of several processes (sharded workers) into one"""
+    summaries = [summary for summary in summaries if summary]
+    recycles = sum(summary.get('recycles', 0) for summary in summaries)
+    measured = [summary for summary in summaries if summary.get('measured_terms')]
+    if not measured:
+        return {'measured_terms': 0, 'recycles': recycles}
+    growth = sorted((entry for summary in measured for entry in summary['top_growth']), key=lambda e: e['delta_mb'], reverse=True)
+    return {
+        'measured_terms': sum(summary['measured_terms'] for summary in measured),
+        'peak_rss_mb': max(summary['peak_rss_mb'] for summary in measured),
+        'total_growth_mb': round(sum(summary['total_growth_mb'] for summary in measured), 1),
+        'top_growth': growth[:top],
+        'recycles': recycles,
+    }
+
+
+# Shared by the scheduler, the browser pool and standalone scraper runs
+memory_watchdog = MemoryWatchdog.from_env()
@@ -0,0 +1,265 @@
+# Metrics endpoint
+# Counters, gauges and histograms in the Prometheus text exposition format,
+# served over a small background HTTP server when METRICS_PORT is set
+
+import os
+import copy
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Seconds - from a fast HTTP search up to a slow Selenium page or an SMTP send
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(self._render_samples(items))
+        return lines
+
+    def _render_samples(self, items):
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+    def snapshot(self):
+        with self._lock:
+            return copy.deepcopy(self._values)
+
+    def delta(self, since):
+        """Samples that changed since snapshot() ``since``, in the form merge() takes"""
+        with self._lock:
+            return {key: copy.deepcopy(value) for key, value in self._values.items() if since.get(key) != value}
+
+    def merge(self, delta):
+        with self._lock:
+            self._values.update(delta)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def delta(self, since):
+        with self._lock:
+            return {key: value - since.get(key, 0) for key, value in self._values.items() if value != since.get(key, 0)}
+
+    def merge(self, delta):
+        with self._lock:
+            for key, amount in delta.items():
+                self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def delta(self, since):
+        delta = {}
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                old_counts, old_total, old_count = since.get(key, ([0] * len(counts), 0.0, 0))
+                if count != old_count:
+                    delta[key] = [[new - old for new, old in zip(counts, old_counts)], total - old_total, count - old_count]
+        return delta
+
+    def merge(self, delta):
+        with self._lock:
+            for key, (counts, total, count) in delta.items():
+                state = self._values.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+                state[0] = [mine + theirs for mine, theirs in zip(state[0], counts)]
+                state[1] += total
+                state[2] += count
+
+    def _render_samples(self, items):
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, key, (('le', _format_value(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Every metric the bot exports, rendered together on /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+        self._server = None
+
+        self.listings_scraped = self._add(Counter(
+            'rwscraper_listings_scraped_total', 'Listings returned by searches', ('platform', 'term')))
+        self.listings_new = self._add(Counter(
+            'rwscraper_listings_new_total', 'Scraped listings not seen before', ('platform', 'term')))
+        self.listings_duplicate = self._add(Counter(
+            'rwscraper_listings_duplicate_total', 'Scraped listings already seen', ('platform', 'term')))
+        self.search_seconds = self._add(Histogram(
+            'rwscraper_search_seconds', 'Time to search one term', ('platform', 'term')))
+        self.search_failures = self._add(Counter(
+            'rwscraper_search_failures_total', 'Searches that raised an error', ('platform',)))
+        self.challenge_pages = self._add(Counter(
+            'rwscraper_challenge_pages_total', 'Searches answered with a bot-challenge page', ('platform',)))
+        self.circuit_trips = self._add(Counter(
+            'rwscraper_circuit_breaker_trips_total', 'Times a platform was paused after consecutive challenge pages', ('platform',)))
+        self.circuit_open = self._add(Gauge(
+            'rwscraper_circuit_breaker_open', '1 while a platform is paused by its challenge circuit breaker', ('platform',)))
+        self.driver_restarts = self._add(Counter(
+            'rwscraper_driver_restarts_total', 'Chrome restarts after crashes, lost sessions or memory limits', ('platform',)))
+        self.rate_limit_slowdown = self._add(Gauge(
+            'rwscraper_rate_limit_slowdown', 'Factor the request rate is divided by after challenges or 403/429 responses', ('domain',)))
+        self.tab_crashes = self._add(Counter(
+            'rwscraper_tab_crashes_total', 'Searches that hit a crashed tab or lost browser session', ('platform',)))
+        self.email_seconds = self._add(Histogram(
+            'rwscraper_email_send_seconds', 'Time to deliver one email batch, retries included', ('transport',)))
+        self.email_failures = self._add(Counter(
+            'rwscraper_email_failures_total', 'Email batches that failed on every transport', ()))
+        self.seen_filter_false_positives = self._add(Counter(
+            'rwscraper_seen_filter_false_positives_total', 'New listings the seen filter reported as seen', ()))
+        self.outbox_pending = self._add(Gauge(
+            'rwscraper_outbox_pending', 'Listings queued for email', ()))
+        self.cycle_seconds = self._add(Histogram(
+            'rwscraper_cycle_seconds', 'Duration of a monitoring cycle', (),
+            buckets=(30, 60, 120, 300, 600, 900, 1200, 1800, 2700, 3600)))
+        self.last_cycle = self._add(Gauge(
+            'rwscraper_last_cycle_timestamp_seconds', 'Unix time the last monitoring cycle finished', ()))
+        self.db_size = self._add(Gauge(
+            'rwscraper_db_size_bytes', 'Size of champion_listings.db', ()))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        """Every metric's samples, to pass to delta_since() after some work"""
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def delta_since(self, snapshot):
+        """What changed since snapshot(): counter and histogram increments, new gauge values
+
+        The result is picklable, so a worker process can hand it to merge() in
+        the process that serves /metrics.
+        """
+        deltas = {}
+        for metric in self._metrics:
+            delta = metric.delta(snapshot.get(metric.name, {}))
+            if delta:
+                deltas[metric.name] = delta
+        return deltas
+
+    def merge(self, deltas):
+        """Add a delta_since() result from another process to these metrics"""
+        by_name = {metric.name: metric for metric in self._metrics}
+        for name, delta in deltas.items():
+            if name in by_name:
+                by_name[name].merge(delta)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def start_server(self, port=None, host=None):
+        """Serve /metrics on a daemon thread; no-op unless a port is given or METRICS_PORT is set"""
+        port = int(port if port is not None else os.getenv('METRICS_PORT', '0'))
+        if not port or self._server is not None:
+            return None
+        host = host or os.getenv('METRICS_HOST', '0.0.0.0')
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"metrics request: {format % args}")
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True).start()
+        logger.info(f"Metrics endpoint listening on http://{host}:{self._server.server_port}/metrics")
+        return self._server
+
+    def stop_server(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# Shared by the scheduler, scrapers, email delivery and the bot
+metrics = MetricsRegistry()
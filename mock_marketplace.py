@@ -0,0 +1,298 @@
+# Mock marketplace
+# Local stand-in for eBay search pages, Depop search pages and the Depop web API,
+# with configurable latency, new-listing arrival rate, challenge pages and
+# oversized pages, so whole monitoring cycles can be load-tested offline.
+# Run: python mock_marketplace.py [--port 8900], then point the scrapers at it
+# with the EBAY_BASE_URL / DEPOP_BASE_URL / DEPOP_API_URL it prints
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from html import escape
+from urllib.parse import urlparse, parse_qs, quote_plus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+EBAY_PAGE_SIZE = 60
+DEPOP_PAGE_SIZE = 24
+BACKLOG = 1000  # Listings each term already has when the server starts
+
+SIZES = ('S', 'M', 'L', 'XL', 'XXL')
+CONDITIONS = ('Vintage', 'VTG', 'Rare', 'Faded', 'Deadstock', 'True Vintage')
+OFF_TOPIC_TITLES = (
+    'Vintage 90s Nike Center Swoosh Crewneck Sweatshirt',
+    'Russell Athletic Pro Cotton Sweatshirt Grey',
+    'Not Champion Reverse Weave Style Heavyweight Hoodie',
+    'Patagonia Retro X Fleece Jacket',
+    'Vintage Wrangler Denim Jacket Blue',
+)
+
+# Smallest valid GIF - every listing image resolves to it
+PIXEL_GIF = bytes.fromhex('47494638396101000100800000000000ffffff21f90401000000002c00000000010001000002024401003b')
+
+CHALLENGE_HTML = b'''<!DOCTYPE html><html><head><title>Security Measure</title></head>
+<body><div id="splashui"><h1>Checking your browser before you access eBay.</h1></div></body></html>'''
+
+
+def _term_seed(term):
+    return int.from_bytes(hashlib.blake2b(term.encode(), digest_size=6).digest(), 'big')
+
+
+class MockMarketplace:
+    """Threaded HTTP server faking the eBay and Depop search endpoints
+
+    Every search term has its own newest-first listing stream: BACKLOG
+    listings exist at start-up and ``arrivals_per_hour`` more appear per term
+    per hour. A listing's ID, title and price depend only on (term, index),
+    so repeat searches return the same listings until new ones arrive.
+    """
+
+    def __init__(self, latency_ms=None, jitter_ms=None, arrivals_per_hour=None, challenge_rate=None,
+                 heavy_page_rate=None, heavy_page_mb=None, off_topic_rate=None, seed=None):
+        self.latency_ms = float(latency_ms if latency_ms is not None else os.getenv('MOCK_LATENCY_MS', '150'))
+        self.jitter_ms = float(jitter_ms if jitter_ms is not None else os.getenv('MOCK_LATENCY_JITTER_MS', '100'))
+        self.arrivals_per_hour = float(arrivals_per_hour if arrivals_per_hour is not None else os.getenv('MOCK_ARRIVALS_PER_HOUR', '6'))
+        # Share of search requests answered with a bot challenge (eBay redirect, Depop 403)
+        self.challenge_rate = float(challenge_rate if challenge_rate is not None else os.getenv('MOCK_CHALLENGE_RATE', '0'))
+        # Share of HTML pages padded with heavy_page_mb of hidden markup, enough to crash a small tab
+        self.heavy_page_rate = float(heavy_page_rate if heavy_page_rate is not None else os.getenv('MOCK_HEAVY_PAGE_RATE', '0'))
+        self.heavy_page_mb = float(heavy_page_mb if heavy_page_mb is not None else os.getenv('MOCK_HEAVY_PAGE_MB', '50'))
+        # Share of results whose title does not match the term (eBay and Depop pad results too)
+        self.off_topic_rate = float(off_topic_rate if off_topic_rate is not None else os.getenv('MOCK_OFF_TOPIC_RATE', '0.3'))
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.started = time.time()
+        self.stats = {'requests': 0, 'ebay_pages': 0, 'depop_pages': 0, 'depop_api': 0, 'challenges': 0, 'heavy_pages': 0}
+        self.stats_lock = threading.Lock()
+        self._padding_html = None
+        self._server = None
+
+    # -- listing streams --------------------------------------------------
+
+    def newest_index(self, term):
+        """Index of the newest listing for term right now"""
+        return BACKLOG + int((time.time() - self.started) * self.arrivals_per_hour / 3600)
+
+    def listing(self, term, index):
+        seed = _term_seed(term)
+        rng = random.Random(seed * 1000003 + index)
+        if rng.random() < self.off_topic_rate:
+            title = f"{rng.choice(OFF_TOPIC_TITLES)} {rng.choice(SIZES)}"
+        else:
+            title = f"{rng.choice(CONDITIONS)} {term.title()} Size {rng.choice(SIZES)}"
+        # 12-digit IDs like eBay's, unique per (term, index)
+        listing_id = 100000000000 + (seed % 9000000) * 100000 + index % 100000
+        return {
+            'id': listing_id,
+            'title': title,
+            'price': f"{rng.randrange(20, 400)}.{rng.choice(('00', '50', '99'))}",
+            'slug': f"seller{seed % 997}-{'-'.join(title.lower().split())}-{listing_id:x}",
+        }
+
+    def page(self, term, offset, count):
+        """Newest-first listings offset..offset+count for term"""
+        newest = self.newest_index(term)
+        return [self.listing(term, index) for index in range(newest - offset, max(-1, newest - offset - count), -1)]
+
+    # -- responses --------------------------------------------------------
+
+    def _chance(self, rate):
+        if rate <= 0:
+            return False
+        with self.rng_lock:
+            return self.rng.random() < rate
+
+    def _latency(self):
+        with self.rng_lock:
+            return max(0.0, self.latency_ms + self.rng.uniform(-1, 1) * self.jitter_ms) / 1000
+
+    def _count(self, *keys):
+        with self.stats_lock:
+            for key in keys:
+                self.stats[key] += 1
+
+    def _padding(self):
+        """Hidden markup of heavy_page_mb, counted once per padded page"""
+        self._count('heavy_pages')
+        if self._padding_html is None:
+            block = '<div class="x-pad" hidden>' + 'x' * 1000 + '</div>'
+            self._padding_html = block * int(self.heavy_page_mb * 1024 * 1024 / len(block))
+        return self._padding_html
+
+    def image_url(self, listing):
+        return f"{self.url}/img/{listing['id']}.gif"
+
+    def ebay_search(self, query):
+        term = query.get('_nkw', [''])[0]
+        page = max(1, int(query.get('_pgn', ['1'])[0] or 1))
+        size = int(query.get('_ipg', [str(EBAY_PAGE_SIZE)])[0] or EBAY_PAGE_SIZE)
+        cards = []
+        for listing in self.page(term, (page - 1) * size, size):
+            href = f"{self.url}/itm/{listing['id']}?hash=item{listing['id'] % 10 ** 10:x}"
+            cards.append(
+                f'<li class="s-card s-card--horizontal" data-listingid="{listing["id"]}">'
+                f'<div class="su-card-container__media"><a href="{href}"><img class="s-card__image" src="{self.image_url(listing)}"></a></div>'
+                f'<div class="su-card-container__header"><a class="su-link" href="{href}">'
+                f'<div role="heading" class="s-card__title"><span>{escape(listing["title"])}</span></div></a></div>'
+                f'<div class="s-card__attribute-row"><span class="su-styled-text s-card__price">${listing["price"]}</span></div></li>'
+            )
+        padding = self._padding() if self._chance(self.heavy_page_rate) else ''
+        return (
+            f'<!DOCTYPE html><html><head><title>{escape(term)} for sale | eBay</title></head><body>'
+            f'<ul class="srp-results srp-list">{"".join(cards)}</ul>{padding}</body></html>'
+        ).encode()
+
+    def depop_product(self, listing):
+        preview = {size: self.image_url(listing) for size in ('150', '320', '640')}
+        return {
+            'id': listing['id'],
+            'slug': listing['slug'],
+            'description': f"{listing['title']}\n\nGood vintage condition.",
+            'price': {'priceAmount': listing['price'], 'currencyName': 'USD'},
+            'pricing': {'final_price_key': 'original_price', 'original_price': {'total_price': listing['price']}},
+            'preview': preview,
+            'pictures': [preview],
+        }
+
+    def depop_api(self, query):
+        term = query.get('what', [''])[0]
+        count = min(int(query.get('itemsPerPage', [str(DEPOP_PAGE_SIZE)])[0] or DEPOP_PAGE_SIZE), DEPOP_PAGE_SIZE)
+        offset = int(query.get('cursor', ['0'])[0] or 0)
+        products = [self.depop_product(listing) for listing in self.page(term, offset, count)]
+        return json.dumps({
+            'meta': {'cursor': str(offset + count), 'hasMore': bool(products), 'resultCount': len(products)},
+            'products': products,
+        }).encode()
+
+    def depop_search(self, query):
+        term = query.get('q', [''])[0]
+        listings = self.page(term, 0, DEPOP_PAGE_SIZE * 2)
+        links = ''.join(
+            f'<li><a href="/products/{listing["slug"]}/"><img src="{self.image_url(listing)}"></a></li>'
+            for listing in listings
+        )
+        next_data = json.dumps({'props': {'pageProps': {'dehydratedState': {'queries': [
+            {'state': {'data': {'pages': [{'products': [self.depop_product(listing) for listing in listings]}]}}}
+        ]}}}})
+        padding = self._padding() if self._chance(self.heavy_page_rate) else ''
+        return (
+            f'<!DOCTYPE html><html><head><title>{escape(term)} | Depop</title></head><body><ul>{links}</ul>{padding}'
+            f'<script id="__NEXT_DATA__" type="application/json">{next_data}</script></body></html>'
+        ).encode()
+
+    # -- server -----------------------------------------------------------
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self):
+        """Environment variables pointing the scrapers at this server"""
+        return {
+            'EBAY_BASE_URL': self.url,
+            'DEPOP_BASE_URL': self.url,
+            'DEPOP_API_URL': f"{self.url}/api/v3/search/products/",
+        }
+
+    def start(self, port=None, host=None):
+        """Serve on a daemon thread; port 0 picks a free one"""
+        port = int(port if port is not None else os.getenv('MOCK_MARKETPLACE_PORT', '0'))
+        host = host or os.getenv('MOCK_MARKETPLACE_HOST', '127.0.0.1')
+        marketplace = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, like the real sites
+
+            def do_GET(self):
+                marketplace._count('requests')
+                parsed = urlparse(self.path)
+                query = parse_qs(parsed.query)
+                path = parsed.path
+
+                if path.startswith('/img/'):
+                    return self._send(200, PIXEL_GIF, 'image/gif')
+                if 'splashui' in path or 'challenge' in path:
+                    return self._send(200, CHALLENGE_HTML, 'text/html; charset=utf-8')
+
+                time.sleep(marketplace._latency())
+
+                challenged = marketplace._chance(marketplace.challenge_rate)
+                if path == '/sch/i.html':
+                    marketplace._count('ebay_pages')
+                    if challenged:
+                        marketplace._count('challenges')
+                        return self._redirect(f"/splashui/challenge?ap=1&ru={quote_plus(self.path)}")
+                    return self._send(200, marketplace.ebay_search(query), 'text/html; charset=utf-8')
+                if path.rstrip('/') == '/api/v3/search/products':
+                    marketplace._count('depop_api')
+                    if challenged:
+                        marketplace._count('challenges')
+                        return self._send(403, b'{"error": "forbidden"}', 'application/json')
+                    return self._send(200, marketplace.depop_api(query), 'application/json')
+                if path.rstrip('/') == '/search':
+                    marketplace._count('depop_pages')
+                    if challenged:
+                        marketplace._count('challenges')
+                        return self._redirect(f"/challenge?ru={quote_plus(self.path)}")
+                    return self._send(200, marketplace.depop_search(query), 'text/html; charset=utf-8')
+                self._send(404, b'not found', 'text/plain')
+
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _redirect(self, location):
+                self.send_response(302)
+                self.send_header('Location', location)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger.debug(f"mock marketplace: {format % args}")
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='mock-marketplace', daemon=True).start()
+        logger.info(f"Mock marketplace listening on {self.url}")
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve fake eBay/Depop search results for offline load tests')
+    parser.add_argument('--port', type=int, default=int(os.getenv('MOCK_MARKETPLACE_PORT', '8900')))
+    parser.add_argument('--host', default=os.getenv('MOCK_MARKETPLACE_HOST', '127.0.0.1'))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    marketplace = MockMarketplace().start(args.port, args.host)
+    print("Point the bot at the mock marketplace with:")
+    for name, value in marketplace.env().items():
+        print(f"  export {name}={value}")
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"Mock marketplace stats: {marketplace.stats}")
+    except KeyboardInterrupt:
+        marketplace.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+# Notification outbox
+# New listings are queued in champion_listings.db in the same transaction that
+# marks them seen; a separate worker groups them into emails and delivers them
+# with retries, so a failed or slow send neither loses listings nor holds up scraping
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox:
+    """Durable queue of listings waiting to be emailed
+
+    Pending listings are grouped into batches of ``batch_size``. Each batch
+    gets an idempotency key (a hash of its listing IDs) and a fixed part
+    number, persisted before the first send attempt. A retry, including one
+    after a crash mid-send, therefore sends the identical email under the same
+    key, and the provider can drop the duplicate. Failed batches back off
+    exponentially and are given up after ``max_attempts``.
+    """
+
+    def __init__(self, conn, lock, batch_size=50, max_attempts=None, retry_base_seconds=None, retry_max_seconds=None):
+        self.conn = conn
+        self.lock = lock
+        self.batch_size = batch_size
+        self.max_attempts = int(max_attempts if max_attempts is not None else os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+        self.retry_base_seconds = float(retry_base_seconds if retry_base_seconds is not None else os.getenv('OUTBOX_RETRY_BASE_SECONDS', '60'))
+        self.retry_max_seconds = float(retry_max_seconds if retry_max_seconds is not None else os.getenv('OUTBOX_RETRY_MAX_SECONDS', '3600'))
+        self._drain_lock = threading.Lock()
+        self.init_tables()
+
+    def init_tables(self):
+        with self.lock:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS notification_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    platform TEXT NOT NULL,
+                    listing_id TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    batch_key TEXT,
+                    enqueued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE (platform, listing_id)
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_batch ON notification_outbox (batch_key)')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS outbox_batches (
+                    batch_key TEXT PRIMARY KEY,
+                    part INTEGER NOT NULL,
+                    total INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    sent_at TIMESTAMP
+                )
+            ''')
+
+    @staticmethod
+    def enqueue(cursor, listings):
+        """Queue listings for delivery on the caller's cursor, inside the caller's transaction"""
+        cursor.executemany(
+            'INSERT OR IGNORE INTO notification_outbox (platform, listing_id, payload) VALUES (?, ?, ?)',
+            [(listing['platform'], listing['listing_id'], json.dumps(listing)) for listing in listings]
+        )
+
+    def pending_count(self):
+        with self.lock:
+            return self.conn.execute('''
+                SELECT COUNT(*) FROM notification_outbox o
+                LEFT JOIN outbox_batches b ON b.batch_key = o.batch_key
+                WHERE o.batch_key IS NULL OR b.status = 'pending'
+            ''').fetchone()[0]
+
+    def _form_batches(self):
+        """Assign unbatched listings to new batches of batch_size, oldest first"""
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                rows = cursor.execute(
+                    "SELECT id, platform || ':' || listing_id FROM notification_outbox WHERE batch_key IS NULL ORDER BY id"
+                ).fetchall()
+                chunks = [rows[start:start + self.batch_size] for start in range(0, len(rows), self.batch_size)]
+                for part, chunk in enumerate(chunks, 1):
+                    batch_key = hashlib.sha256(','.join(key for _, key in chunk).encode()).hexdigest()[:40]
+                    cursor.execute(
+                        'INSERT OR IGNORE INTO outbox_batches (batch_key, part, total) VALUES (?, ?, ?)',
+                        (batch_key, part, len(chunks))
+                    )
+                    cursor.executemany(
+                        'UPDATE notification_outbox SET batch_key = ? WHERE id = ?',
+                        [(batch_key, row_id) for row_id, _ in chunk]
+                    )
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+        return len(chunks)
+
+    def _due_batches(self):
+        """[(batch_key, part, total, attempts, listings)] ready for a send attempt"""
+        with self.lock:
+            batches = self.conn.execute('''
+                SELECT batch_key, part, total, attempts FROM outbox_batches
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                ORDER BY created_at, part
+            ''', (time.time(),)).fetchall()
+            due = []
+            for batch_key, part, total, attempts in batches:
+                payloads = self.conn.execute(
+                    'SELECT payload FROM notification_outbox WHERE batch_key = ? ORDER BY id', (batch_key,)
+                ).fetchall()
+                due.append((batch_key, part, total, attempts, [json.loads(payload) for (payload,) in payloads]))
+        return due
+
+    def drain(self, delivery, compose):
+        """Send every due batch; compose(listings, part, total) -> (subject, html, text, attachments)
+
+        Returns the number of listings delivered. Concurrent calls are
+        serialized so one batch is never in flight twice.
+        """
+        with self._drain_lock:
+            self._form_batches()
+            due = self._due_batches()
+            if not due:
+                return 0
+
+            messages = [compose(listings, part, total) + (batch_key,) for batch_key, part, total, _, listings in due]
+            results = delivery.send_all(messages)
+
+            delivered = 0
+            now = time.time()
+            with self.lock:
+                for (batch_key, part, total, attempts, listings), ok in zip(due, results):
+                    if ok:
+                        delivered += len(listings)
+                        self.conn.execute(
+                            "UPDATE outbox_batches SET status = 'sent', attempts = ?, sent_at = CURRENT_TIMESTAMP WHERE batch_key = ?",
+                            (attempts + 1, batch_key)
+                        )
+                        continue
+                    attempts += 1
+                    if attempts >= self.max_attempts:
+                        logger.error(f"Giving up on email batch {batch_key[:12]} ({len(listings)} listings) after {attempts} attempts")
+                        self.conn.execute(
+                            "UPDATE outbox_batches SET status = 'failed', attempts = ? WHERE batch_key = ?",
+                            (attempts, batch_key)
+                        )
+                        continue
+                    delay = min(self.retry_max_seconds, self.retry_base_seconds * 2 ** (attempts - 1))
+                    logger.warning(f"Email batch {batch_key[:12]} ({len(listings)} listings) failed, retrying in {delay:.0f}s (attempt {attempts}/{self.max_attempts})")
+                    self.conn.execute(
+                        'UPDATE outbox_batches SET attempts = ?, next_attempt_at = ? WHERE batch_key = ?',
+                        (attempts, now + delay, batch_key)
+                    )
+
+            logger.info(f"Outbox: delivered {delivered} listings in {sum(1 for ok in results if ok)}/{len(due)} email(s)")
+            return delivered
+
+
+class OutboxWorker:
+    """Background thread that drains the outbox whenever listings are queued (or on a timer for retries)"""
+
+    def __init__(self, outbox, delivery, compose, poll_seconds=None):
+        self.outbox = outbox
+        self.delivery = delivery
+        self.compose = compose
+        self.poll_seconds = float(poll_seconds if poll_seconds is not None else os.getenv('OUTBOX_POLL_SECONDS', '30'))
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='outbox-worker', daemon=True)
+        self._thread.start()
+
+    def notify(self):
+        self._wake.set()
+
+    def stop(self, timeout=30):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.outbox.drain(self.delivery, self.compose)
+            except Exception as e:
+                logger.error(f"Outbox delivery error: {e}")
@@ -0,0 +1,138 @@
+# Page readiness detection for the Selenium scrapers
+# Waits until the listing cards have rendered and the DOM has gone quiet,
+# instead of sleeping a fixed number of seconds after every page load
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+from cycle_profiler import cycle_profiler
+
+logger = logging.getLogger(__name__)
+
+# Installed once per document: records when the DOM last changed
+_OBSERVER_SCRIPT = """
+if (!window.__rwObserver) {
+    window.__rwLastMutation = performance.now();
+    window.__rwObserver = new MutationObserver(function() {
+        window.__rwLastMutation = performance.now();
+    });
+    window.__rwObserver.observe(document.documentElement, {childList: true, subtree: true});
+}
+"""
+
+# Returns [matching card count, ms since last DOM mutation, current URL]
+_PROBE_SCRIPT = """
+var quietMs = window.__rwLastMutation === undefined ? 0 : performance.now() - window.__rwLastMutation;
+return [document.querySelectorAll(arguments[0]).length, quietMs, window.location.href];
+"""
+
+
+class PageReadiness:
+    """Adaptive wait for search result pages, learning each site's load time
+
+    A page is ready once the listing-card selector matches at least one
+    element, its count has stopped changing for ``quiet_period`` seconds and
+    no DOM mutation happened in that window. Pages that keep mutating (ads,
+    carousels) are accepted once the card count alone has been stable for
+    three quiet periods. Pages where no card ever appears are abandoned after
+    a per-site budget derived from the p95 of previously observed ready
+    times, never longer than ``ceiling``.
+    """
+
+    def __init__(self, ceiling=15.0, floor=2.0, quiet_period=0.4, poll_interval=0.2, history=50, min_samples=5):
+        self.ceiling = ceiling
+        self.floor = floor
+        self.quiet_period = quiet_period
+        self.poll_interval = poll_interval
+        self.min_samples = min_samples
+        self._samples = {}
+        self._history = history
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            ceiling=float(os.getenv('READINESS_CEILING', '15')),
+            floor=float(os.getenv('READINESS_FLOOR', '2')),
+            quiet_period=float(os.getenv('READINESS_QUIET_PERIOD', '0.4')),
+        )
+
+    def p95(self, site):
+        """95th percentile of observed ready times for a site, or None if too few samples"""
+        with self._lock:
+            samples = sorted(self._samples.get(site, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def budget(self, site):
+        """How long to wait for a page on this site before giving up"""
+        p95 = self.p95(site)
+        if p95 is None:
+            return self.ceiling
+        return min(self.ceiling, max(self.floor, p95 * 1.5))
+
+    def _record(self, site, elapsed):
+        with self._lock:
+            self._samples.setdefault(site, deque(maxlen=self._history)).append(elapsed)
+
+    @cycle_profiler.timed('selenium.wait_ready')
+    def wait_for_listings(self, driver, site, selector, abort_url_markers=()):
+        """Block until the listing cards for ``selector`` are rendered and stable
+
+        Returns a dict with ``ready`` (bool), ``count`` (cards found),
+        ``elapsed`` (seconds) and ``aborted`` (True if the browser landed on
+        a URL containing one of ``abort_url_markers``, e.g. a challenge page).
+        """
+        start = time.monotonic()
+        deadline = start + self.budget(site)
+        last_count = -1
+        stable_since = start
+        count = 0
+
+        try:
+            driver.execute_script(_OBSERVER_SCRIPT)
+        except Exception as e:
+            logger.debug(f"Could not install DOM observer on {site}: {e}")
+
+        while True:
+            now = time.monotonic()
+            try:
+                count, quiet_ms, current_url = driver.execute_script(_PROBE_SCRIPT, selector)
+            except Exception as e:
+                error_msg = str(e).lower()
+                if 'tab crashed' in error_msg or 'session' in error_msg:
+                    raise
+                # Document may be mid-navigation; try again on the next poll
+                logger.debug(f"Readiness probe failed on {site}: {e}")
+                count, quiet_ms, current_url = last_count, 0, ''
+
+            if current_url and any(marker in current_url for marker in abort_url_markers):
+                return {'ready': False, 'count': 0, 'elapsed': now - start, 'aborted': True}
+
+            if count != last_count:
+                last_count = count
+                stable_since = now
+            stable_for = now - stable_since
+
+            if count > 0:
+                dom_quiet = quiet_ms >= self.quiet_period * 1000
+                if (stable_for >= self.quiet_period and dom_quiet) or stable_for >= self.quiet_period * 3:
+                    elapsed = now - start
+                    self._record(site, elapsed)
+                    logger.debug(f"{site} page ready after {elapsed:.2f}s with {count} cards")
+                    return {'ready': True, 'count': count, 'elapsed': elapsed, 'aborted': False}
+
+            if now >= deadline:
+                # Cards appeared but never settled - still usable, just not learned from
+                return {'ready': count > 0, 'count': max(count, 0), 'elapsed': now - start, 'aborted': False}
+
+            time.sleep(self.poll_interval)
+
+
+# Shared across every scraper instance and worker thread so learned load times
+# survive driver restarts
+page_readiness = PageReadiness.from_env()
@@ -0,0 +1,137 @@
+# Adaptive polling scheduler
+# Gives every search term its own polling interval from its historical arrival
+# rate in seen_listings, within min/max bounds and a global searches-per-hour budget
+
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+SQLITE_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class TermPollState:
+    """Arrival-rate estimate and polling interval for one search term"""
+
+    def __init__(self, term):
+        self.term = term
+        self.rate_per_hour = 0.0
+        self.interval_hours = 0.0
+        self.next_due = 0.0  # time.monotonic() deadline; 0 = due immediately
+
+
+class AdaptivePollScheduler:
+    """Decides which search terms are due for a scrape on each tick
+
+    A term is polled once ``target_per_poll`` new listings are expected since
+    its last poll. Arrival rates come from ``seen_listings.first_seen`` over the
+    last ``lookback_days``, smoothed towards the fixed two-hour cadence the bot
+    used before (``prior_hours`` of pseudo-history at that rate) so new or
+    quiet terms start from the old schedule. Intervals are clamped to
+    [min_minutes, max_hours] and stretched together until the total polls per
+    hour fit ``budget_per_hour``, which defaults to the old fixed schedule's
+    cost.
+    """
+
+    BASELINE_HOURS = 2.0  # The fixed cadence this scheduler replaces
+    SEED_GRACE_HOURS = 1.0  # Rows from the first-run seeding batch are not arrivals
+
+    def __init__(self, search_terms, conn, lock, target_per_poll=None, min_minutes=None, max_hours=None,
+                 budget_per_hour=None, lookback_days=None, prior_hours=None, refresh_minutes=None):
+        self.search_terms = list(search_terms)
+        self.conn = conn
+        self.lock = lock
+        self.target_per_poll = float(target_per_poll if target_per_poll is not None else os.getenv('POLL_TARGET_NEW', '5'))
+        self.min_hours = float(min_minutes if min_minutes is not None else os.getenv('POLL_MIN_MINUTES', '20')) / 60
+        self.max_hours = float(max_hours if max_hours is not None else os.getenv('POLL_MAX_HOURS', '24'))
+        default_budget = len(self.search_terms) / self.BASELINE_HOURS
+        self.budget_per_hour = float(budget_per_hour if budget_per_hour is not None else os.getenv('POLL_BUDGET_PER_HOUR', default_budget))
+        self.lookback_days = float(lookback_days if lookback_days is not None else os.getenv('POLL_LOOKBACK_DAYS', '14'))
+        self.prior_hours = float(prior_hours if prior_hours is not None else os.getenv('POLL_PRIOR_HOURS', '24'))
+        self.refresh_seconds = float(refresh_minutes if refresh_minutes is not None else os.getenv('POLL_REFRESH_MINUTES', '60')) * 60
+        self.states = {term: TermPollState(term) for term in self.search_terms}
+        self._refreshed_at = None
+
+    def _arrival_counts(self):
+        """(listings per term, hours observed) inside the lookback window"""
+        now = datetime.utcnow()
+        with self.lock:
+            first = self.conn.execute('SELECT MIN(first_seen) FROM seen_listings').fetchone()[0]
+        if first is None:
+            return {}, 0.0
+
+        # The window starts after the seeding batch, which records everything live at once
+        window_start = max(
+            now - timedelta(days=self.lookback_days),
+            datetime.strptime(first[:19], SQLITE_TIME_FORMAT) + timedelta(hours=self.SEED_GRACE_HOURS)
+        )
+        hours = max(0.0, (now - window_start).total_seconds() / 3600)
+        if hours == 0:
+            return {}, 0.0
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT search_term, COUNT(*) FROM seen_listings WHERE first_seen >= ? GROUP BY search_term',
+                (window_start.strftime(SQLITE_TIME_FORMAT),)
+            ).fetchall()
+        return dict(rows), hours
+
+    def refresh(self):
+        """Re-estimate arrival rates and recompute every term's interval"""
+        counts, hours = self._arrival_counts()
+        prior_rate = self.target_per_poll / self.BASELINE_HOURS
+        for state in self.states.values():
+            state.rate_per_hour = (counts.get(state.term, 0) + prior_rate * self.prior_hours) / (hours + self.prior_hours)
+
+        scale = self._budget_scale()
+        for state in self.states.values():
+            old_interval = state.interval_hours
+            state.interval_hours = self._interval(state, scale)
+            if old_interval and state.next_due:
+                # Keep the time already waited when an interval changes
+                state.next_due += (state.interval_hours - old_interval) * 3600
+        self._refreshed_at = time.monotonic()
+
+        polls_per_hour = sum(1 / state.interval_hours for state in self.states.values())
+        logger.info(f"Polling plan: {polls_per_hour:.1f} term polls/hour (budget {self.budget_per_hour:.1f}) over {hours:.0f}h of history")
+        for state in sorted(self.states.values(), key=lambda s: s.interval_hours):
+            logger.debug(f"  '{state.term}': {state.rate_per_hour:.2f}/h -> every {state.interval_hours * 60:.0f} min")
+
+    def _interval(self, state, scale=1.0):
+        ideal = self.target_per_poll / state.rate_per_hour if state.rate_per_hour > 0 else self.max_hours
+        return min(self.max_hours, max(self.min_hours, ideal * scale))
+
+    def _budget_scale(self):
+        """Smallest common stretch factor that brings total polls per hour within the budget"""
+        def polls_per_hour(scale):
+            return sum(1 / self._interval(state, scale) for state in self.states.values())
+
+        if polls_per_hour(1.0) <= self.budget_per_hour:
+            return 1.0
+        low, high = 1.0, 2.0
+        while polls_per_hour(high) > self.budget_per_hour and high < self.max_hours / self.min_hours:
+            high *= 2
+        for _ in range(40):
+            mid = (low + high) / 2
+            if polls_per_hour(mid) > self.budget_per_hour:
+                low = mid
+            else:
+                high = mid
+        return high
+
+    def due_terms(self):
+        """Terms whose interval has elapsed, in configuration order"""
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at >= self.refresh_seconds:
+            self.refresh()
+        now = time.monotonic()
+        return [term for term in self.search_terms if self.states[term].next_due <= now]
+
+    def mark_polled(self, terms):
+        if self._refreshed_at is None:
+            self.refresh()
+        now = time.monotonic()
+        for term in terms:
+            state = self.states.get(term)
+            if state is not None:
+                state.next_due = now + state.interval_hours * 3600
@@ -62,6 +62,7 @@ def check_imports():
         "dotenv",
         "selenium",
         "webdriver_manager",
+        "aiohttp",
         "sqlite3",
         "smtplib",
         "email"
@@ -0,0 +1,227 @@
+# Search query planner
+# Collapses overlapping search terms into a smaller set of broader platform
+# searches and fans the results back out to the original terms with the matcher
+
+import os
+import re
+import logging
+
+from listing_matcher import ListingMatcher, compile_term, STOP_WORDS
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"[a-z0-9']+")
+DEPOP_SLUG_RE = re.compile(r'/products/([^/?#]+)')
+
+
+def term_words(search_term):
+    return tuple(WORD_RE.findall(search_term.lower()))
+
+
+def _is_specific(words):
+    """A merged query needs at least two meaningful words, or it floods the newest-first results"""
+    return sum(1 for w in words if w not in STOP_WORDS and len(w) > 2) >= 2
+
+
+def _listing_text(listing):
+    """Lower-cased text the platform matched on - Depop also searches the product slug"""
+    text = listing['title']
+    if listing.get('platform') == 'Depop':
+        slug = DEPOP_SLUG_RE.search(listing.get('url', ''))
+        if slug:
+            text = f"{text} {slug.group(1).replace('-', ' ')}"
+    return text.lower()
+
+
+class QueryGroup:
+    """One platform search standing in for one or more configured terms"""
+
+    def __init__(self, query, members):
+        self.query = query
+        self.members = members
+        query_words = set(term_words(query))
+        # Words each member adds on top of the query; a fanned-out listing must contain them all,
+        # as the platform's own search for that member would have required
+        self.extra_words = {
+            term: [re.compile(r'\b' + re.escape(w) + r'\b') for w in term_words(term) if w not in query_words]
+            for term in members
+        }
+
+    @property
+    def merged(self):
+        return self.members != [self.query]
+
+
+class QueryPlanner:
+    """Plans the searches one platform runs per cycle and checks their coverage
+
+    Terms are covered greedily by the broadest specific query (an existing term
+    or the words two terms share) whose relevance rule accepts every title the
+    covered term would. Every ``audit_every`` cycles the merged members are also
+    searched directly; members whose direct results the broad query missed are
+    searched on their own from then on if the group's coverage falls below
+    ``min_coverage``. Coverage only counts direct results within the period
+    the broad page reached back to (see ``_audit_group``).
+
+    A cycle for some terms searches whole groups and fans the results out to
+    every member, so ``covered_terms`` reports all of them: the bot counts
+    those members as polled rather than discarding results it already has.
+    """
+
+    def __init__(self, search_terms, matcher=None, platform='', audit_every=None, min_coverage=None):
+        self.search_terms = list(search_terms)
+        self.matcher = matcher or ListingMatcher(self.search_terms)
+        self.platform = platform
+        self.audit_every = int(audit_every if audit_every is not None else os.getenv('QUERY_PLAN_AUDIT_EVERY', '6'))
+        self.min_coverage = float(min_coverage if min_coverage is not None else os.getenv('QUERY_PLAN_MIN_COVERAGE', '0.95'))
+        self.pinned = set()  # Terms that failed a coverage audit and are searched individually
+        self.cycles = 0
+        self.auditing = False
+        self.last_report = {}
+        self.groups = self._plan()
+        self.active_groups = self.groups
+
+    def _covers(self, query_words, term):
+        """Whether a search for query_words can stand in for a search for term"""
+        words = term_words(term)
+        if not set(query_words) <= set(words):
+            return False
+        query_rule = compile_term(' '.join(query_words))
+        term_rule = compile_term(term)
+        if query_rule.reject_not_champion and not term_rule.reject_not_champion:
+            return False
+        # Every listing fanned out to term matches term's rule and contains all of term's words,
+        # so each requirement of the query rule must follow from one of those two facts
+        for patterns, min_count in query_rule.requirements:
+            if any(set(term_patterns) <= set(patterns) and term_min >= min_count
+                   for term_patterns, term_min in term_rule.requirements):
+                continue
+            if sum(1 for p in patterns if p in words) >= min_count:
+                continue
+            return False
+        return True
+
+    def _plan(self):
+        active = [term for term in self.search_terms if term not in self.pinned]
+
+        candidates = {term_words(term) for term in active}
+        for i, first in enumerate(active):
+            first_words = term_words(first)
+            for second in active[i + 1:]:
+                shared = set(term_words(second))
+                candidates.add(tuple(w for w in first_words if w in shared))
+        candidates = [words for words in candidates if _is_specific(words)]
+
+        groups = []
+        uncovered = list(active)
+        while uncovered:
+            best_words, best_members = None, []
+            for words in candidates:
+                members = [term for term in uncovered if self._covers(words, term)]
+                # Prefer wider coverage, then the narrower (more specific) query
+                if (len(members), len(words)) > (len(best_members), len(best_words or ())):
+                    best_words, best_members = words, members
+            if len(best_members) < 2:
+                break
+            groups.append(QueryGroup(' '.join(best_words), best_members))
+            uncovered = [term for term in uncovered if term not in best_members]
+
+        singles = set(uncovered) | self.pinned
+        groups.extend(QueryGroup(term, [term]) for term in self.search_terms if term in singles)
+
+        searches = len({group.query for group in groups})
+        logger.info(f"{self.platform} query plan: {searches} searches for {len(self.search_terms)} terms")
+        for group in groups:
+            if group.merged:
+                logger.debug(f"  '{group.query}' covers {group.members}")
+        return groups
+
+    def covered_terms(self, terms=None):
+        """Terms searched when ``terms`` are asked for - every member of the groups they belong to"""
+        wanted = set(self.search_terms if terms is None else terms)
+        covered = {term for group in self.groups if wanted.intersection(group.members) for term in group.members}
+        return [term for term in self.search_terms if term in covered]
+
+    def begin_cycle(self, audit=None, terms=None):
+        """Queries to run this cycle; an audit cycle adds a direct search for every merged member
+
+        With ``terms``, only the groups covering at least one of them are searched.
+        """
+        self.auditing = self.cycles % self.audit_every == 0 if audit is None and self.audit_every > 0 else bool(audit)
+        self.cycles += 1
+
+        covered = set(self.covered_terms(terms))
+        self.active_groups = [group for group in self.groups if covered.intersection(group.members)]
+        queries = [group.query for group in self.active_groups]
+        if self.auditing:
+            queries.extend(term for group in self.active_groups if group.merged for term in group.members)
+        return list(dict.fromkeys(queries))
+
+    def fan_out(self, per_query):
+        """Turn {query: listings} into listings tagged with the original terms, in term order"""
+        per_term = {term: [] for term in self.search_terms}
+        report = {'searches': len(per_query), 'terms': len(self.search_terms), 'groups': {}}
+
+        for group in self.active_groups:
+            found = per_query.get(group.query, [])
+            if not group.merged:
+                per_term[group.query].extend(found)
+                continue
+
+            for listing in found:
+                text = _listing_text(listing)
+                for term in group.members:
+                    if all(word.search(text) for word in group.extra_words[term]) and self.matcher.matches(text, term):
+                        per_term[term].append(dict(listing, search_term=term))
+
+            if self.auditing:
+                report['groups'][group.query] = self._audit_group(group, per_query, per_term)
+
+        if self.auditing and report['groups']:
+            self._apply_audit(report['groups'])
+        self.last_report = report
+
+        listings = []
+        for term in self.search_terms:
+            listings.extend(per_term[term])
+        return listings
+
+    def _audit_group(self, group, per_query, per_term):
+        """Compare direct member results with the fanned-out ones, keeping the union for this cycle
+
+        A broad newest-first page only reaches back so far, while each direct
+        search reaches back as far again for its own term, so coverage is only
+        measured inside the broad query's window: a member's direct results
+        down to the oldest one the broad search also returned. Everything
+        newer than that listing should have been on the broad page too. Older
+        direct results are still reported, but are not counted as misses.
+        """
+        broad_ids = {listing['listing_id'] for listing in per_query.get(group.query, [])}
+        direct_total, missed = 0, {}
+        for term in group.members:
+            direct = list({listing['listing_id']: listing for listing in per_query.get(term, [])}.values())
+            fanned_ids = {listing['listing_id'] for listing in per_term[term]}
+            missing = [listing for listing in direct if listing['listing_id'] not in fanned_ids]
+            if missing:
+                # Report what the direct search found, so an audit cycle never loses listings
+                per_term[term].extend(missing)
+
+            anchors = [i for i, listing in enumerate(direct) if listing['listing_id'] in broad_ids]
+            window = direct[:anchors[-1] + 1] if anchors else []
+            in_window = sum(1 for listing in window if listing['listing_id'] not in fanned_ids)
+            direct_total += len(window)
+            if in_window:
+                missed[term] = in_window
+        coverage = 1.0 - sum(missed.values()) / direct_total if direct_total else 1.0
+        return {'coverage': coverage, 'direct': direct_total, 'missed': missed}
+
+    def _apply_audit(self, groups):
+        replan = False
+        for query, result in groups.items():
+            logger.info(f"{self.platform} coverage audit: '{query}' found {result['coverage']:.0%} of {result['direct']} direct results in its window")
+            if result['coverage'] < self.min_coverage:
+                logger.warning(f"{self.platform}: '{query}' below {self.min_coverage:.0%} coverage - searching {sorted(result['missed'])} individually")
+                self.pinned.update(result['missed'])
+                replan = True
+        if replan:
+            self.groups = self._plan()
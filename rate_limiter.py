@@ -0,0 +1,163 @@
+# Rate limiter
+# Per-domain token buckets that every scraper request goes through, shared by all
+# threads of the process and, with RATE_LIMIT_STATE_PATH, by every process on the
+# host; a domain answering with challenge pages or HTTP 403/429 is slowed down
+
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from urllib.parse import urlparse
+
+from cycle_profiler import cycle_profiler
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Legacy per-site interval settings, used as the rate when RATE_LIMIT_<SITE> is unset
+LEGACY_INTERVALS = {
+    'ebay': ('EBAY_MIN_INTERVAL',),
+    'depop': ('DEPOP_API_INTERVAL', 'DEPOP_MIN_INTERVAL'),
+}
+DEFAULT_RATES = {'ebay': '0.5', 'depop': '2'}  # Requests per second
+
+
+def domain_of(url):
+    """Rate-limit key for a URL: the registrable domain (www.ebay.com and ebay.com share one bucket)
+
+    IP addresses and single-label hosts keep their port, so local stand-ins on
+    different ports get separate buckets.
+    """
+    parsed = urlparse(url if '//' in url else f"//{url}")
+    host = (parsed.hostname or '').lower()
+    if not host or host.replace('.', '').isdigit() or '.' not in host:
+        return f"{host}:{parsed.port}" if parsed.port else host
+    return '.'.join(host.split('.')[-2:])
+
+
+class RateLimiter:
+    """Token bucket per domain, kept as a reservation schedule (GCRA)
+
+    A domain allows ``rate`` requests per second with bursts of ``burst``
+    after idle time. Each request reserves the next free slot and then sleeps
+    until it, so no lock is held while waiting and concurrent callers queue in
+    order. ``observe`` feeds responses back: a challenge page, 403 or 429
+    doubles the domain's slowdown (up to ``max_slowdown``), and every normal
+    response eases it back towards 1.
+    """
+
+    def __init__(self, rates=None, default_rate=None, burst=None, max_slowdown=None, recovery=None, state_path=None):
+        self.rates = rates if rates is not None else {}
+        self.default_rate = float(default_rate if default_rate is not None else os.getenv('RATE_LIMIT_DEFAULT', '0'))
+        self.burst = max(1, int(burst if burst is not None else os.getenv('RATE_LIMIT_BURST', '5')))
+        self.max_slowdown = float(max_slowdown if max_slowdown is not None else os.getenv('RATE_LIMIT_MAX_SLOWDOWN', '16'))
+        # Slowdown kept after each normal response (0.9 halves it in ~7 responses)
+        self.recovery = float(recovery if recovery is not None else os.getenv('RATE_LIMIT_RECOVERY', '0.9'))
+        self.state_path = state_path if state_path is not None else os.getenv('RATE_LIMIT_STATE_PATH', '')
+        self._lock = threading.Lock()
+        self._state = {}  # domain -> (theoretical arrival time, slowdown)
+        self._conn = None
+
+    @classmethod
+    def from_env(cls):
+        rates = {}
+        for site, default in DEFAULT_RATES.items():
+            rate = os.getenv(f"RATE_LIMIT_{site.upper()}")
+            if rate is None:
+                legacy = next((os.getenv(name) for name in LEGACY_INTERVALS[site] if os.getenv(name)), None)
+                rate = str(1 / float(legacy)) if legacy and float(legacy) > 0 else default
+            rates[site] = float(rate)
+        return cls(rates=rates)
+
+    def rate_for(self, domain):
+        """Requests per second allowed for domain (0 = unlimited)"""
+        return self.rates.get(domain.split('.')[0], self.default_rate)
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.state_path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS rate_limits (domain TEXT PRIMARY KEY, tat REAL NOT NULL, slowdown REAL NOT NULL)')
+        return self._conn
+
+    def _update(self, domain, change):
+        """Apply change(tat, slowdown, now) -> (tat, slowdown, result) atomically, in-process or across processes"""
+        with self._lock:
+            now = time.time()
+            if not self.state_path:
+                tat, slowdown = self._state.get(domain, (now, 1.0))
+                tat, slowdown, result = change(tat, slowdown, now)
+                self._state[domain] = (tat, slowdown)
+                return result, slowdown
+
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT tat, slowdown FROM rate_limits WHERE domain = ?', (domain,)).fetchone()
+                tat, slowdown, result = change(*(row or (now, 1.0)), now)
+                conn.execute('INSERT OR REPLACE INTO rate_limits (domain, tat, slowdown) VALUES (?, ?, ?)', (domain, tat, slowdown))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            return result, slowdown
+
+    def reserve(self, url):
+        """Reserve the next request slot for url's domain; returns the seconds to wait before sending"""
+        domain = domain_of(url)
+        rate = self.rate_for(domain)
+        if rate <= 0:
+            return 0.0
+
+        def take_slot(tat, slowdown, now):
+            interval = slowdown / rate
+            tat = max(tat, now)
+            # Up to burst requests may run ahead of the steady schedule
+            start = max(now, tat - (self.burst - 1) * interval)
+            return tat + interval, slowdown, start - now
+
+        delay, _ = self._update(domain, take_slot)
+        return delay
+
+    def acquire(self, url):
+        """Block until a request to url is allowed; returns the seconds waited"""
+        delay = self.reserve(url)
+        if delay > 0:
+            with cycle_profiler.span('sleep.rate_limit'):
+                time.sleep(delay)
+        return delay
+
+    async def acquire_async(self, url):
+        """acquire() for asyncio callers"""
+        delay = self.reserve(url)
+        if delay > 0:
+            with cycle_profiler.span('sleep.rate_limit'):
+                await asyncio.sleep(delay)
+        return delay
+
+    def observe(self, url, status=None, challenge=False):
+        """Feed back a response: challenges and 403/429 slow the domain down, anything else eases off"""
+        domain = domain_of(url)
+        if self.rate_for(domain) <= 0:
+            return
+        blocked = challenge or status in (403, 429)
+
+        def adjust(tat, slowdown, now):
+            if blocked:
+                slowdown = min(self.max_slowdown, slowdown * 2)
+                # Drop the burst credit: the next request waits a full (slowed) interval
+                tat = max(tat, now + self.burst * slowdown / self.rate_for(domain))
+            else:
+                slowdown = max(1.0, slowdown * self.recovery)
+            return tat, slowdown, None
+
+        _, slowdown = self._update(domain, adjust)
+        metrics.rate_limit_slowdown.set(slowdown, domain=domain)
+        if blocked:
+            logger.warning(f"Rate limiter: {domain} answered with {'a challenge' if challenge else status}, slowing to {self.rate_for(domain) / slowdown:.2f} req/s")
+
+
+# Shared by every scraper, so all workers of a site draw from the same bucket
+rate_limiter = RateLimiter.from_env()
@@ -0,0 +1,148 @@
+# Database retention
+# Ages old listings out of champion_listings.db: their full rows are replaced by
+# 8-byte ID hashes that still answer "seen before?", delivered outbox rows and old
+# challenge events are dropped, and freed pages are returned to the filesystem with
+# incremental vacuum
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+SQLITE_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def retired_key(platform, listing_id):
+    """Signed 64-bit hash standing in for a retired (platform, listing_id)
+
+    At 2^-64 per pair, a false "already seen" is practically impossible even
+    over millions of retired listings.
+    """
+    digest = hashlib.blake2b(f"{platform}:{listing_id}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class RetentionJob:
+    """Periodic pruning of listings older than ``retention_days``
+
+    Runs at most once every ``every_hours`` (tracked in db_maintenance, so the
+    interval holds across the one-cycle-per-process GitHub Actions runs too).
+    The first run switches the database to incremental auto-vacuum, which takes
+    one full VACUUM; later runs only release the pages they freed.
+    """
+
+    TASK = 'retention'
+    DELETE_CHUNK = 5000
+
+    def __init__(self, conn, lock, retention_days=None, every_hours=None, vacuum_pages=None):
+        self.conn = conn
+        self.lock = lock
+        self.retention_days = float(retention_days if retention_days is not None else os.getenv('RETENTION_DAYS', '90'))
+        self.every_hours = float(every_hours if every_hours is not None else os.getenv('RETENTION_EVERY_HOURS', '24'))
+        # Pages released per run (0 = all free pages); bounds how long a run holds the write lock
+        self.vacuum_pages = int(vacuum_pages if vacuum_pages is not None else os.getenv('RETENTION_VACUUM_PAGES', '0'))
+
+    @property
+    def enabled(self):
+        return self.retention_days > 0
+
+    def _size(self):
+        """Database bytes - the file size the artifact upload will see after a checkpoint"""
+        page_size = self.conn.execute('PRAGMA page_size').fetchone()[0]
+        page_count = self.conn.execute('PRAGMA page_count').fetchone()[0]
+        return page_size * page_count
+
+    def due(self):
+        if not self.enabled:
+            return False
+        with self.lock:
+            row = self.conn.execute('SELECT last_run FROM db_maintenance WHERE task = ?', (self.TASK,)).fetchone()
+        return row is None or time.time() - row[0] >= self.every_hours * 3600
+
+    def run(self, force=False):
+        """Retire expired listings, prune delivered outbox rows and challenge events, and vacuum; returns a report dict"""
+        if not self.enabled or not (force or self.due()):
+            return None
+
+        started = time.monotonic()
+        cutoff = (datetime.utcnow() - timedelta(days=self.retention_days)).strftime(SQLITE_TIME_FORMAT)
+        with self.lock:
+            size_before = self._size()
+            retired = self._retire_listings(cutoff)
+            pruned = self._prune_outbox(cutoff)
+            self.conn.execute('DELETE FROM challenge_events WHERE occurred_at < ?', (cutoff,))
+            self.conn.execute(
+                'INSERT OR REPLACE INTO db_maintenance (task, last_run) VALUES (?, ?)', (self.TASK, time.time())
+            )
+            self._vacuum()
+            size_after = self._size()
+
+        report = {
+            'retired': retired,
+            'outbox_pruned': pruned,
+            'size_before_mb': round(size_before / 1024 / 1024, 2),
+            'size_after_mb': round(size_after / 1024 / 1024, 2),
+            'seconds': round(time.monotonic() - started, 2),
+        }
+        logger.info(
+            f"Retention: retired {retired} listings first seen before {cutoff}, pruned {pruned} outbox rows, "
+            f"database {report['size_before_mb']} MB -> {report['size_after_mb']} MB in {report['seconds']}s"
+        )
+        return report
+
+    def _retire_listings(self, cutoff):
+        """Replace rows first seen before cutoff with their ID hashes, a chunk per transaction"""
+        retired = 0
+        cursor = self.conn.cursor()
+        while True:
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                rows = cursor.execute(
+                    'SELECT id, platform, listing_id FROM seen_listings WHERE first_seen < ? ORDER BY first_seen LIMIT ?',
+                    (cutoff, self.DELETE_CHUNK)
+                ).fetchall()
+                cursor.executemany(
+                    'INSERT OR IGNORE INTO retired_listings (key) VALUES (?)',
+                    [(retired_key(platform, listing_id),) for _, platform, listing_id in rows]
+                )
+                row_ids = [(row_id,) for row_id, _, _ in rows]
+                cursor.executemany('DELETE FROM listing_terms WHERE listing_rowid = ?', row_ids)
+                cursor.executemany('DELETE FROM seen_listings WHERE id = ?', row_ids)
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            retired += len(rows)
+            if len(rows) < self.DELETE_CHUNK:
+                return retired
+
+    def _prune_outbox(self, cutoff):
+        """Drop outbox rows whose batch was sent or given up on before cutoff"""
+        cursor = self.conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            done = "SELECT batch_key FROM outbox_batches WHERE status != 'pending' AND created_at < ?"
+            pruned = cursor.execute(f'DELETE FROM notification_outbox WHERE batch_key IN ({done})', (cutoff,)).rowcount
+            cursor.execute(f'DELETE FROM outbox_batches WHERE batch_key IN ({done})', (cutoff,))
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        return pruned
+
+    def _vacuum(self):
+        if self.conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            # auto_vacuum only changes on an empty database or through a full rebuild
+            logger.info("Retention: switching champion_listings.db to incremental auto-vacuum (one-time VACUUM)")
+            self.conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            try:
+                self.conn.execute('VACUUM')
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Retention: VACUUM failed, will retry next run: {e}")
+            return
+        # The pragma frees one page per step, so it has to be stepped to completion
+        self.conn.execute(f'PRAGMA incremental_vacuum({self.vacuum_pages})' if self.vacuum_pages else 'PRAGMA incremental_vacuum').fetchall()
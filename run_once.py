@@ -44,6 +44,9 @@ if __name__ == "__main__":
             print(f"ERROR: Error in monitoring cycle: {e}")
             traceback.print_exc()
             sys.exit(1)
+        finally:
+            # Checkpoint the WAL so the uploaded database artifact is complete
+            bot.close()
     except Exception as e:
         print(f"ERROR: Fatal error: {e}")
         traceback.print_exc()
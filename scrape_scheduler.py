@@ -0,0 +1,255 @@
+# Concurrent scrape scheduler
+# Runs a pool of scraper workers per platform in parallel, feeding them
+# search terms from a shared work queue and merging the results
+
+import os
+import queue
+import threading
+import time
+import logging
+
+from memory_watchdog import memory_watchdog
+from cycle_profiler import cycle_profiler
+from circuit_breaker import circuit_breakers
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PlatformJob:
+    """Describes how one platform should be scraped by the scheduler"""
+
+    def __init__(self, platform, factory, workers=1, search_kwargs=None,
+                 recycle_every=0, uses_browser=True, chunk_size=1, pool=None, planner=None):
+        self.platform = platform
+        self.factory = factory  # Callable returning a scraper with search_listings()/close()
+        self.workers = max(1, int(workers))
+        self.search_kwargs = search_kwargs or {}
+        self.recycle_every = int(recycle_every)  # Fixed tab-recycle interval, used only when browser RSS cannot be measured (0 = never)
+        self.uses_browser = uses_browser
+        self.chunk_size = int(chunk_size)  # Terms handed to one search_listings call (0 = all remaining)
+        self.pool = pool  # BrowserPool to lease warm scrapers from instead of calling factory
+        self.planner = planner  # QueryPlanner collapsing overlapping terms into fewer searches
+
+
+def browser_budget():
+    """Maximum number of concurrent browsers allowed by the configured memory cap"""
+    if os.getenv('MAX_BROWSERS'):
+        return max(1, int(os.getenv('MAX_BROWSERS')))
+    budget_mb = int(os.getenv('BROWSER_MEMORY_BUDGET_MB', '900'))
+    per_browser_mb = int(os.getenv('BROWSER_MEMORY_MB', '300'))
+    return max(1, budget_mb // per_browser_mb)
+
+
+class ScrapeScheduler:
+    """Scrape every platform concurrently with a bounded pool of workers per site"""
+
+    def __init__(self, jobs, max_browsers=None):
+        self.jobs = jobs
+        self.max_browsers = max_browsers if max_browsers is not None else browser_budget()
+        self._allocate_workers()
+
+    def _allocate_workers(self):
+        """Share the browser budget across platforms, one worker each before any platform gets a second"""
+        self.allocation = {}
+        remaining = self.max_browsers
+        browser_jobs = [job for job in self.jobs if job.uses_browser]
+        for job in self.jobs:
+            if not job.uses_browser:
+                self.allocation[job.platform] = job.workers
+
+        # Round-robin so eBay and Depop run side by side even on a tight budget
+        for job in browser_jobs:
+            self.allocation[job.platform] = 0
+        progress = True
+        while remaining > 0 and progress:
+            progress = False
+            for job in browser_jobs:
+                if remaining > 0 and self.allocation[job.platform] < job.workers:
+                    self.allocation[job.platform] += 1
+                    remaining -= 1
+                    progress = True
+
+        for job in browser_jobs:
+            if self.allocation[job.platform] == 0:
+                # Never starve a platform entirely - it will run once a slot frees up
+                self.allocation[job.platform] = 1
+            if self.allocation[job.platform] < job.workers:
+                logger.info(f"{job.platform}: {job.workers} workers requested, {self.allocation[job.platform]} allowed by the browser memory budget")
+
+    def run(self, search_terms):
+        """Scrape all search terms on every platform and return {platform: listings}
+
+        Listings are returned in search-term order regardless of which worker
+        handled each term, so downstream deduplication stays deterministic.
+        Jobs with a planner search its planned queries instead and have the
+        results fanned back out to the original terms. Platforms paused by the
+        challenge circuit breaker are skipped.
+        """
+        browser_slots = threading.BoundedSemaphore(self.max_browsers)
+        results = {}
+        threads = []
+
+        for job in self.jobs:
+            if not circuit_breakers.allow(job.platform):
+                resume = time.strftime('%H:%M:%S', time.localtime(circuit_breakers.paused_until(job.platform)))
+                logger.warning(f"{job.platform}: paused after repeated challenge pages until {resume} - skipping this cycle")
+                continue
+            queries = job.planner.begin_cycle(terms=search_terms) if job.planner is not None else search_terms
+            search_kwargs = dict(job.search_kwargs)
+            if job.planner is not None and job.planner.auditing:
+                # Coverage audits compare full result pages; watermarks would cut each search short
+                search_kwargs.pop('watermarks', None)
+            work = queue.Queue()
+            for term in queries:
+                work.put(term)
+            per_term = {}
+            results[job.platform] = (job, queries, per_term, work)
+
+            for worker_num in range(self.allocation[job.platform]):
+                thread = threading.Thread(
+                    target=self._profiled_worker,
+                    args=(job, worker_num + 1, work, per_term, browser_slots, search_kwargs),
+                    name=f"{job.platform}-worker-{worker_num + 1}",
+                    daemon=True
+                )
+                threads.append(thread)
+                thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        merged = {}
+        for platform, (job, queries, per_term, work) in results.items():
+            if not work.empty():
+                logger.warning(f"{platform}: {work.qsize()} search terms were not scraped (all workers failed)")
+            if job.planner is not None:
+                merged[platform] = job.planner.fan_out(per_term)
+                logger.info(f"{platform}: scheduler collected {len(merged[platform])} listings for {len(search_terms)} terms from {len(per_term)} searches")
+                continue
+            merged[platform] = []
+            for term in queries:
+                merged[platform].extend(per_term.get(term, []))
+            logger.info(f"{platform}: scheduler collected {len(merged[platform])} listings from {len(per_term)} terms")
+        return merged
+
+    def _profiled_worker(self, *args):
+        # cProfile only sees the thread it is enabled in, so each worker profiles itself
+        with cycle_profiler.thread_profile():
+            self._worker(*args)
+
+    def _worker(self, job, worker_num, work, per_term, browser_slots, search_kwargs):
+        """Pull terms off the platform queue until it is empty
+
+        Requests are paced per site by the shared rate limiter inside the
+        scrapers, so workers start each term as soon as they are free.
+        """
+        label = f"{job.platform} worker {worker_num}"
+        if job.uses_browser:
+            browser_slots.acquire()
+        scraper = None
+        try:
+            try:
+                with cycle_profiler.span(f"{job.platform}.start_scraper"):
+                    scraper = job.pool.acquire(job.platform) if job.pool is not None else job.factory()
+            except Exception as e:
+                logger.error(f"{label}: failed to start scraper: {e}")
+                return
+            if getattr(scraper, 'driver', True) is None:
+                logger.error(f"{label}: driver unavailable, leaving terms to other workers")
+                return
+
+            terms_done = 0
+            while True:
+                terms = []
+                while job.chunk_size == 0 or len(terms) < job.chunk_size:
+                    try:
+                        terms.append(work.get_nowait())
+                    except queue.Empty:
+                        break
+                if not terms:
+                    break
+
+                rss_before = memory_watchdog.sample_mb(scraper) if job.uses_browser else None
+                started = time.monotonic()
+                try:
+                    with cycle_profiler.span(f"{job.platform}.search"):
+                        found = scraper.search_listings(terms, term_delay=0, **search_kwargs)
+                except Exception as e:
+                    logger.error(f"{label}: error searching for {terms}: {e}")
+                    metrics.search_failures.inc(platform=job.platform)
+                    if search_kwargs.get('watermarks') is not None:
+                        search_kwargs['watermarks'].fail(job.platform, terms)
+                    found = []
+                if len(terms) == 1:
+                    # Batched jobs (the Depop API client) time their terms themselves
+                    metrics.search_seconds.observe(time.monotonic() - started, platform=job.platform, term=terms[0])
+                for term in terms:
+                    per_term[term] = [listing for listing in found if listing['search_term'] == term]
+                terms_done += len(terms)
+
+                if not circuit_breakers.allow(job.platform):
+                    skipped = self._drain(work)
+                    if skipped:
+                        logger.warning(f"{label}: {job.platform} paused after repeated challenge pages - skipping {skipped} remaining terms")
+                    break
+                if not job.uses_browser:
+                    continue
+                rss_after = memory_watchdog.sample_mb(scraper)
+                for term in terms:
+                    memory_watchdog.record_term(job.platform, term, rss_before, rss_after)
+                if work.empty():
+                    break
+
+                if rss_after is not None:
+                    if rss_after > memory_watchdog.limit_mb:
+                        logger.info(f"{label}: browser at {rss_after:.0f} MB exceeds {memory_watchdog.limit_mb:.0f} MB limit - recycling")
+                        self._recycle_browser(job, scraper)
+                elif job.recycle_every and terms_done % job.recycle_every == 0:
+                    # RSS unavailable on this host - fall back to a fixed fresh-tab interval
+                    self._recycle_tab(job, scraper)
+                if scraper.driver is None:
+                    logger.error(f"{label}: browser lost while recycling, leaving remaining terms to other workers")
+                    break
+        finally:
+            if scraper is not None:
+                try:
+                    if job.pool is not None:
+                        job.pool.release(job.platform, scraper)
+                    else:
+                        scraper.close()
+                except Exception as e:
+                    logger.error(f"{label}: error closing scraper: {e}")
+            if job.uses_browser:
+                browser_slots.release()
+
+    def _drain(self, work):
+        """Empty a platform's queue, returning how many terms were dropped"""
+        dropped = 0
+        while True:
+            try:
+                work.get_nowait()
+            except queue.Empty:
+                return dropped
+            dropped += 1
+
+    def _recycle_tab(self, job, scraper):
+        if job.pool is not None:
+            job.pool.recycle(scraper)
+        else:
+            scraper._recycle_tab()
+
+    @cycle_profiler.timed('selenium.recycle')
+    def _recycle_browser(self, job, scraper):
+        """A fresh tab first; restart Chrome only if the process tree is still over the limit"""
+        memory_watchdog.record_recycle()
+        self._recycle_tab(job, scraper)
+        if scraper.driver is None or not memory_watchdog.over_limit(scraper):
+            return
+        logger.info(f"{job.platform}: still over the memory limit after a fresh tab - restarting browser")
+        if job.pool is not None:
+            job.pool.restart(scraper)
+        else:
+            scraper.close()
+            scraper.setup_driver()
+            metrics.driver_restarts.inc(platform=job.platform)
@@ -0,0 +1,149 @@
+# Seen-listing filter
+# In-memory Bloom filter over every (platform, listing_id) in champion_listings.db,
+# snapshotted to disk, so repeat listings are recognised without an SQLite lookup
+
+import os
+import math
+import struct
+import logging
+
+from retention import retired_key
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'RWBLOOM1'
+# magic, bits, capacity, hash count, then the database state the bits were built from
+SNAPSHOT_HEADER = struct.Struct('<8sQQIQQ')
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over 64-bit keys
+
+    ``capacity`` keys fit at ``error_rate`` false positives; the k bit
+    positions come from the two halves of the key (Kirsch-Mitzenmacher).
+    """
+
+    def __init__(self, capacity, error_rate, bits=None, hashes=None, data=None):
+        self.capacity = max(1, int(capacity))
+        self.bits = bits or max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = hashes or max(1, round(self.bits / self.capacity * math.log(2)))
+        self.data = data if data is not None else bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        key &= 0xFFFFFFFFFFFFFFFF
+        h1, h2 = key & 0xFFFFFFFF, (key >> 32) | 1
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in range(self.hashes)]
+
+    def add(self, key):
+        data = self.data
+        for pos in self._positions(key):
+            data[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        data = self.data
+        for pos in self._positions(key):
+            if not data[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class SeenFilter:
+    """Bloom filter front cache for the seen-listing lookups
+
+    A miss means this process has not recorded the listing, so it skips the
+    SQLite lookup; a hit is only probably seen (a new listing also hits with
+    probability ``error_rate``) and is confirmed in the database before the
+    listing is dropped. Retired listings are covered via their retention hashes. The snapshot records the database state it was
+    built from and is rebuilt from the tables whenever that no longer matches;
+    it is only written while every listing row has passed through this filter.
+    """
+
+    def __init__(self, conn, lock, path=None, error_rate=None, min_capacity=None):
+        self.conn = conn
+        self.lock = lock
+        self.path = path or os.getenv('SEEN_FILTER_PATH', 'champion_listings.bloom')
+        self.error_rate = float(error_rate if error_rate is not None else os.getenv('SEEN_FILTER_ERROR_RATE', '1e-6'))
+        self.min_capacity = int(min_capacity if min_capacity is not None else os.getenv('SEEN_FILTER_MIN_CAPACITY', '200000'))
+        self.bloom = None
+        self.expected_total = 0  # Listings + retired listings the filter has seen
+        self.load()
+
+    def _db_state(self):
+        """(highest rowid ever assigned, listings + retired listings)
+
+        Retention moves rows between the two tables without changing the total,
+        and the AUTOINCREMENT sequence never goes back, so both only change when
+        listings are added.
+        """
+        with self.lock:
+            seq = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'seen_listings'").fetchone()
+            listings = self.conn.execute('SELECT COUNT(*) FROM seen_listings').fetchone()[0]
+            retired = self.conn.execute('SELECT COUNT(*) FROM retired_listings').fetchone()[0]
+        return (seq[0] if seq else 0), listings + retired
+
+    def load(self):
+        """Use the on-disk snapshot if it matches the database, otherwise rebuild"""
+        state = self._db_state()
+        try:
+            with open(self.path, 'rb') as f:
+                header = f.read(SNAPSHOT_HEADER.size)
+                magic, bits, capacity, hashes, *snapshot_state = SNAPSHOT_HEADER.unpack(header)
+                if magic == SNAPSHOT_MAGIC and tuple(snapshot_state) == state and capacity >= state[1]:
+                    data = bytearray(f.read())
+                    if len(data) == (bits + 7) // 8:
+                        self.bloom = BloomFilter(capacity, self.error_rate, bits, hashes, data)
+                        self.bloom.count = self.expected_total = state[1]
+                        logger.info(f"Seen filter: loaded snapshot covering {self.bloom.count} listings")
+                        return
+        except (OSError, struct.error):
+            pass
+        self.rebuild(state)
+
+    def rebuild(self, state=None):
+        with self.lock:
+            state = state or self._db_state()
+            total = state[1]
+            bloom = BloomFilter(max(self.min_capacity, total * 2), self.error_rate)
+            for platform, listing_id in self.conn.execute('SELECT platform, listing_id FROM seen_listings'):
+                bloom.add(retired_key(platform, listing_id))
+            for (key,) in self.conn.execute('SELECT key FROM retired_listings'):
+                bloom.add(key)
+        self.bloom = bloom
+        self.expected_total = total
+        logger.info(f"Seen filter: built from {total} listings ({bloom.bits // 8 // 1024} KB, {bloom.hashes} hashes)")
+        self.save(state)
+
+    def save(self, state=None):
+        """Write the snapshot atomically, tagged with the database state it covers"""
+        state = state or self._db_state()
+        if state[1] != self.expected_total:
+            # Another writer added listings this filter never saw; let the next start rebuild
+            logger.info("Seen filter: database changed outside this process, not saving snapshot")
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.bloom.bits, self.bloom.capacity, self.bloom.hashes, *state))
+                f.write(self.bloom.data)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Seen filter: could not write snapshot {self.path}: {e}")
+
+    def __contains__(self, listing_key):
+        """listing_key is (platform, listing_id)"""
+        return retired_key(*listing_key) in self.bloom
+
+    def add(self, listing_keys):
+        """Record committed (platform, listing_id) pairs, growing the filter once it is full"""
+        for listing_key in listing_keys:
+            self.bloom.add(retired_key(*listing_key))
+            self.expected_total += 1
+        if self.bloom.count > self.bloom.capacity:
+            self.rebuild()
@@ -0,0 +1,263 @@
+# Sharded workers
+# Spreads each cycle's search terms over worker processes with a consistent-hash
+# ring; every worker runs its own scrapers and browsers and records into the one
+# champion_listings.db, whose seen-listing transactions deduplicate across workers
+
+import os
+import time
+import queue
+import bisect
+import hashlib
+import logging
+import itertools
+import multiprocessing
+
+from scrape_scheduler import browser_budget
+from cycle_profiler import cycle_profiler
+from memory_watchdog import merge_summaries
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class HashRing:
+    """Consistent-hash ring assigning search terms to workers
+
+    Each worker owns ``replicas`` points on the ring and a term goes to the
+    first point at or after its hash, so adding or removing one of N workers
+    moves only about 1/N of the terms and the rest keep their worker.
+    """
+
+    def __init__(self, nodes=(), replicas=None):
+        self.replicas = max(1, int(replicas if replicas is not None else os.getenv('SHARD_REPLICAS', '128')))
+        self._points = []  # Sorted (hash, node)
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+    @property
+    def nodes(self):
+        return sorted({node for _, node in self._points})
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        for i in range(self.replicas):
+            bisect.insort(self._points, (self._hash(f"{node}#{i}"), node))
+
+    def remove(self, node):
+        self._points = [point for point in self._points if point[1] != node]
+
+    def node_for(self, term):
+        if not self._points:
+            raise LookupError("No workers on the hash ring")
+        index = bisect.bisect_left(self._points, (self._hash(term),))
+        return self._points[index % len(self._points)][1]
+
+    def partition(self, terms, keys=None):
+        """{node: [terms]}, each list in the order the terms were given
+
+        ``keys`` maps a term to the ring key it is placed by (default: itself),
+        so terms sharing a key always land on the same node.
+        """
+        keys = keys or {}
+        shards = {}
+        for term in terms:
+            shards.setdefault(self.node_for(keys.get(term, term)), []).append(term)
+        return shards
+
+
+def _worker_main(name, tasks, results, max_browsers, log_disable):
+    """Worker process: a scrape-and-record bot serving (task_id, terms, seed) tasks until it gets None
+
+    Each task's result goes back with its telemetry - span timings, metric
+    deltas and the browser memory summary - for the coordinator to merge.
+    """
+    # The worker's own bot must not shard again, and gets its slice of the browser budget
+    os.environ['SHARD_WORKERS'] = '1'
+    os.environ['MAX_BROWSERS'] = str(max_browsers)
+    from main import VintageClothingMonitorBot
+    logging.disable(log_disable)  # Same logging.disable() level as the coordinator
+
+    bot = VintageClothingMonitorBot()
+    logger.info(f"{name}: ready (pid {os.getpid()}, up to {max_browsers} browser(s))")
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            task_id, terms, seed = task
+            cycle_profiler.reset()
+            before = metrics.snapshot()
+            bot.last_memory_report = {}
+            try:
+                if seed:
+                    bot.seed_database_with_current_listings(terms)
+                    result = ({}, 0, [])
+                else:
+                    checked, new_listings = bot.scrape_and_record(terms)
+                    result = (checked, len(new_listings), bot.last_covered_terms)
+            except Exception as e:
+                logger.error(f"{name}: scraping {len(terms)} terms failed: {e}")
+                result = None
+            report = cycle_profiler.finish_cycle(label=name, extra={'terms': len(terms)})
+            telemetry = {
+                'wall_s': report['wall_s'] if report else None,
+                'spans': report['spans'] if report else [],
+                'metrics': metrics.delta_since(before),
+                'memory': bot.last_memory_report,
+            }
+            results.put((task_id, name, result, telemetry))
+    finally:
+        bot.close()
+
+
+class ShardCoordinator:
+    """Runs each cycle's search terms on long-lived worker processes
+
+    Terms are assigned with a HashRing, so a term keeps its worker (and that
+    worker's warm browsers and sessions) from cycle to cycle. Each worker is a
+    separate VintageClothingMonitorBot that scrapes its terms and records them
+    in champion_listings.db; a listing is only new to the worker whose INSERT OR
+    IGNORE adds its row, so a listing found by two workers is new to exactly
+    one of them. Emails, retention and checkpoints stay with the
+    coordinating bot, which also merges the workers' metrics, span timings
+    and browser memory summaries into its own. A worker that dies has its
+    outstanding terms moved to the others and is restarted after the cycle.
+
+    Terms one of ``planners`` (QueryPlanner) merges into a shared search are
+    placed on the ring as a unit, so each worker's own planner can still
+    merge them; a large group therefore makes its worker's shard larger.
+    """
+
+    def __init__(self, workers, max_browsers=None, planners=()):
+        self.names = [f"shard-{i + 1}" for i in range(max(1, int(workers)))]
+        # The host's browser budget is split between the workers
+        self.max_browsers = max(1, (max_browsers or browser_budget()) // len(self.names))
+        self.ring = HashRing(self.names)
+        self._context = multiprocessing.get_context('spawn')  # No forked SQLite connections or threads
+        self._results = None
+        self._processes = {}  # name -> (process, task queue)
+        self._task_ids = itertools.count(1)
+        self.keys = self._group_keys(planners)
+        self.memory_report = {}  # The last cycle's merged browser memory summary
+        self.covered_terms = set()  # Terms the last cycle's workers searched, with their planners' pins
+        # One set of request buckets for every worker, so N workers don't send N times the configured rate
+        os.environ.setdefault('RATE_LIMIT_STATE_PATH', 'rate_limits.db')
+
+    @staticmethod
+    def _group_keys(planners):
+        """{term: ring key}; terms any planner searches together share one key"""
+        parent = {}
+
+        def root(term):
+            while parent.setdefault(term, term) != term:
+                term = parent[term]
+            return term
+
+        for planner in planners:
+            for group in planner.groups:
+                roots = {root(term) for term in group.members}
+                first = min(roots)
+                for other in roots:
+                    parent[other] = first
+        return {term: root(term) for term in parent}
+
+    def start(self):
+        if self._results is None:
+            self._results = self._context.Queue()
+        for name in self.names:
+            process = self._processes.get(name, (None, None))[0]
+            if process is None or not process.is_alive():
+                if process is not None:
+                    logger.warning(f"{name} exited (code {process.exitcode}) - restarting it")
+                self._start_worker(name)
+            self.ring.add(name)
+        return self
+
+    def _start_worker(self, name):
+        tasks = self._context.Queue()
+        process = self._context.Process(
+            target=_worker_main, args=(name, tasks, self._results, self.max_browsers, logging.root.manager.disable),
+            name=name, daemon=True
+        )
+        process.start()
+        self._processes[name] = (process, tasks)
+
+    def run(self, terms, seed=False):
+        """Scrape terms on the workers; returns ({platform: listings checked}, new listings recorded)
+
+        With seed, the workers mark what they find seen without queueing emails.
+        """
+        self.start()
+        started = time.monotonic()
+        outstanding = {}  # task_id -> (worker, terms)
+        for name, shard in self.ring.partition(terms, self.keys).items():
+            self._dispatch(name, shard, seed, outstanding)
+
+        checked, new_count, slowest, memory = {}, 0, 0.0, []
+        self.covered_terms = set()
+        while outstanding:
+            try:
+                task_id, name, result, telemetry = self._results.get(timeout=5)
+            except queue.Empty:
+                self._reassign_dead(outstanding, seed)
+                continue
+            _, shard = outstanding.pop(task_id)
+            slowest = max(slowest, telemetry['wall_s'] or 0.0)
+            metrics.merge(telemetry['metrics'])
+            cycle_profiler.merge(telemetry['spans'])
+            memory.append(telemetry['memory'])
+            if result is None:
+                logger.warning(f"{name}: {len(shard)} terms were not scraped this cycle")
+                continue
+            for platform, count in result[0].items():
+                checked[platform] = checked.get(platform, 0) + count
+            new_count += result[1]
+            self.covered_terms.update(result[2])
+        self.memory_report = merge_summaries(memory)
+
+        logger.info(
+            f"Shards: {len(terms)} terms on {len(self.ring.nodes)} workers in {time.monotonic() - started:.1f}s "
+            f"(slowest worker {slowest:.1f}s)"
+        )
+        return checked, new_count
+
+    def _dispatch(self, name, terms, seed, outstanding):
+        task_id = next(self._task_ids)
+        outstanding[task_id] = (name, terms)
+        self._processes[name][1].put((task_id, terms, seed))
+
+    def _reassign_dead(self, outstanding, seed):
+        """Move the terms of workers that died mid-cycle onto the surviving workers"""
+        for name in {worker for worker, _ in outstanding.values()}:
+            process = self._processes[name][0]
+            if process.is_alive():
+                continue
+            orphaned = []
+            for task_id, (worker, terms) in list(outstanding.items()):
+                if worker == name:
+                    orphaned.extend(terms)
+                    del outstanding[task_id]
+            self.ring.remove(name)
+            if not self.ring.nodes:
+                logger.error(f"{name} exited (code {process.exitcode}) and no workers are left - {len(orphaned)} terms not scraped")
+                continue
+            logger.error(f"{name} exited (code {process.exitcode}) - moving its {len(orphaned)} terms to the other workers")
+            for other, shard in self.ring.partition(orphaned, self.keys).items():
+                self._dispatch(other, shard, seed, outstanding)
+
+    def stop(self, timeout=60):
+        """Let every worker finish its task and close its browsers, then reap it"""
+        for process, tasks in self._processes.values():
+            if process.is_alive():
+                tasks.put(None)
+        for name, (process, _) in self._processes.items():
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"{name} did not stop within {timeout}s - terminating it")
+                process.terminate()
+        self._processes = {}
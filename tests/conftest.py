@@ -0,0 +1,36 @@
+# Test configuration
+# The bot's modules live at the repository root
+
+import os
+import sys
+import sqlite3
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def db(tmp_path):
+    """(connection, lock) on a fresh champion_listings.db at the latest schema"""
+    import db_schema
+    conn = sqlite3.connect(str(tmp_path / 'champion_listings.db'), isolation_level=None, check_same_thread=False)
+    db_schema.migrate(conn)
+    yield conn, threading.RLock()
+    conn.close()
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    """A VintageClothingMonitorBot with its database, logs and snapshots in tmp_path"""
+    from circuit_breaker import circuit_breakers
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('INLINE_IMAGES', 'off')
+    monkeypatch.setenv('SHARD_WORKERS', '1')
+    # The bot attaches the shared breakers to its database; detach them again afterwards
+    monkeypatch.setattr(circuit_breakers, 'conn', circuit_breakers.conn)
+    from main import VintageClothingMonitorBot
+    bot = VintageClothingMonitorBot()
+    yield bot
+    bot.close()
@@ -0,0 +1,54 @@
+# Browser pool tests
+
+import time
+import threading
+
+from browser_pool import BrowserPool
+
+
+class _FakeDriver:
+    def execute_script(self, script):
+        return 1
+
+
+class _FakeScraper:
+    live = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def __init__(self, platform):
+        self.platform = platform
+        self.driver = _FakeDriver()
+        with self.lock:
+            _FakeScraper.live += 1
+            _FakeScraper.peak = max(_FakeScraper.peak, _FakeScraper.live)
+
+    def close(self):
+        if self.driver is not None:
+            self.driver = None
+            with self.lock:
+                _FakeScraper.live -= 1
+
+
+def test_leases_never_exceed_the_budget():
+    pool = BrowserPool(max_browsers=2, factory=_FakeScraper)
+    pool.recycle = lambda scraper: None
+
+    def search(platform):
+        with pool.lease(platform):
+            time.sleep(0.02)
+
+    threads = [threading.Thread(target=search, args=(('eBay', 'Depop')[i % 2],)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert _FakeScraper.peak <= 2
+    assert pool._total() <= 2
+    pool.max_browsers = 1
+    with pool.lease('eBay'):
+        pass
+    assert pool._total() == 1
+    pool.shutdown()
+    assert _FakeScraper.live == 0
@@ -0,0 +1,55 @@
+# Challenge circuit breaker tests
+
+import time
+import sqlite3
+import threading
+
+import db_schema
+from circuit_breaker import CircuitBreakers, OPEN, HALF_OPEN, CLOSED
+
+
+def _attached(path, **kwargs):
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    db_schema.migrate(conn)
+    breakers = CircuitBreakers(threshold=3, pause=0.05, max_pause=1, **kwargs)
+    breakers.attach(conn, threading.RLock())
+    return breakers
+
+
+def _challenge(breakers, times):
+    tripped = False
+    for _ in range(times):
+        assert breakers.allow('eBay')
+        tripped = breakers.record_challenge('eBay', 'captcha') or tripped
+    return tripped
+
+
+def test_trips_again_after_closing(tmp_path):
+    breakers = _attached(str(tmp_path / 'listings.db'))
+
+    assert _challenge(breakers, 3)
+    assert not breakers.allow('eBay')
+    time.sleep(0.06)
+    assert breakers.allow('eBay')
+    assert breakers._get('eBay').state == HALF_OPEN
+    breakers.record_success('eBay')
+    assert breakers._get('eBay').state == CLOSED
+
+    assert not _challenge(breakers, 2)
+    assert _challenge(breakers, 1)
+    assert breakers._get('eBay').state == OPEN
+    assert not breakers.allow('eBay')
+    events = [row[0] for row in breakers.conn.execute('SELECT event FROM challenge_events ORDER BY id')]
+    assert events == ['trip', 'resume', 'close', 'trip']
+
+
+def test_pause_is_shared_through_the_database(tmp_path):
+    path = str(tmp_path / 'listings.db')
+    first, second = _attached(path), _attached(path)
+
+    assert _challenge(first, 3)
+    assert not second.allow('eBay')
+    time.sleep(0.06)
+    assert second.allow('eBay')
+    assert first.allow('eBay')
+    assert first.generation('eBay') == second.generation('eBay') == 1
@@ -0,0 +1,97 @@
+# Notification outbox tests
+
+import pytest
+
+import main
+from outbox import Outbox
+
+
+def _listing(listing_id, platform='eBay'):
+    return {
+        'listing_id': listing_id,
+        'platform': platform,
+        'title': 'Vintage Champion Reverse Weave Hoodie',
+        'price': '$45.00',
+        'url': f"https://www.ebay.com/itm/{listing_id}",
+        'image_url': '',
+        'search_term': 'champion reverse weave',
+    }
+
+
+class _Delivery:
+    """Stand-in for EmailDelivery answering send_all with scripted results"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.sent = []
+
+    def send_all(self, messages):
+        self.sent.append(messages)
+        ok = self.results.pop(0)
+        return [ok] * len(messages)
+
+
+def _compose(listings, part, total):
+    return f"{len(listings)} listings", '<html></html>', '', []
+
+
+def _count(conn, table):
+    return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def test_new_listings_are_queued_with_their_seen_rows(bot):
+    bot.record_new_listings([_listing('600000000001'), _listing('600000000002')])
+
+    assert _count(bot.conn, 'seen_listings') == 2
+    assert sorted(row[0] for row in bot.conn.execute('SELECT listing_id FROM notification_outbox')) == [
+        '600000000001', '600000000002'
+    ]
+
+
+def test_a_failed_enqueue_leaves_the_listing_unseen(bot, monkeypatch):
+    queue = Outbox.enqueue
+
+    def enqueue(cursor, listings):
+        queue(cursor, listings)
+        raise RuntimeError('disk full')
+
+    monkeypatch.setattr(main.Outbox, 'enqueue', staticmethod(enqueue))
+    with pytest.raises(RuntimeError):
+        bot.record_new_listings([_listing('600000000003')])
+
+    assert _count(bot.conn, 'seen_listings') == 0
+    assert _count(bot.conn, 'notification_outbox') == 0
+    assert not bot.is_listing_seen('eBay', '600000000003')
+
+
+def test_a_failed_send_is_redelivered_under_the_same_key(db):
+    conn, lock = db
+    outbox = Outbox(conn, lock, retry_base_seconds=0)
+    conn.execute('BEGIN IMMEDIATE')
+    Outbox.enqueue(conn.cursor(), [_listing('600000000004'), _listing('seller-champion-hoodie', 'Depop')])
+    conn.execute('COMMIT')
+
+    delivery = _Delivery(False, True)
+    assert outbox.drain(delivery, _compose) == 0
+    assert outbox.pending_count() == 2
+    assert outbox.drain(delivery, _compose) == 2
+    assert outbox.pending_count() == 0
+
+    first, retry = delivery.sent
+    assert len(first) == len(retry) == 1
+    assert first[0] == retry[0]  # Same email and batch key, so the provider can drop a duplicate
+    assert conn.execute('SELECT status, attempts FROM outbox_batches').fetchall() == [('sent', 2)]
+
+    # Nothing is sent twice once the batch went through
+    assert outbox.drain(_Delivery(), _compose) == 0
+
+
+def test_a_listing_is_queued_once(db):
+    conn, lock = db
+    outbox = Outbox(conn, lock)
+    for _ in range(2):
+        conn.execute('BEGIN IMMEDIATE')
+        Outbox.enqueue(conn.cursor(), [_listing('600000000005')])
+        conn.execute('COMMIT')
+
+    assert outbox.pending_count() == 1
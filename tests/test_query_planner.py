@@ -0,0 +1,76 @@
+# Query planner coverage audit tests
+
+from query_planner import QueryPlanner
+
+COLORS = (
+    'red blue green black white grey navy maroon orange yellow purple '
+    'pink brown olive teal cream tan gold silver forest royal'
+).split()
+TERMS = [f"champion reverse weave {color}" for color in COLORS]
+PAGE = 60
+
+
+def _timeline(count=3000):
+    """Listings newest first; listing n comes in colour n % 21"""
+    return [
+        {
+            'listing_id': str(400000000000 + n),
+            'platform': 'eBay',
+            'title': f"Vintage Champion Reverse Weave Hoodie {COLORS[n % len(COLORS)].title()}",
+            'url': f"https://www.ebay.com/itm/{400000000000 + n}",
+            'search_term': '',
+        }
+        for n in range(count - 1, -1, -1)
+    ]
+
+
+def _audit(planner, dropped=()):
+    """One audit cycle where each search returns its newest PAGE matching listings"""
+    queries = planner.begin_cycle(audit=True)
+    timeline = _timeline()
+    per_query = {}
+    for query in queries:
+        if query in TERMS:
+            color = query.rsplit(' ', 1)[1].title()
+            found = [listing for listing in timeline if listing['title'].endswith(color)]
+        else:
+            found = [listing for listing in timeline if listing['listing_id'] not in dropped]
+        per_query[query] = [dict(listing, search_term=query) for listing in found[:PAGE]]
+    return planner.fan_out(per_query)
+
+
+def test_older_direct_results_do_not_count_against_the_group():
+    planner = QueryPlanner(TERMS, platform='eBay', min_coverage=0.95)
+    assert [group.query for group in planner.groups] == ['champion reverse weave']
+
+    listings = _audit(planner)
+
+    result = planner.last_report['groups']['champion reverse weave']
+    assert result['coverage'] == 1.0
+    assert result['missed'] == {}
+    assert not planner.pinned
+    assert len(planner.groups) == 1
+    # The audit still reports every direct result, older ones included
+    assert len(listings) == len(TERMS) * PAGE
+
+
+def test_in_window_misses_pin_the_member():
+    planner = QueryPlanner(TERMS, platform='eBay', min_coverage=0.99)
+    # The broad search skips the two newest red listings but returns an older one
+    newest_red = [listing['listing_id'] for listing in _timeline() if listing['title'].endswith('Red')][:2]
+
+    _audit(planner, dropped=set(newest_red))
+
+    result = planner.last_report['groups']['champion reverse weave']
+    assert result['missed'] == {'champion reverse weave red': 2}
+    assert result['coverage'] < 0.99
+    assert planner.pinned == {'champion reverse weave red'}
+
+
+def test_a_due_member_covers_its_whole_group():
+    terms = TERMS[:3] + ['champion sweatshirt usa']
+    planner = QueryPlanner(terms, platform='eBay')
+
+    assert planner.covered_terms([TERMS[1]]) == TERMS[:3]
+    assert planner.begin_cycle(audit=False, terms=[TERMS[1]]) == ['champion reverse weave']
+    assert planner.covered_terms(['champion sweatshirt usa']) == ['champion sweatshirt usa']
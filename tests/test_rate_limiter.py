@@ -0,0 +1,58 @@
+# Rate limiter tests
+
+import types
+
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter
+
+URL = 'https://www.ebay.com/sch/i.html'
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Frozen time.time() for the rate limiter; advance it with clock.now += seconds"""
+    fake = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(rate_limiter, 'time', types.SimpleNamespace(time=lambda: fake.now))
+    return fake
+
+
+def test_bursts_then_keeps_to_the_rate(clock):
+    limiter = RateLimiter(rates={'ebay': 2}, burst=3)
+
+    assert [limiter.reserve(URL) for _ in range(5)] == [0.0, 0.0, 0.0, 0.5, 1.0]
+
+    # Idle time earns the burst back, but no more than it
+    clock.now += 60
+    assert [limiter.reserve(URL) for _ in range(4)] == [0.0, 0.0, 0.0, 0.5]
+
+
+def test_subdomains_share_a_bucket_and_unlimited_domains_never_wait(clock):
+    limiter = RateLimiter(rates={'ebay': 1}, burst=1)
+
+    assert limiter.reserve('https://www.ebay.com/sch/i.html') == 0.0
+    assert limiter.reserve('https://ebay.com/itm/1') == 1.0
+    assert limiter.reserve('https://example.org/') == 0.0
+
+
+def test_a_block_slows_the_domain_until_it_recovers(clock):
+    limiter = RateLimiter(rates={'ebay': 2}, burst=3, recovery=0.5)
+    limiter.reserve(URL)
+
+    limiter.observe(URL, status=429)
+    # Slowed to 1 req/s with the burst credit gone
+    assert limiter.reserve(URL) == pytest.approx(1.0)
+    assert limiter.reserve(URL) == pytest.approx(2.0)
+
+    limiter.observe(URL, status=200)
+    clock.now += 60
+    assert [limiter.reserve(URL) for _ in range(4)] == [0.0, 0.0, 0.0, 0.5]
+
+
+def test_processes_share_the_schedule_through_the_state_file(clock, tmp_path):
+    path = str(tmp_path / 'rate_limits.db')
+    first = RateLimiter(rates={'ebay': 2}, burst=2, state_path=path)
+    second = RateLimiter(rates={'ebay': 2}, burst=2, state_path=path)
+
+    assert [first.reserve(URL), second.reserve(URL), first.reserve(URL), second.reserve(URL)] == [0.0, 0.0, 0.5, 1.0]
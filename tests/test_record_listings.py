@@ -0,0 +1,59 @@
+# Batched seen-listing dedup tests
+
+import threading
+
+from main import VintageClothingMonitorBot
+
+
+def _listing(listing_id, search_term='navy champion reverse weave'):
+    return {
+        'listing_id': listing_id,
+        'platform': 'eBay',
+        'title': 'Vintage Yale Champion Reverse Weave Navy Hoodie',
+        'price': '$45.00',
+        'url': f"https://www.ebay.com/itm/{listing_id}",
+        'image_url': '',
+        'search_term': search_term,
+    }
+
+
+def test_a_listing_found_by_two_terms_is_new_once(bot):
+    batch = [
+        _listing('700000000001', 'navy champion reverse weave'),
+        _listing('700000000001', 'yale champion reverse weave'),
+    ]
+
+    new = bot.record_new_listings(batch)
+
+    assert [listing['search_term'] for listing in new] == ['navy champion reverse weave']
+    terms = {row[0] for row in bot.conn.execute('SELECT search_term FROM listing_terms')}
+    assert {'navy champion reverse weave', 'yale champion reverse weave'} <= terms
+    assert bot.conn.execute('SELECT COUNT(*) FROM notification_outbox').fetchone()[0] == 1
+    assert bot.record_new_listings(batch) == []
+
+
+def test_workers_sharing_the_database_record_each_listing_once(bot):
+    other = VintageClothingMonitorBot()  # A second worker process's bot on the same champion_listings.db
+    try:
+        ids = [str(700000001000 + i) for i in range(300)]
+        batches = {bot: ids[:200], other: ids[100:]}
+        new = {bot: [], other: []}
+        start = threading.Barrier(2)
+
+        def record(worker):
+            start.wait()
+            for offset in range(0, 200, 20):
+                batch = [_listing(listing_id) for listing_id in batches[worker][offset:offset + 20]]
+                new[worker].extend(listing['listing_id'] for listing in worker.record_new_listings(batch))
+
+        threads = [threading.Thread(target=record, args=(worker,)) for worker in (bot, other)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(new[bot] + new[other]) == ids
+        assert bot.conn.execute('SELECT COUNT(*) FROM seen_listings').fetchone()[0] == 300
+        assert bot.conn.execute('SELECT COUNT(*) FROM notification_outbox').fetchone()[0] == 300
+    finally:
+        other.close()
@@ -0,0 +1,42 @@
+# Seen-listing filter tests
+
+from metrics import metrics
+
+
+def _listing(listing_id):
+    return {
+        'listing_id': listing_id,
+        'platform': 'eBay',
+        'title': 'Vintage Champion Reverse Weave Hoodie',
+        'price': '$45.00',
+        'url': f"https://www.ebay.com/itm/{listing_id}",
+        'image_url': '',
+        'search_term': 'champion reverse weave',
+    }
+
+
+def _saturate(seen_filter):
+    """Set every bit, so the filter reports every listing as probably seen"""
+    seen_filter.bloom.data[:] = b'\xff' * len(seen_filter.bloom.data)
+
+
+def test_a_false_positive_is_still_new(bot):
+    bot.record_new_listings([_listing('500000000001')])
+    _saturate(bot.seen_filter)
+    before = metrics.seen_filter_false_positives.snapshot().get((), 0)
+
+    new = bot.record_new_listings([_listing('500000000001'), _listing('500000000002')])
+
+    assert [listing['listing_id'] for listing in new] == ['500000000002']
+    assert metrics.seen_filter_false_positives.snapshot()[()] == before + 1
+    assert not bot.is_listing_seen('eBay', '500000000003')
+    assert bot.is_listing_seen('eBay', '500000000002')
+
+
+def test_a_miss_is_recorded_once(bot):
+    assert len(bot.record_new_listings([_listing('500000000004')])) == 1
+    # A row the filter never saw, as another shard worker would have written it
+    bot.seen_filter.rebuild()
+    bot.conn.execute(bot.INSERT_LISTING_SQL, bot._listing_row(_listing('500000000005')))
+
+    assert bot.record_new_listings([_listing('500000000004'), _listing('500000000005')]) == []
@@ -0,0 +1,135 @@
+# Search watermark tests
+
+import sqlite3
+
+import pytest
+
+import db_schema
+import depop_scraper
+import ebay_scraper
+from circuit_breaker import circuit_breakers
+from depop_scraper import DepopScraper, DepopApiError
+from ebay_scraper import EbayScraper, ChallengePageError
+from watermarks import WatermarkStore
+
+TERM = 'champion reverse weave'
+
+
+class _BrokenPool:
+    def lease(self, platform):
+        raise RuntimeError('no browser available')
+
+
+@pytest.fixture(autouse=True)
+def no_fallback(monkeypatch):
+    monkeypatch.setattr(depop_scraper, 'default_pool', _BrokenPool)
+    monkeypatch.setattr(ebay_scraper, 'default_pool', _BrokenPool)
+    monkeypatch.setattr(circuit_breakers, 'pause', 0)  # A failed fallback must not pause later tests
+
+
+def _products(start, count):
+    return [
+        {'id': i, 'slug': f"seller-champion-reverse-weave-{i}", 'title': f"Champion reverse weave {i}"}
+        for i in range(start, start + count)
+    ]
+
+
+def _depop_api(fail_page=None):
+    """Fake _fetch_json serving 24 products per page, raising on fail_page"""
+    async def fetch_json(session, params):
+        page = int(params.get('cursor', '0'))
+        if page == fail_page:
+            raise DepopApiError('status 500')
+        return {'products': _products(page * 24, 24), 'meta': {'cursor': str(page + 1), 'hasMore': True}}
+    return fetch_json
+
+
+def test_failed_depop_search_keeps_its_watermark(db):
+    store = WatermarkStore(*db)
+    scraper = DepopScraper()
+
+    # Page 2 fails and the Selenium fallback cannot lease a browser: nothing is returned
+    scraper._fetch_json = _depop_api(fail_page=1)
+    assert scraper.search_listings([TERM], max_pages=3, watermarks=store) == []
+    store.commit()
+    assert db[0].execute('SELECT COUNT(*) FROM search_watermarks').fetchone()[0] == 0
+
+    # So the next cycle still returns the listings of page 1
+    scraper._fetch_json = _depop_api()
+    listings = scraper.search_listings([TERM], max_pages=1, watermarks=store)
+    assert len(listings) == 24
+    store.commit()
+    assert db[0].execute('SELECT COUNT(*) FROM search_watermarks').fetchone()[0] == 24
+
+
+def test_challenged_ebay_search_keeps_its_watermark(db):
+    store = WatermarkStore(*db)
+    scraper = EbayScraper()
+
+    def get_page_listings(search_term, page, limit=None, watermark=None):
+        if page == 2:
+            raise ChallengePageError('captcha')
+        ids = [str(100000000000 + i) for i in range(scraper.page_size)]
+        for listing_id in ids:
+            watermark.observe(listing_id)
+        return [{'listing_id': listing_id, 'platform': 'eBay', 'search_term': search_term} for listing_id in ids], len(ids)
+
+    scraper._get_page_listings = get_page_listings
+    assert scraper.search_listings([TERM], max_pages=3, watermarks=store) == []
+    store.commit()
+    assert db[0].execute('SELECT COUNT(*) FROM search_watermarks').fetchone()[0] == 0
+
+
+def test_retry_replaces_the_failed_watermark(db):
+    store = WatermarkStore(*db)
+    failed = store.get('eBay', TERM)
+    failed.observe('a')
+    failed.fail()
+    retry = store.get('eBay', TERM)
+    retry.observe('b')
+    store.commit()
+    assert [row[0] for row in db[0].execute('SELECT listing_id FROM search_watermarks')] == ['b']
+
+
+def test_platforms_keep_separate_watermarks_for_one_query(db):
+    store = WatermarkStore(*db, keep=3)
+    ebay = store.get('eBay', TERM)
+    for listing_id in ('300000000003', '300000000002', '300000000001'):
+        ebay.observe(listing_id)
+    store.commit()
+
+    # A busier Depop search of the same query must not trim eBay's IDs away
+    depop = store.get('Depop', TERM)
+    for i in range(5):
+        assert not depop.observe(f"seller-champion-{i}")
+    store.commit()
+
+    assert store.get('eBay', TERM).known == {'300000000003', '300000000002', '300000000001'}
+    assert store.get('Depop', TERM).known == {'seller-champion-0', 'seller-champion-1', 'seller-champion-2'}
+    assert not store.get('Depop', TERM).observe('300000000003')
+
+
+def test_migration_assigns_existing_watermarks_a_platform(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'champion_listings.db'), isolation_level=None)
+    for target, description, migration in db_schema.MIGRATIONS[:6]:
+        migration(conn.cursor())
+    conn.execute('''
+        CREATE TABLE search_watermarks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            query TEXT NOT NULL,
+            listing_id TEXT NOT NULL,
+            seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (query, listing_id)
+        )
+    ''')
+    conn.executemany(
+        'INSERT INTO search_watermarks (query, listing_id) VALUES (?, ?)',
+        [(TERM, '300000000001'), (TERM, 'seller-champion-1')]
+    )
+    conn.execute('PRAGMA user_version = 6')
+
+    assert db_schema.migrate(conn) == db_schema.LATEST_VERSION
+    assert sorted(conn.execute('SELECT platform, listing_id FROM search_watermarks')) == [
+        ('Depop', 'seller-champion-1'), ('eBay', '300000000001')
+    ]
+    conn.close()
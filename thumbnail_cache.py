@@ -0,0 +1,171 @@
+# Thumbnail cache
+# Fetches listing images concurrently, shrinks them to email-sized thumbnails
+# with Pillow and keeps them in a content-addressed, size-bounded LRU cache on disk
+
+import io
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cycle_profiler import cycle_profiler
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Optional - without Pillow emails keep hotlinking the listing images
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+# Smaller source renditions are plenty for a thumbnail: eBay sizes images by
+# s-l<px>, Depop by P<n> (P4 = 210px)
+EBAY_SIZE_RE = re.compile(r'/s-l\d+\.(jpg|jpeg|png|webp)')
+DEPOP_SIZE_RE = re.compile(r'/P\d\.jpg')
+
+
+def source_url(image_url):
+    """The smallest rendition of a listing image that still covers a thumbnail"""
+    if 'ebayimg.com' in image_url:
+        return EBAY_SIZE_RE.sub(r'/s-l225.\1', image_url)
+    if 'depop.com' in image_url:
+        return DEPOP_SIZE_RE.sub('/P4.jpg', image_url)
+    return image_url
+
+
+class ThumbnailCache:
+    """URL -> thumbnail lookups backed by files named after their SHA-256
+
+    Identical images reached through different URLs share one file. An index
+    database in the cache directory maps URLs to digests and tracks last use;
+    once the files exceed ``max_bytes`` the least recently used ones are
+    evicted. URLs are fetched at most once while their thumbnail is cached.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None, size=None, workers=None):
+        self.cache_dir = cache_dir or os.getenv('THUMBNAIL_CACHE_DIR', 'thumbnail_cache')
+        self.max_bytes = int(max_bytes if max_bytes is not None else float(os.getenv('THUMBNAIL_CACHE_MB', '50')) * 1024 * 1024)
+        self.size = int(size if size is not None else os.getenv('THUMBNAIL_SIZE', '80'))
+        self.workers = int(workers if workers is not None else os.getenv('THUMBNAIL_WORKERS', '8'))
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self.cache_dir, 'index.db'), check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, digest TEXT NOT NULL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER NOT NULL, last_used REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS idx_blobs_last_used ON blobs (last_used)')
+
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=self.workers))
+        self.session.headers.update({'User-Agent': USER_AGENT})
+
+    @staticmethod
+    def available():
+        return Image is not None
+
+    def _path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.jpg")
+
+    def _cached_digest(self, url):
+        with self._lock:
+            row = self._db.execute('SELECT digest FROM urls WHERE url = ?', (url,)).fetchone()
+        if row and os.path.exists(self._path(row[0])):
+            return row[0]
+        return None
+
+    def _make_thumbnail(self, data):
+        with Image.open(io.BytesIO(data)) as image:
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            # Same framing as the email's object-fit: cover
+            thumb = ImageOps.fit(image, (self.size, self.size), Image.LANCZOS)
+        out = io.BytesIO()
+        thumb.save(out, 'JPEG', quality=80, optimize=True)
+        return out.getvalue()
+
+    def _fetch(self, url):
+        """Download and shrink one image, store it and return its digest (None on failure)"""
+        try:
+            response = self.session.get(source_url(url), timeout=10)
+            if response.status_code != 200 and source_url(url) != url:
+                response = self.session.get(url, timeout=10)
+            response.raise_for_status()
+            thumbnail = self._make_thumbnail(response.content)
+        except Exception as e:
+            logger.debug(f"Thumbnail fetch failed for {url}: {e}")
+            return None
+
+        digest = hashlib.sha256(thumbnail).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(thumbnail)
+            os.replace(tmp_path, path)
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO urls (url, digest) VALUES (?, ?)', (url, digest))
+            self._db.execute('INSERT OR IGNORE INTO blobs (digest, size, last_used) VALUES (?, ?, ?)', (digest, len(thumbnail), time.time()))
+        return digest
+
+    @cycle_profiler.timed('email.thumbnails')
+    def thumbnails(self, urls):
+        """{url: (digest, jpeg bytes)} for every URL whose thumbnail is cached or could be fetched"""
+        urls = list(dict.fromkeys(url for url in urls if url))
+        digests = {url: self._cached_digest(url) for url in urls}
+        missing = [url for url, digest in digests.items() if digest is None]
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='thumbnail') as executor:
+                digests.update(zip(missing, executor.map(self._fetch, missing)))
+            logger.info(f"Thumbnails: {len(urls) - len(missing)} cached, fetched {sum(1 for url in missing if digests[url])}/{len(missing)}")
+
+        result = {}
+        for url, digest in digests.items():
+            if digest is None:
+                continue
+            try:
+                with open(self._path(digest), 'rb') as f:
+                    result[url] = (digest, f.read())
+            except OSError:
+                continue
+
+        used = {digest for digest, _ in result.values()}
+        if used:
+            now = time.time()
+            with self._lock:
+                self._db.executemany('UPDATE blobs SET last_used = ? WHERE digest = ?', [(now, digest) for digest in used])
+        self.evict()
+        return result
+
+    def evict(self):
+        """Delete least recently used thumbnails until the cache fits max_bytes"""
+        with self._lock:
+            total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            evicted = []
+            for digest, size in self._db.execute('SELECT digest, size FROM blobs ORDER BY last_used').fetchall():
+                if total <= self.max_bytes:
+                    break
+                evicted.append(digest)
+                total -= size
+            self._db.executemany('DELETE FROM blobs WHERE digest = ?', [(digest,) for digest in evicted])
+            self._db.executemany('DELETE FROM urls WHERE digest = ?', [(digest,) for digest in evicted])
+        for digest in evicted:
+            try:
+                os.remove(self._path(digest))
+            except OSError:
+                pass
+        logger.info(f"Thumbnail cache: evicted {len(evicted)} images")
+
+    def close(self):
+        self.session.close()
+        with self._lock:
+            self._db.close()
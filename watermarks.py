@@ -0,0 +1,149 @@
+# Search watermarks
+# Remembers the newest listing IDs each search has returned, so newest-first
+# scrapers can stop extracting (and skip deeper pages) once they reach known listings
+
+import os
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Watermark:
+    """Known listing IDs of one search, consulted card by card in newest-first order
+
+    Extraction stops after ``stop_after`` consecutive known IDs rather than the
+    first one, so a promoted card pinned above the new listings does not end
+    the scan early.
+    """
+
+    def __init__(self, platform, query, known, stop_after):
+        self.platform = platform
+        self.query = query
+        self.known = known
+        self.stop_after = stop_after
+        self.observed = []  # Every card ID seen this cycle, newest first
+        self._observed_ids = set()
+        self.reached = False
+        self.page_all_new = True
+        self.failed = False
+        self._known_run = 0
+
+    def fail(self):
+        """The search failed after observing cards it may not have returned; commit() skips it"""
+        self.failed = True
+
+    def new_page(self):
+        self.page_all_new = True
+        self._known_run = 0
+
+    def observe(self, listing_id):
+        """Record a card; returns True if the listing is already known"""
+        if listing_id in self._observed_ids:
+            # Nested wrappers can present one card twice - it must not extend the known run
+            return listing_id in self.known
+        self._observed_ids.add(listing_id)
+        self.observed.append(listing_id)
+        if listing_id not in self.known:
+            self._known_run = 0
+            return False
+        self.page_all_new = False
+        self._known_run += 1
+        if self._known_run >= self.stop_after:
+            self.reached = True
+        return True
+
+    @property
+    def want_next_page(self):
+        """Deeper pages are only worth fetching while every card so far was new"""
+        return self.page_all_new and not self.reached
+
+
+class WatermarkStore:
+    """Per-search watermarks kept in the bot's SQLite database (search_watermarks)
+
+    Each platform keeps its own IDs for a query, trimmed to the newest
+    ``keep`` separately.
+
+    Watermarks handed out during a cycle are only written back by
+    ``commit()``, which the bot calls after the cycle's listings have been
+    recorded - a failed cycle never advances a watermark past listings that
+    were not stored. Likewise a search that failed part-way (its watermark
+    marked ``fail()``) leaves its stored watermark as it was. Each search gets
+    one watermark per cycle: a retry, such as a Selenium fallback, replaces
+    the failed attempt's.
+    """
+
+    def __init__(self, conn, lock, keep=None, stop_after=None):
+        self.conn = conn
+        self.lock = lock
+        self.keep = int(keep if keep is not None else os.getenv('WATERMARK_KEEP', '100'))
+        self.stop_after = max(1, int(stop_after if stop_after is not None else os.getenv('WATERMARK_STOP_AFTER', '3')))
+        self._pending = {}  # (platform, query) -> this cycle's watermark
+        self._pending_lock = threading.Lock()
+        self._known = {}
+        self.load()
+
+    def load(self):
+        known = {}
+        with self.lock:
+            for platform, query, listing_id in self.conn.execute('SELECT platform, query, listing_id FROM search_watermarks'):
+                known.setdefault((platform, query), set()).add(listing_id)
+        self._known = {key: frozenset(ids) for key, ids in known.items()}
+
+    def get(self, platform, query):
+        """A fresh watermark for one search of ``query`` on ``platform`` this cycle"""
+        watermark = Watermark(platform, query, self._known.get((platform, query), frozenset()), self.stop_after)
+        with self._pending_lock:
+            self._pending[(platform, query)] = watermark
+        return watermark
+
+    def fail(self, platform, queries):
+        """Mark this cycle's watermarks for ``queries`` on ``platform`` failed (their searches raised)"""
+        with self._pending_lock:
+            for query in queries:
+                if (platform, query) in self._pending:
+                    self._pending[(platform, query)].fail()
+
+    def discard(self):
+        """Forget this cycle's observations (the scrape failed before its listings were stored)"""
+        with self._pending_lock:
+            self._pending = {}
+
+    def commit(self):
+        """Persist this cycle's observed IDs, keeping the newest ``keep`` per search"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        failed = [watermark.query for watermark in pending.values() if watermark.failed]
+        if failed:
+            logger.info(f"Keeping the previous watermarks of {len(failed)} failed searches")
+        rows = {}
+        for key, watermark in pending.items():
+            if watermark.failed:
+                continue
+            # Oldest first, so the newest card gets the highest id and survives trimming;
+            # re-observed IDs are re-inserted to keep a steady anchor from ageing out
+            rows[key] = list(reversed(watermark.observed))
+        if not rows:
+            return
+
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                for (platform, query), ids in rows.items():
+                    cursor.executemany(
+                        'INSERT OR REPLACE INTO search_watermarks (platform, query, listing_id) VALUES (?, ?, ?)',
+                        [(platform, query, listing_id) for listing_id in ids]
+                    )
+                    cursor.execute('''
+                        DELETE FROM search_watermarks WHERE platform = ? AND query = ? AND id NOT IN (
+                            SELECT id FROM search_watermarks WHERE platform = ? AND query = ? ORDER BY id DESC LIMIT ?
+                        )
+                    ''', (platform, query, platform, query, self.keep))
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+        self.load()
+        logger.info(f"Watermarks updated for {len(rows)} searches")